@@ -0,0 +1,200 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" File cache.py
+
+Last update: 17/10/2026
+
+Description:
+On-disk cache of preprocessed (cropped, background corrected and rescaled)
+stacks, see reconstruct.preprocess_images(). Entries are keyed by a hash of
+the raw frames and their index, the backgrounds, the crop offsets, the
+correction mode and the configuration fields the preprocessing depends on,
+so any change to them is a miss. Entries are stored as on-disk stacks (see
+stack.StackWriter) and the least recently used ones are removed once the
+cache exceeds its size, together with the files left by interrupted writes.
+
+Configuration fields:
+    preprocess_cache: use the cache from preprocess_images().
+    preprocess_cache_dir: cache folder, the per user ~/.cache/pyfpm (or
+                          $XDG_CACHE_HOME/pyfpm) if empty.
+    preprocess_cache_size: maximum size in MB.
+
+Usage:
+    cache = PreprocessCache.from_config(cfg)
+    key = cache.key(samples, backgrounds, xoff, yoff, cfg)
+    stack = cache.get(key)
+    if stack is None:
+        stack = cache.put(key, preprocess(...))
+"""
+__version__ = "1.1.1"
+__author__ = 'Juan M. Bujjamer'
+__all__ = ['PreprocessCache', 'CACHE_FIELDS', 'default_directory']
+
+import os
+import glob
+import json
+import time
+import hashlib
+import tempfile
+
+import numpy as np
+
+from .stack import as_stack, open_stack, stack_files, write_stack
+
+# Configuration fields used by the preprocessing
+CACHE_FIELDS = ['patch_size', 'phi', 'wavelength', 'objective_na',
+                'pixel_size']
+# Changes whenever the preprocessing itself changes, to invalidate entries
+CACHE_VERSION = 1
+# Entries are written under this prefix and renamed once complete
+PARTIAL_PREFIX = '.partial-'
+# Seconds after which an incomplete write is taken as interrupted
+PARTIAL_AGE = 3600
+
+
+def default_directory():
+    """ Per user cache folder, $XDG_CACHE_HOME/pyfpm or ~/.cache/pyfpm.
+    """
+    base = (os.environ.get('XDG_CACHE_HOME') or
+            os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'pyfpm')
+
+
+class PreprocessCache(object):
+    """ Size bounded, least recently used cache of preprocessed stacks.
+
+    Args:
+    -----
+        directory: cache folder (created if needed), default_directory()
+                   if not given.
+        max_size: maximum size of the cache, in MB.
+    """
+    def __init__(self, directory=None, max_size=2048):
+        if not directory:
+            directory = default_directory()
+        self.directory = directory
+        self.max_bytes = int(float(max_size)*1024**2)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @classmethod
+    def from_config(cls, cfg=None):
+        """ Cache from cfg.preprocess_cache_dir and cfg.preprocess_cache_size.
+        """
+        return cls(getattr(cfg, 'preprocess_cache_dir', None),
+                   getattr(cfg, 'preprocess_cache_size', None) or 2048)
+
+    def key(self, samples=None, backgrounds=None, xoff=None, yoff=None,
+            cfg=None, corr_mode='background'):
+        """ Hex digest identifying a preprocessing run.
+        """
+        digest = hashlib.sha256()
+        for stack in [samples, backgrounds]:
+            if stack is None:
+                digest.update(b'none')
+                continue
+            stack = as_stack(stack, cfg)
+            digest.update(np.ascontiguousarray(stack.index).tobytes())
+            digest.update(str(stack.images.dtype).encode())
+            digest.update(str(stack.images.shape).encode())
+            digest.update(memoryview(np.ascontiguousarray(stack.images)))
+        fields = dict((field, getattr(cfg, field, None))
+                      for field in CACHE_FIELDS)
+        settings = {'xoff': xoff, 'yoff': yoff, 'corr_mode': corr_mode,
+                    'cfg': fields, 'version': CACHE_VERSION}
+        digest.update(json.dumps(settings, sort_keys=True,
+                                 default=str).encode())
+        return digest.hexdigest()
+
+    def _entry(self, key=None):
+        return os.path.join(self.directory, key + '.npy')
+
+    def get(self, key=None):
+        """ The cached SampleStack, or None if missing. Hits are marked as
+        recently used.
+        """
+        entry = self._entry(key)
+        files = stack_files(entry)
+        if not all(os.path.exists(name) for name in files):
+            return None
+        for name in files:
+            os.utime(name, None)
+        stack = open_stack(entry)
+        return stack.load(stack.images.dtype)
+
+    def put(self, key=None, samples=None):
+        """ Stores a (normalised) SampleStack and evicts the least recently
+        used entries over the cache size. Returns samples.
+        """
+        handle, partial = tempfile.mkstemp(suffix='.npy', dir=self.directory,
+                                           prefix=PARTIAL_PREFIX)
+        os.close(handle)
+        write_stack(partial, samples, dtype=samples.images.dtype)
+        # Index last, so a complete entry is never missing its frames
+        for source, target in zip(stack_files(partial),
+                                  stack_files(self._entry(key))):
+            os.replace(source, target)
+        self.evict()
+        return samples
+
+    def entries(self):
+        """ (last use, size in bytes, key) of every entry, oldest first.
+        """
+        entries = list()
+        for index_file in glob.glob(os.path.join(self.directory,
+                                                 '*_index.npz')):
+            key = os.path.basename(index_file)[:-len('_index.npz')]
+            files = stack_files(self._entry(key))
+            if not os.path.exists(files[0]):
+                continue
+            size = sum(os.path.getsize(name) for name in files)
+            entries.append((os.path.getmtime(index_file), size, key))
+        return sorted(entries)
+
+    def orphans(self, age=PARTIAL_AGE):
+        """ Files left by writes interrupted more than age seconds ago:
+        partial entries and frames whose index was never moved in place.
+        """
+        now = time.time()
+        orphans = list()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not name.startswith(PARTIAL_PREFIX):
+                # Only entry frames without their index are left over
+                if (not name.endswith('.npy') or
+                        os.path.exists(stack_files(path)[1])):
+                    continue
+            try:
+                if now - os.path.getmtime(path) >= age:
+                    orphans.append(path)
+            except OSError:
+                continue  # removed meanwhile
+        return orphans
+
+    def evict(self):
+        """ Removes the files of interrupted writes and the least recently
+        used entries until the cache fits in its size.
+        """
+        for name in self.orphans():
+            try:
+                os.remove(name)
+            except OSError:
+                pass
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            for name in stack_files(self._entry(key)):
+                if os.path.exists(name):
+                    os.remove(name)
+            total -= size
+
+    def clear(self):
+        """ Removes every entry and the files of interrupted writes.
+        """
+        for _, _, key in self.entries():
+            for name in stack_files(self._entry(key)):
+                os.remove(name)
+        for name in self.orphans(age=0):
+            os.remove(name)
@@ -0,0 +1,231 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" File calibration.py
+
+Last update: 17/10/2026
+
+Description:
+LED position self-calibration inside the reconstruction. The illumination
+angles given by ct.n_to_krels() assume an ideal LED matrix (centered at
+[15, 15], led_gap apart and sample_height below the sample); every few
+passes the reconstruction refines them from its own estimate:
+    1. Per LED search: every LED window is moved by each integer shift in
+       a (2*radius + 1)**2 neighbourhood, the low resolution amplitudes of
+       all LEDs and shifts are computed at once (batched gathers and
+       inverse FFTs) and every LED takes the shift that best fits its
+       sample.
+    2. Global model: the matrix shift (sx, sy, in mm), rotation (radians)
+       and height (mm) are fitted by robust least squares to the refined
+       positions, with the same mapping n_to_krels() uses. The step is
+       scaled down so no LED moves further than the search radius.
+    3. Every LED is placed on the fitted model, plus its own deviation from
+       it up to tolerance spectrum pixels (0 keeps the matrix rigid).
+The search needs an estimate that already resembles the object, so it
+corrects windows misplaced by up to 2-3 spectrum pixels; larger errors
+need a coarse calibration of the geometry first. Moving every window by
+the same amount only adds a linear phase ramp to the object, so the
+fitted matrix shift is only known up to about a spectrum pixel.
+
+Usage:
+    calibration = LedCalibration.from_config(cfg)
+    calibration.step(plan, spectrum, pupil, images)  # updates plan windows
+    print(calibration.describe())
+    state = calibration.get_state()  # checkpoint entries, see set_state()
+"""
+__version__ = "1.1.1"
+__author__ = 'Juan M. Bujjamer'
+__all__ = ['LedCalibration', 'matrix_krels', 'window_search']
+
+import numpy as np
+from scipy import optimize
+
+from .fftbackend import ifft2
+
+
+def matrix_krels(params=None, nxy=None, cfg=None, xoff=0, yoff=0):
+    """ Relative k of the LEDs (nx, ny) of a shifted, rotated matrix at the
+    given height, following ct.n_to_krels() (which is the [0, 0, 0,
+    sample_height] case).
+
+    Args:
+    -----
+        params: [sx, sy, rotation, height] (mm, mm, radians, mm).
+        nxy: (n, 2) LED matrix indexes.
+        cfg: configuration (named tuple), for the LED gap.
+        xoff, yoff: offsets of the plan (see ReconstructionPlan).
+
+    Returns:
+    --------
+        (ndarray) (n, 2) [kx_rel, ky_rel].
+    """
+    sx, sy, rotation, height = params
+    led_gap = float(cfg.led_gap)
+    mat_center = np.array([15, 15]) - np.array([xoff, yoff])
+    u = (nxy[:, 0] - mat_center[0])*led_gap
+    v = (nxy[:, 1] - mat_center[1])*led_gap
+    x = np.cos(rotation)*u - np.sin(rotation)*v + sx
+    y = np.sin(rotation)*u + np.cos(rotation)*v + sy
+    return np.stack([np.sin(np.arctan(x/height)),
+                     np.sin(np.arctan(y/height))], axis=-1)
+
+
+def window_search(plan=None, spectrum=None, pupil=None, images=None,
+                  radius=1):
+    """ Best integer shift of every LED window, from a batched forward model
+    of every candidate shift.
+
+    Args:
+    -----
+        plan: the ReconstructionPlan (current windows).
+        spectrum: the centered high resolution spectrum estimate.
+        pupil: centered (lrsize, lrsize) pupil.
+        images: (n_leds, lrsize, lrsize) samples in plan order.
+        radius: largest shift tried, in spectrum pixels.
+
+    Returns:
+    --------
+        (ndarray) (n_leds, 2) [dy, dx] shifts.
+    """
+    lrsize = plan.lrsize
+    span = np.arange(lrsize)
+    flat = np.ascontiguousarray(spectrum).ravel()
+    scaled_pupil = plan.factor*pupil
+    candidates = [(dy, dx) for dy in range(-radius, radius + 1)
+                  for dx in range(-radius, radius + 1)]
+    errors = np.empty((len(candidates), len(plan)))
+    for n, (dy, dx) in enumerate(candidates):
+        # Windows kept inside the spectrum
+        kyl = np.clip(plan.kyl + dy, 0, plan.hrshape[0] - lrsize)
+        kxl = np.clip(plan.kxl + dx, 0, plan.hrshape[1] - lrsize)
+        rows = kyl[:, np.newaxis, np.newaxis] + span[np.newaxis, :, np.newaxis]
+        cols = kxl[:, np.newaxis, np.newaxis] + span[np.newaxis, np.newaxis, :]
+        windows = flat[rows*plan.hrshape[1] + cols]*scaled_pupil
+        amplitudes = np.abs(ifft2(windows, axes=(-2, -1)))
+        errors[n] = np.sum((amplitudes - images)**2, axis=(1, 2))
+        moved = (kyl != plan.kyl + dy) | (kxl != plan.kxl + dx)
+        errors[n, moved] = np.inf
+    return np.array(candidates)[np.argmin(errors, axis=0)]
+
+
+class LedCalibration(object):
+    """ In loop LED position calibration (see the module description).
+
+    Args:
+    -----
+        every: passes between calibration steps.
+        radius: per LED search radius, in spectrum pixels.
+        tolerance: largest deviation of an LED from the global model, in
+                   spectrum pixels.
+        patience: the calibration stops after this many steps in a row
+                  without moving any window.
+        cfg: configuration (named tuple), for the ideal geometry.
+    """
+    def __init__(self, every=1, radius=1, tolerance=0., patience=2,
+                 cfg=None):
+        self.every = int(every)
+        self.radius = int(radius)
+        self.tolerance = float(tolerance)
+        self.patience = int(patience)
+        self.cfg = cfg
+        self.params = np.array([0., 0., 0., float(cfg.sample_height)])
+        self.steps = 0
+        self.settled = 0
+        self.residual = None
+
+    @classmethod
+    def from_config(cls, cfg=None, **kwargs):
+        """ Calibration from cfg.led_calibration_every,
+        cfg.led_calibration_radius and cfg.led_calibration_tolerance.
+        Keyword arguments take precedence.
+        """
+        settings = {'every': getattr(cfg, 'led_calibration_every', 0),
+                    'radius': getattr(cfg, 'led_calibration_radius', 1),
+                    'tolerance': getattr(cfg, 'led_calibration_tolerance',
+                                         0.)}
+        settings.update((key, value) for key, value in kwargs.items()
+                        if value is not None)
+        return cls(cfg=cfg, **settings)
+
+    def due(self, iteration=0):
+        """ True after every 'every' passes (counted from 1), until the
+        windows settle.
+        """
+        return (self.every > 0 and self.settled < self.patience and
+                (iteration + 1) % self.every == 0)
+
+    def step(self, plan=None, spectrum=None, pupil=None, images=None):
+        """ Refines the LED positions of plan (its krels and windows are
+        replaced, not modified in place).
+
+        Args:
+        -----
+            plan: the ReconstructionPlan.
+            spectrum: the centered high resolution spectrum estimate.
+            pupil: centered (lrsize, lrsize) pupil.
+            images: (n_leds, lrsize, lrsize) samples in plan order.
+
+        Returns:
+        --------
+            (int) number of LEDs whose window moved.
+        """
+        shifts = window_search(plan, spectrum, pupil, images, self.radius)
+        kdsc = plan.kdsc
+        measured = plan.krels + shifts[:, ::-1]/kdsc
+        nxy = np.array(plan.keys, dtype=np.float64).reshape(-1, 2)
+
+        def residuals(params):
+            model = matrix_krels(params, nxy, self.cfg, plan.xoff, plan.yoff)
+            return kdsc*(model - measured).ravel()
+        fit = optimize.least_squares(residuals, self.params, loss='soft_l1',
+                                     x_scale=[1., 1., .01, 10.])
+        # Trust region: no LED moves further than the search radius
+        model = matrix_krels(fit.x, nxy, self.cfg, plan.xoff, plan.yoff)
+        largest = kdsc*np.max(np.abs(model - plan.krels))
+        fraction = min(1., self.radius/largest) if largest > 0 else 1.
+        params = self.params + fraction*(fit.x - self.params)
+        model = matrix_krels(params, nxy, self.cfg, plan.xoff, plan.yoff)
+        deviation = np.clip(kdsc*(measured - model), -self.tolerance,
+                            self.tolerance)
+        self.residual = float(np.sqrt(np.mean(fit.fun**2)))
+        self.steps += 1
+        krels = model + deviation/kdsc
+        if np.any(plan.window_corners(krels)[2]):
+            # Windows pushed off the spectrum, the geometry is kept
+            self.settled += 1
+            return 0
+        self.params = params
+        kyl, kxl = plan.kyl, plan.kxl
+        plan.krels = krels
+        plan.compute_windows()
+        moved = int(np.count_nonzero((plan.kyl != kyl) | (plan.kxl != kxl)))
+        self.settled = 0 if moved else self.settled + 1
+        return moved
+
+    def get_state(self):
+        """ Checkpoint entries: the fitted model, the step counters and the
+        last residual (nan before the first step).
+        """
+        residual = np.nan if self.residual is None else self.residual
+        return {'calibration_params': self.params,
+                'calibration_steps': self.steps,
+                'calibration_settled': self.settled,
+                'calibration_residual': residual}
+
+    def set_state(self, state):
+        """ Restores get_state(), the calibration goes on from the model
+        fitted before the checkpoint.
+        """
+        self.params = np.array(state['calibration_params'], dtype=np.float64)
+        self.steps = int(state['calibration_steps'])
+        self.settled = int(state['calibration_settled'])
+        residual = float(state['calibration_residual'])
+        self.residual = None if np.isnan(residual) else residual
+
+    def describe(self):
+        """ Run metadata of the calibration.
+        """
+        sx, sy, rotation, height = self.params
+        return {'led_calibration': {
+            'steps': self.steps, 'shift': [float(sx), float(sy)],
+            'rotation': float(np.degrees(rotation)), 'height': float(height),
+            'rms_residual': self.residual}}
@@ -0,0 +1,113 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" File checkpoint.py
+
+Last update: 17/10/2026
+
+Description:
+Checkpoints of a running reconstruction: the spectrum, the pupil, the
+iteration counter, the LED cursor inside the iteration and the error history,
+stored in a single compressed .npz file. Writes are done by a background
+thread; the reconstruction only copies the arrays and goes on (a snapshot
+still being written is replaced by the newest one, never queued).
+
+Usage:
+    checkpointer = Checkpointer('run.npz', every=len(plan))
+    ...
+    checkpointer.step(state_function)  # after every LED update
+    checkpointer.close()
+    state = load_checkpoint('run.npz')
+"""
+__version__ = "1.1.1"
+__author__ = 'Juan M. Bujjamer'
+__all__ = ['Checkpointer', 'load_checkpoint']
+
+import os
+import threading
+
+import numpy as np
+
+
+class Checkpointer(object):
+    """ Periodic asynchronous checkpoint writer.
+
+    Args:
+    -----
+        filename: output file (.npz is appended). It is replaced atomically
+                  on every write, so a crash while writing keeps the
+                  previous checkpoint.
+        every: number of LED updates between checkpoints.
+    """
+    def __init__(self, filename=None, every=None):
+        self.filename = os.path.splitext(filename)[0] + '.npz'
+        self.every = max(int(every), 1)
+        self.count = 0
+        self.written = 0
+        self._pending = None
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._writer, daemon=True)
+        self._thread.start()
+
+    def step(self, get_state):
+        """ Counts an LED update and, every 'every' updates, takes a
+        snapshot. get_state is only called when a snapshot is due and must
+        return a dictionary of arrays; they are copied here.
+        """
+        self.count += 1
+        if self.count % self.every:
+            return
+        self.save(get_state())
+
+    def save(self, state):
+        """ Queues a snapshot of state for writing (without blocking).
+        """
+        snapshot = dict((key, np.array(value)) for key, value in state.items())
+        with self._lock:
+            self._pending = snapshot
+        self._ready.set()
+
+    def _writer(self):
+        while True:
+            self._ready.wait()
+            with self._lock:
+                snapshot, self._pending = self._pending, None
+                self._ready.clear()
+            if snapshot is not None:
+                self._write(snapshot)
+            with self._lock:
+                if self._closed and self._pending is None:
+                    return
+
+    def _write(self, snapshot):
+        tmpname = os.path.splitext(self.filename)[0] + '.tmp.npz'
+        np.savez_compressed(tmpname, **snapshot)
+        os.replace(tmpname, self.filename)
+        self.written += 1
+
+    def close(self):
+        """ Writes the last pending snapshot and stops the writer thread.
+        """
+        self._closed = True
+        self._ready.set()
+        self._thread.join()
+
+
+def load_checkpoint(filename):
+    """ Loads a checkpoint written by a Checkpointer.
+
+    Returns:
+    --------
+        (dict) spectrum, pupil, iteration, cursor, error (partial error of
+        the iteration in course), errors and times (history), krels, the
+        solver method, the solver_* state of the accelerated methods and the
+        calibration_* state of the LED calibration.
+    """
+    filename = os.path.splitext(filename)[0] + '.npz'
+    with np.load(filename) as data:
+        state = dict((key, data[key]) for key in data.files)
+    for key in ['iteration', 'cursor']:
+        state[key] = int(state[key])
+    state['error'] = float(state['error'])
+    return state
@@ -0,0 +1,151 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" File convergence.py
+
+Last update: 17/10/2026
+
+Description:
+Convergence monitoring for the reconstruction loops. The error of every
+iteration is the relative amplitude residual between the measured samples
+and the low resolution estimates, accumulated by the update itself (no
+extra transforms). A StoppingRule decides when to end the run and the
+result is returned as a ReconstructionResult.
+
+Usage:
+    rule = StoppingRule.from_config(cfg)
+    for iteration in range(rule.max_iter):
+        ...
+        if rule.update(error):
+            break
+    result = ReconstructionResult(im_out, rule)
+    mag, phase = result
+"""
+__version__ = "1.1.1"
+__author__ = 'Juan M. Bujjamer'
+__all__ = ['StoppingRule', 'ReconstructionResult']
+
+import time
+
+import numpy as np
+
+
+class StoppingRule(object):
+    """ Ends a reconstruction when the error stops improving, when the time
+    budget is exhausted or after max_iter iterations.
+
+    Args:
+    -----
+        max_iter: maximum number of iterations.
+        tolerance: minimum relative improvement of the best error for an
+                   iteration to count as progress. 0 never stops early.
+        patience: consecutive iterations without progress before stopping.
+        max_time: wall time budget in seconds. None (or 0) disables it.
+    """
+    def __init__(self, max_iter=20, tolerance=0., patience=1, max_time=None):
+        self.max_iter = int(max_iter)
+        self.tolerance = float(tolerance)
+        self.patience = max(int(patience), 1)
+        self.max_time = max_time
+        self.reset()
+
+    @classmethod
+    def from_config(cls, cfg=None, **kwargs):
+        """ Rule from the configuration fields n_iter, stop_tolerance,
+        stop_patience and stop_max_time. Keyword arguments take precedence.
+        """
+        settings = {'max_iter': getattr(cfg, 'n_iter', 20),
+                    'tolerance': getattr(cfg, 'stop_tolerance', 0.),
+                    'patience': getattr(cfg, 'stop_patience', 1),
+                    'max_time': getattr(cfg, 'stop_max_time', None)}
+        settings.update((key, value) for key, value in kwargs.items()
+                        if value is not None)
+        return cls(**settings)
+
+    def reset(self):
+        """ Clears the history and restarts the clock.
+        """
+        self.errors = list()
+        self.times = list()
+        self.best = np.inf
+        self.stalled = 0
+        self.reason = None
+        self.start_time = time.time()
+
+    def restore(self, errors=(), times=()):
+        """ Continues a previous run (see checkpoint.py) with its history.
+        The clock keeps counting from the last recorded time.
+        """
+        self.reset()
+        self.errors = [float(error) for error in errors]
+        self.times = [float(elapsed) for elapsed in times]
+        for error in self.errors:
+            self._track(error)
+        if self.times:
+            self.start_time -= self.times[-1]
+
+    def _track(self, error):
+        """ Counts the iterations without progress.
+        """
+        if error < self.best*(1 - self.tolerance):
+            self.stalled = 0
+        else:
+            self.stalled += 1
+        self.best = min(self.best, error)
+
+    def update(self, error):
+        """ Records the error of the last iteration.
+
+        Returns:
+        --------
+            (bool) True if the reconstruction should stop.
+        """
+        error = float(error)
+        self.errors.append(error)
+        self.times.append(time.time() - self.start_time)
+        if not np.isfinite(error):
+            self.reason = 'diverged'
+            return True
+        self._track(error)
+        if self.tolerance > 0 and self.stalled >= self.patience:
+            self.reason = 'converged'
+        elif self.max_time and self.times[-1] >= float(self.max_time):
+            self.reason = 'max_time'
+        elif len(self.errors) >= self.max_iter:
+            self.reason = 'max_iter'
+        return self.reason is not None
+
+
+class ReconstructionResult(object):
+    """ Outcome of a reconstruction. It unpacks as (modulus, phase), so
+    callers expecting the two arrays keep working.
+
+    Attributes:
+    -----------
+        modulus, phase: the reconstructed image.
+        spectrum: the (centered) high resolution spectrum.
+        pupil: the pupil used (or recovered).
+        errors: relative amplitude residual of every iteration.
+        times: elapsed wall time at the end of every iteration.
+        iterations: number of iterations run.
+        stop_reason: 'converged', 'max_time', 'max_iter' or 'diverged'.
+        metadata: settings of the run (update rule, LED ordering...), to be
+                  saved with the result (see data.save_yaml_metadata()).
+    """
+    def __init__(self, field=None, rule=None, spectrum=None, pupil=None):
+        self.modulus = np.abs(field)
+        self.phase = np.angle(field)
+        self.spectrum = spectrum
+        self.pupil = pupil
+        self.errors = np.array(rule.errors)
+        self.times = np.array(rule.times)
+        self.iterations = len(rule.errors)
+        self.stop_reason = rule.reason
+        self.metadata = dict()
+
+    def __iter__(self):
+        return iter((self.modulus, self.phase))
+
+    def __repr__(self):
+        final = self.errors[-1] if self.iterations else np.nan
+        return ('ReconstructionResult(iterations=%d, error=%.4e, stop=%s)' %
+                (self.iterations, final, self.stop_reason))
@@ -10,7 +10,8 @@ Usage:
 """
 __version__ = "1.1.1"
 __author__ = 'Juan M. Bujjamer'
-__all__ = ['get_acquisition_pars', 'set_iterator', 'tidy', 'phi_rot']
+__all__ = ['get_acquisition_pars', 'set_iterator', 'multiplex_iterator',
+           'encode_pattern', 'decode_pattern', 'tidy', 'phi_rot']
 
 import yaml
 import numpy as np
@@ -261,6 +262,58 @@ def set_iterator(cfg=None):
             index += 1
 
 
+def multiplex_iterator(cfg=None, n_leds=None):
+    """ Groups the LEDs of set_iterator(cfg) into patterns lit together, so
+    every exposure takes n_leds LEDs. LEDs are grouped inside each square
+    ring of the matrix (similar brightness) and spread evenly around it, so
+    their spectrum windows overlap as little as possible.
+
+    Args:
+        cfg (named tuple): configuration, its sweep must be one of the
+                           led_matrix iterators.
+        n_leds (int): LEDs per pattern, taken from cfg.multiplex if not
+                      given.
+
+    Yields:
+        (dict) {'indexes': tuple of the (nx, ny) LEDs, used as sample key,
+                'pattern': list of (nx, ny), 'acqpars': acquisition
+                parameters with the shortest shutter of the pattern}
+    """
+    if n_leds is None:
+        n_leds = getattr(cfg, 'multiplex', 1)
+    n_leds = max(1, int(n_leds))
+    xc, yc = image_center([int(cfg.matsize)-1, int(cfg.matsize)-1])
+    rings = dict()
+    for it in set_iterator(cfg):
+        nx, ny = it['indexes']
+        ring = max(abs(nx-xc), abs(ny-yc))
+        rings.setdefault(ring, list()).append(it)
+    for ring in sorted(rings):
+        leds = rings[ring]
+        n_patterns = int(np.ceil(len(leds)/float(n_leds)))
+        for first in range(n_patterns):
+            group = leds[first::n_patterns]
+            pattern = [tuple(int(n) for n in it['indexes']) for it in group]
+            # The shortest exposure keeps every LED out of saturation
+            acqpars = min((it['acqpars'] for it in group),
+                          key=lambda pars: pars[1])
+            yield {'indexes': tuple(pattern), 'pattern': pattern,
+                   'acqpars': acqpars}
+
+
+def encode_pattern(pattern=None):
+    """ URL friendly string of a list of (nx, ny) LEDs, e.g. '15-15_11-15'.
+    """
+    return '_'.join('%d-%d' % (int(nx), int(ny)) for nx, ny in pattern)
+
+
+def decode_pattern(text=None):
+    """ List of (nx, ny) LEDs from its encode_pattern() string.
+    """
+    return [tuple(int(n) for n in led.split('-'))
+            for led in str(text).split('_') if led]
+
+
 def tidy(number):
     """ Rounding function to work under mechanical precission.
     """
@@ -437,7 +490,7 @@ def spot_image(source_position, light_dir, radius=20, color='r'):
     image[:, :] = image_gray[0]
     return image
 
-def n_to_krels(it, cfg, xoff, yoff):
+def n_to_krels(it, cfg, xoff=0, yoff=0):
     """ .
 
     Parameters:
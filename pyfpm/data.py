@@ -16,10 +16,14 @@ CONFIG_FILE = os.path.join(HOME_FOLDER, "etc/config.yaml")
 OUT_SIMULATION = os.path.join(HOME_FOLDER, "out_simulation")
 OUT_SAMLPING = os.path.join(HOME_FOLDER, "out_sampling")
 
-def save_yaml_metadata(outname, cfg):
+def save_yaml_metadata(outname, cfg, **metadata):
+    """ Saves the configuration (and any additional run metadata, e.g.
+    ReconstructionResult.metadata) next to outname, as yaml.
+    """
     base = os.path.splitext(outname)[0]
     outname = base + '.yaml'
     out_dict = cfg._asdict()
+    out_dict.update(metadata)
     timestamp = '{:%Y-%m-%d %H%M%S}'.format(datetime.datetime.now())
     out_dict['timestamp'] = timestamp
     with open(outname, 'w') as outfile:
@@ -29,6 +33,13 @@ def save_yaml_metadata(outname, cfg):
 
 def load_config():
     config_dict = yaml.load(open(CONFIG_FILE, 'r'))
+    return config_from_dict(config_dict)
+
+
+def config_from_dict(config_dict):
+    """ Configuration named tuple from a dictionary. Used to rebuild the
+    configuration on worker processes (the named tuple is not picklable).
+    """
     config = collections.namedtuple('config', config_dict.keys())
     cfg = config(*config_dict.values())
     return cfg
@@ -65,7 +76,36 @@ def iter_dict(image_dict):
         yield theta, phi, power, img
 
 
-def open_sampled(filename, mode='sampling'):
+def save_pupil(filename, pupil, cfg=None, **metadata):
+    """ Saves a (recovered) pupil, together with the optical parameters it
+    was obtained with, so later datasets on the same optics can start from
+    it.
+    """
+    if cfg is not None:
+        for field in ['wavelength', 'pixel_size', 'x', 'na', 'objective_na']:
+            metadata.setdefault(field, getattr(cfg, field, None))
+    metadata['timestamp'] = '{:%Y-%m-%d %H%M%S}'.format(datetime.datetime.now())
+    np.savez(filename, pupil=pupil, metadata=json.dumps(metadata))
+    return
+
+
+def load_pupil(filename):
+    """ Loads a pupil saved by save_pupil().
+
+    Returns the pupil and a dictionary with its metadata.
+    """
+    with np.load(filename) as data:
+        pupil = data['pupil']
+        metadata = json.loads(str(data['metadata']))
+    return pupil, metadata
+
+
+def open_sampled(filename, mode='sampling', as_stack=False, mapped=False):
+    """ Loads a sampled set and its metadata. With as_stack=True the legacy
+    dictionary is converted into a normalised SampleStack. With mapped=True
+    filename is an on-disk stack (see stack.StackWriter), opened as a
+    memory mapped MappedStack without reading the frames.
+    """
     if mode == 'sampling':
         datafile = os.path.join(OUT_SAMLPING, filename)
     if mode == 'simulation':
@@ -74,4 +114,11 @@ def open_sampled(filename, mode='sampling'):
     config_dict = yaml.load(open(configfile, 'r'))
     config = collections.namedtuple('config', config_dict.keys())
     file_cfg = config(*config_dict.values())
-    return np.load(datafile, encoding='bytes')[()], file_cfg
+    if mapped:
+        from pyfpm.stack import open_stack
+        return open_stack(datafile), file_cfg
+    samples = np.load(datafile, encoding='bytes')[()]
+    if as_stack:
+        from pyfpm.stack import SampleStack
+        samples = SampleStack.from_dict(samples, file_cfg)
+    return samples, file_cfg
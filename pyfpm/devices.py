@@ -51,14 +51,19 @@ class LedMatrixRGB(object):
         print('doit')
 
     def set_pixel(self, x, y, power, color):
+        self.set_pattern([(x, y)], power, color)
+
+    def set_pattern(self, pattern, power, color):
+        """ Lights every (nx, ny) LED of pattern at once (multiplexed
+        illumination), turning off the rest.
+        """
         self.matrix.Clear()
-        nx, ny, power = int(x), int(y), int(power)
-        if color == 'R':
-            self.matrix.SetPixel(nx, ny, power, 0, 0)
-        if color == 'G':
-            self.matrix.SetPixel(nx, ny, 0, power, 0)
-        if color == 'B':
-            self.matrix.SetPixel(nx, ny, 0, 0, power)
+        power = int(power)
+        rgb = {'R': (power, 0, 0), 'G': (0, power, 0), 'B': (0, 0, power)}
+        if color not in rgb:
+            return
+        for x, y in pattern:
+            self.matrix.SetPixel(int(x), int(y), *rgb[color])
 
     def __del__(self):
         print('Goodbye')
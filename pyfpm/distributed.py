@@ -0,0 +1,403 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" File distributed.py
+
+Last update: 17/10/2026
+
+Description:
+Coordinator/worker tiled reconstruction. The coordinator serves a job queue
+and a result queue (multiprocessing.managers, over a TCP socket with an
+authentication key); every job is a (tile, origin, LED offsets, plan id)
+tuple and the plan settings (configuration, grid sizes, stack file...) are
+fetched once per plan id. Workers map the shared on-disk stack (see
+stack.StackWriter), crop the patch of every tile they take and stream the
+reconstructed tile back, where it is blended into the mosaic as it arrives.
+
+A tile is queued again if its worker reports an error or does not finish
+it within lease_timeout seconds of taking it (e.g. the worker died), up to
+max_retries times. Late duplicates of a re-queued tile are ignored.
+
+The manager connections exchange pickles, so anyone holding the
+authentication key can run code in the coordinator. There is no default
+key: it is read (hex encoded) from the PYFPM_AUTHKEY environment variable
+or from a key file readable only by its owner (load_authkey()). Without
+either a random key is written to the key file, in the per user cache
+folder by default. The key never goes on a command line or to stdout, the
+coordinator only prints its address.
+
+Workers can be local processes (workers=n) or remote ones, started on any
+machine that sees the stack file with PYFPM_AUTHKEY set or the key file
+copied:
+    python -m pyfpm.distributed host:port [key file]
+
+Usage:
+    mag, phase = reconstruct_distributed('/data/stack.npy', cfg, kdsc,
+                                         pupil_radius, upsampling=3,
+                                         workers=4)
+"""
+__version__ = "1.1.1"
+__author__ = 'Juan M. Bujjamer'
+__all__ = ['TileCoordinator', 'run_worker', 'reconstruct_distributed',
+           'load_authkey', 'write_authkey', 'default_key_file',
+           'AUTHKEY_VARIABLE']
+
+import os
+import sys
+import stat
+import time
+import queue
+import socket
+import threading
+import traceback
+import multiprocessing
+from multiprocessing.managers import BaseManager
+
+import numpy as np
+
+from . import tiling
+from .cache import default_directory
+from .stack import MappedStack, open_stack
+
+AUTHKEY_VARIABLE = 'PYFPM_AUTHKEY'
+KEY_FILE_NAME = 'distributed_authkey'
+
+
+class _PlanRegistry(object):
+    """ Plan settings by plan id, served to the workers.
+    """
+    def __init__(self):
+        self.plans = dict()
+
+    def get(self, plan_id):
+        return self.plans[plan_id]
+
+
+class _CoordinatorManager(BaseManager):
+    pass
+
+
+class _WorkerManager(BaseManager):
+    pass
+
+
+for _name in ['get_jobs', 'get_results', 'get_plans', 'get_done']:
+    _WorkerManager.register(_name)
+
+
+def _parse_address(address=None):
+    """ (host, port) from a 'host:port' string or a sequence.
+    """
+    if isinstance(address, str):
+        host, port = address.rsplit(':', 1)
+        return host, int(port)
+    return address[0], int(address[1])
+
+
+def default_key_file():
+    """ Authentication key file in the per user cache folder.
+    """
+    return os.path.join(default_directory(), KEY_FILE_NAME)
+
+
+def load_authkey(key_file=None):
+    """ Authentication key (bytes) from the PYFPM_AUTHKEY environment
+    variable or, if it is not set, from key_file (default_key_file() if not
+    given), both hex encoded. None if there is neither. A key file that
+    other users can read or write raises a ValueError.
+    """
+    key = os.environ.get(AUTHKEY_VARIABLE)
+    if key:
+        return bytes.fromhex(key.strip())
+    if not key_file:
+        key_file = default_key_file()
+    if not os.path.exists(key_file):
+        return None
+    if os.stat(key_file).st_mode & (stat.S_IRWXG | stat.S_IRWXO):
+        raise ValueError("The key file %s is accessible by other users, "
+                         "restrict it with chmod 600." % key_file)
+    with open(key_file) as key_handle:
+        return bytes.fromhex(key_handle.read().strip())
+
+
+def write_authkey(authkey=None, key_file=None):
+    """ Writes authkey (bytes, hex encoded) to key_file (default_key_file()
+    if not given), readable only by its owner. Returns the file name.
+    """
+    if not key_file:
+        key_file = default_key_file()
+    directory = os.path.dirname(os.path.abspath(key_file))
+    os.makedirs(directory, exist_ok=True)
+    descriptor = os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                         0o600)
+    # The mode is only applied on creation
+    os.fchmod(descriptor, 0o600)
+    with os.fdopen(descriptor, 'w') as key_handle:
+        key_handle.write(authkey.hex())
+    return key_file
+
+
+class TileCoordinator(object):
+    """ Serves tile jobs to the workers and collects their results.
+
+    Args:
+    -----
+        address: (host, port) to listen on. Port 0 takes a free one, the
+                 bound address is in self.address.
+        authkey: authentication key (bytes) shared with the workers, a
+                 random 32 byte one if not given (see self.authkey).
+        lease_timeout: seconds a worker has to finish a tile it took.
+        max_retries: times a failed (or expired) tile is queued again.
+    """
+    def __init__(self, address=('127.0.0.1', 0), authkey=None,
+                 lease_timeout=600., max_retries=3):
+        if not authkey:
+            authkey = os.urandom(32)
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.registry = _PlanRegistry()
+        self.done = threading.Event()
+        self.lease_timeout = float(lease_timeout)
+        self.max_retries = int(max_retries)
+        self.authkey = authkey
+        manager = _CoordinatorManager(address=_parse_address(address),
+                                      authkey=authkey)
+        manager.register('get_jobs', callable=lambda: self.jobs)
+        manager.register('get_results', callable=lambda: self.results)
+        manager.register('get_plans', callable=lambda: self.registry)
+        manager.register('get_done', callable=lambda: self.done)
+        self.server = manager.get_server()
+        self.address = self.server.address
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        self.plan_count = 0
+
+    def add_plan(self, settings=None):
+        """ Registers the settings of a tiled run (see tiling._init_worker)
+        and returns its plan id.
+        """
+        plan_id = self.plan_count
+        self.registry.plans[plan_id] = settings
+        self.plan_count += 1
+        return plan_id
+
+    def run(self, plan_id=None, origins=None, offsets=None, callback=None):
+        """ Queues one job per tile and waits for every result.
+
+        Args:
+        -----
+            plan_id: id returned by add_plan().
+            origins: [row, col] low resolution origin of every tile.
+            offsets: (xoff, yoff) LED matrix offsets of every tile.
+            callback: called as callback(origin, magnitude, phase) for every
+                      tile, as it arrives.
+
+        Returns:
+        --------
+            (dict) number of attempts of every tile.
+        """
+        attempts = dict()
+        leases = dict()
+        jobs = dict()
+        for tile, (origin, offset) in enumerate(zip(origins, offsets)):
+            jobs[tile] = (tile, list(origin), tuple(offset), plan_id)
+            attempts[tile] = 1
+            self.jobs.put(jobs[tile])
+        pending = set(jobs)
+        # Last time every tile was queued or leased
+        stamps = dict.fromkeys(jobs, time.time())
+        while pending:
+            try:
+                message = self.results.get(timeout=1.)
+            except queue.Empty:
+                message = None
+            if message is not None:
+                kind, tile = message[0], message[1]
+                if tile not in pending:
+                    continue
+                if kind == 'started':
+                    leases[tile] = stamps[tile] = time.time()
+                elif kind == 'done':
+                    pending.discard(tile)
+                    leases.pop(tile, None)
+                    callback(*message[2:])
+                elif kind == 'failed':
+                    print('Tile %d failed:\n%s' % (tile, message[2]))
+                    leases.pop(tile, None)
+                    self._requeue(jobs[tile], attempts)
+                    stamps[tile] = time.time()
+            # Leased tiles, and tiles taken from an empty queue without a
+            # lease (the worker died before starting), that went silent
+            now = time.time()
+            taken = self.jobs.empty()
+            for tile in list(pending):
+                if tile not in leases and not taken:
+                    continue
+                if now - stamps[tile] > self.lease_timeout:
+                    print('Tile %d lease expired' % tile)
+                    leases.pop(tile, None)
+                    self._requeue(jobs[tile], attempts)
+                    stamps[tile] = now
+        return attempts
+
+    def _requeue(self, job=None, attempts=None):
+        tile = job[0]
+        if attempts[tile] > self.max_retries:
+            raise RuntimeError("Tile %d at %s failed %d times."
+                               % (tile, job[1], attempts[tile]))
+        attempts[tile] += 1
+        self.jobs.put(job)
+
+    def finish(self):
+        """ Tells the workers there are no more jobs, they exit on their
+        next poll.
+        """
+        self.done.set()
+
+    def close(self):
+        """ Stops serving (workers still connected exit on the lost
+        connection).
+        """
+        self.done.set()
+        self.server.stop_event.set()
+        self.server.listener.close()
+
+
+def run_worker(address=None, authkey=None, poll=1., key_file=None):
+    """ Takes tile jobs from the coordinator at address, authenticated with
+    its authkey (bytes, load_authkey(key_file) if not given), until it
+    closes. The stack file of every plan must be readable by the worker.
+    """
+    if not authkey:
+        authkey = load_authkey(key_file)
+    if not authkey:
+        raise ValueError("The authentication key of the coordinator is "
+                         "required, set %s or give its key file." %
+                         AUTHKEY_VARIABLE)
+    manager = _WorkerManager(address=_parse_address(address),
+                             authkey=authkey)
+    manager.connect()
+    jobs, results = manager.get_jobs(), manager.get_results()
+    plans, done = manager.get_plans(), manager.get_done()
+    plan_id = None
+    while True:
+        try:
+            job = jobs.get(timeout=poll)
+        except queue.Empty:
+            try:
+                if done.is_set():
+                    return
+            except (EOFError, OSError):
+                return
+            continue
+        except (EOFError, OSError):
+            return
+        tile, origin, offsets, job_plan = job
+        results.put(('started', tile))
+        try:
+            if job_plan != plan_id:
+                tiling._shared.clear()
+                tiling._init_worker(plans.get(job_plan))
+                plan_id = job_plan
+            origin, magnitude, phase = tiling._reconstruct_tile(origin,
+                                                                offsets)
+            results.put(('done', tile, origin, magnitude, phase))
+        except Exception:
+            results.put(('failed', tile, traceback.format_exc()))
+
+
+def reconstruct_distributed(samples=None, cfg=None, kdsc=None,
+                            pupil_radius=None, upsampling=None, overlap=32,
+                            patch_size=None, workers=None, precision=None,
+                            address=('127.0.0.1', 0), authkey=None,
+                            lease_timeout=600., max_retries=3,
+                            mosaic_file=None, key_file=None):
+    """ Tiled reconstruction (see tiling.reconstruct_tiled()) by workers
+    of a TileCoordinator.
+
+    Args:
+    -----
+        samples: an on-disk MappedStack, or its file name. It has to be
+                 readable by every worker under the same path.
+        cfg, kdsc, pupil_radius, upsampling, overlap, patch_size, precision,
+        mosaic_file: see tiling.reconstruct_tiled().
+        workers: number of local worker processes to start. With 0 the
+                 tiles wait for remote workers (see run_worker()).
+        address: (host, port) the coordinator listens on, use ('', port)
+                 to accept remote workers.
+        authkey: authentication key (bytes) shared with the workers,
+                 load_authkey(key_file) if not given. Without one a random
+                 key is written to key_file for the remote workers.
+        lease_timeout, max_retries: see TileCoordinator.
+        key_file: authentication key file, default_key_file() if not
+                  given.
+
+    Returns:
+    --------
+        (ndarray) The blended high resolution modulus and phase.
+    """
+    if not isinstance(samples, MappedStack):
+        samples = open_stack(samples)
+    if patch_size is None:
+        patch_size = [int(p) for p in cfg.patch_size]
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    upsampling = int(upsampling)
+    hrshape = [upsampling*patch_size[0], upsampling*patch_size[1]]
+    sensor_shape = samples.shape[1:]
+    origins = tiling.tile_grid(sensor_shape, patch_size, overlap)
+    offsets = [tiling.tile_offsets(origin, patch_size, sensor_shape, cfg)
+               for origin in origins]
+    mosaic = tiling.TileMosaic([upsampling*s for s in sensor_shape], hrshape,
+                               upsampling*overlap/2., mosaic_file)
+
+    if not authkey:
+        authkey = load_authkey(key_file)
+    if not authkey:
+        authkey = os.urandom(32)
+        key_file = write_authkey(authkey, key_file)
+        print('Authentication key for the workers written to %s' % key_file)
+    coordinator = TileCoordinator(address, authkey, lease_timeout,
+                                  max_retries)
+    plan_id = coordinator.add_plan(
+        {'stack_file': os.path.abspath(samples.filename),
+         'stack_shape': samples.shape, 'stack_dtype': np.dtype(np.float32),
+         'cfg_dict': dict(cfg._asdict()), 'patch_size': patch_size,
+         'hrshape': hrshape, 'kdsc': kdsc, 'pupil_radius': pupil_radius,
+         'precision': precision})
+    host, port = coordinator.address
+    if host in ('', '0.0.0.0'):
+        host = socket.gethostname()
+    print('Tile coordinator listening on %s:%d, remote workers:\n'
+          '    python -m pyfpm.distributed %s:%d [key file]'
+          % (host, port, host, port))
+    processes = list()
+    for n in range(workers):
+        process = multiprocessing.Process(target=run_worker,
+                                          args=(coordinator.address,
+                                                coordinator.authkey))
+        process.start()
+        processes.append(process)
+
+    def add_tile(origin, magnitude, phase):
+        print('Tile at (%d, %d) done' % tuple(origin))
+        mosaic.add([upsampling*o for o in origin], magnitude, phase)
+    try:
+        coordinator.run(plan_id, origins, offsets, add_tile)
+    finally:
+        coordinator.finish()
+        for process in processes:
+            process.join(timeout=10.)
+            if process.is_alive():
+                process.terminate()
+        coordinator.close()
+    return mosaic.result()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        sys.exit('Usage: python -m pyfpm.distributed host:port [key file]\n'
+                 'The key is read from %s or the key file (%s by default).'
+                 % (AUTHKEY_VARIABLE, default_key_file()))
+    run_worker(sys.argv[1], key_file=(sys.argv[2] if len(sys.argv) == 3
+                                      else None))
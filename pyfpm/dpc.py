@@ -0,0 +1,157 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" File dpc.py
+
+Last update: 17/10/2026
+
+Description:
+Closed form differential phase contrast (DPC) initial estimate. The bright
+field LEDs of a stack are split in two halves along each axis, and the
+normalised difference of the summed half images is, for a weak object,
+linear in the phase:
+    DPC(f) = H(f)*phi(f)
+The phase transfer function H of each half source follows from the pupil
+and the LED spectrum windows of the plan (the same ones the iterative
+solvers use), and the phase is recovered from both axes with a single
+Tikhonov regularised division in Fourier space:
+    phi(f) = sum(conj(H_a)*DPC_a)/(sum(|H_a|^2) + regularization)
+The low resolution amplitude and phase are then zero padded to the high
+resolution grid, as the initial spectrum of fpm_reconstruct().
+
+Usage:
+    spectrum = dpc_spectrum(samples, plan, pupil)
+    result = fpm_reconstruct(samples, hrshape, None, pupil_radius, kdsc,
+                             cfg, plan=plan, spectrum=spectrum)
+"""
+__version__ = "1.1.1"
+__author__ = 'Juan M. Bujjamer'
+__all__ = ['bright_field', 'phase_transfer', 'dpc_phase', 'dpc_spectrum']
+
+import numpy as np
+
+from . import fpmmath as fpmm
+from .fftbackend import fft2, ifft2, fftshift, ifftshift
+from .multires import pad_spectrum
+
+DEFAULT_REGULARIZATION = 1E-3
+
+
+def _dc_positions(plan=None):
+    """ [row, col] of the zero object frequency in every LED window.
+    """
+    return np.stack([plan.hrshape[0]//2 - plan.kyl,
+                     plan.hrshape[1]//2 - plan.kxl], axis=-1)
+
+
+def bright_field(plan=None, pupil=None):
+    """ Plan positions whose window holds the zero frequency inside the
+    pupil support (bright field LEDs).
+    """
+    dc = _dc_positions(plan)
+    inside = ((dc >= 0) & (dc < plan.lrsize)).all(axis=1)
+    positions = np.flatnonzero(inside)
+    support = np.abs(pupil[dc[positions, 0], dc[positions, 1]]) > 0
+    return positions[support]
+
+
+def phase_transfer(plan=None, pupil=None, position=None):
+    """ Weak object phase transfer function of the (normalised) intensity
+    of one bright field LED, on the low resolution FFT grid (unshifted).
+    With the window holding the zero frequency at d:
+        H(f) = 1j*(P*(d)P(d+f) - P(d)P*(d-f))/|P(d)|^2
+    """
+    lrsize = plan.lrsize
+    dy, dx = _dc_positions(plan)[position]
+    freqs = np.rint(np.fft.fftfreq(lrsize)*lrsize).astype(np.intp)
+
+    def shifted(sign):
+        rows = (dy + sign*freqs)[:, np.newaxis]
+        cols = (dx + sign*freqs)[np.newaxis, :]
+        valid = (rows >= 0) & (rows < lrsize) & (cols >= 0) & (cols < lrsize)
+        values = pupil[np.clip(rows, 0, lrsize-1), np.clip(cols, 0, lrsize-1)]
+        return np.where(valid, values, 0)
+    center = pupil[dy, dx]
+    return 1j*(np.conj(center)*shifted(1) -
+               center*np.conj(shifted(-1)))/np.abs(center)**2
+
+
+def dpc_phase(intensities=None, plan=None, pupil=None, positions=None,
+              regularization=DEFAULT_REGULARIZATION):
+    """ Low resolution phase from the bright field intensities.
+
+    Args:
+    -----
+        intensities: (n, lrsize, lrsize) intensities of the LEDs at the plan
+                     positions.
+        plan: the ReconstructionPlan.
+        pupil: centered (lrsize, lrsize) pupil.
+        positions: plan positions of the intensities (bright field LEDs).
+        regularization: Tikhonov parameter, relative to |H|^2 (which is at
+                        most 4 for a single LED).
+
+    Returns:
+    --------
+        (ndarray) (lrsize, lrsize) phase, with zero mean.
+    """
+    dc = _dc_positions(plan)[positions]
+    center = plan.lrsize//2
+    energy = np.array([np.mean(image, dtype=np.float64)
+                       for image in intensities])
+    numerator = np.zeros((plan.lrsize, plan.lrsize), dtype=np.complex128)
+    denominator = np.zeros((plan.lrsize, plan.lrsize))
+    for axis in range(2):
+        side = np.sign(dc[:, axis] - center)
+        if not (np.any(side > 0) and np.any(side < 0)):
+            continue  # no asymmetric pair along this axis
+        plus = np.sum(intensities[side > 0], axis=0, dtype=np.float64)
+        minus = np.sum(intensities[side < 0], axis=0, dtype=np.float64)
+        contrast = (plus - minus)/np.maximum(plus + minus, 1E-12)
+        contrast -= contrast.mean()
+        total = energy[side != 0].sum()
+        transfer = np.zeros_like(numerator)
+        for n in np.flatnonzero(side):
+            transfer += side[n]*energy[n]*phase_transfer(plan, pupil,
+                                                         positions[n])
+        transfer /= total
+        numerator += np.conj(transfer)*fft2(contrast)
+        denominator += np.abs(transfer)**2
+    return np.real(ifft2(numerator/(denominator + regularization)))
+
+
+def dpc_spectrum(samples=None, plan=None, pupil=None,
+                 regularization=DEFAULT_REGULARIZATION, dtype=np.complex128):
+    """ Initial high resolution spectrum (centered, on plan.hrshape) from
+    the DPC phase and the mean bright field amplitude, scaled so its
+    bright field samples match the measured ones.
+
+    Args:
+    -----
+        samples: the acquired samples as a SampleStack.
+        plan: the ReconstructionPlan.
+        pupil: centered (lrsize, lrsize) pupil.
+        regularization: see dpc_phase().
+        dtype: complex dtype of the spectrum.
+
+    Returns:
+    --------
+        (ndarray) the centered high resolution spectrum.
+    """
+    positions = bright_field(plan, pupil)
+    if len(positions) == 0:
+        raise ValueError("No bright field LEDs in the plan.")
+    rows = samples.rows([plan.keys[p] for p in positions])
+    intensities = np.square(samples.images[rows], dtype=np.float64)
+    phase = dpc_phase(intensities, plan, pupil, positions, regularization)
+    relative = intensities/intensities.mean(axis=(1, 2))[:, np.newaxis,
+                                                         np.newaxis]
+    amplitude = np.sqrt(relative.mean(axis=0))
+    field = amplitude*np.exp(1j*phase)
+    spectrum = pad_spectrum(fftshift(fft2(field)), plan.hrshape)
+    # Scale to the measured bright field amplitudes
+    bright = plan.subset(positions, plan.hrshape)
+    model = fpmm.forward_model(ifft2(ifftshift(spectrum)), bright,
+                               pupil.astype(np.complex128))
+    scale = np.sqrt(np.sum(intensities)/np.sum(np.square(model,
+                                                         dtype=np.float64)))
+    return (scale*spectrum).astype(dtype)
+
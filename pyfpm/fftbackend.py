@@ -0,0 +1,261 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" File fftbackend.py
+
+Last update: 17/10/2026
+
+Description:
+Pluggable FFT layer shared by every pyfpm module. Three backends are
+available:
+    * numpy: numpy.fft (single threaded, unplanned).
+    * scipy: scipy.fft with a configurable number of workers.
+    * fftw: pyFFTW builders, cached per (shape, dtype, axes) and with the
+            accumulated wisdom persisted to disk (once per run, when the
+            process exits, into the per user cache folder by default).
+The backend is selected from the configuration file (fft_backend,
+fft_workers and fft_wisdom fields) and falls back to numpy when the
+required package is not installed.
+
+Usage:
+    from pyfpm.fftbackend import fft2, ifft2, fftshift, ifftshift
+    set_backend(cfg)
+    plan_transforms([(lrsize, lrsize), hrshape], np.complex128)
+"""
+__version__ = "1.1.1"
+__author__ = 'Juan M. Bujjamer'
+__all__ = ['get_backend', 'set_backend', 'plan_transforms', 'fast_length',
+           'fft2', 'ifft2', 'fftshift', 'ifftshift']
+
+import os
+import atexit
+import pickle
+import tempfile
+import multiprocessing
+
+import numpy as np
+
+try:
+    import scipy.fft as scipy_fft
+except ImportError:
+    scipy_fft = None
+
+try:
+    import pyfftw
+    import pyfftw.builders
+except ImportError:
+    pyfftw = None
+
+AXES = (-2, -1)
+# Wisdom file name inside the per user cache folder (see cache.py)
+WISDOM_NAME = 'fftw_wisdom.pkl'
+
+
+class NumpyBackend(object):
+    """ numpy.fft transforms. Every other backend follows this interface.
+    """
+    name = 'numpy'
+
+    def __init__(self, workers=1, wisdom_file=None):
+        self.workers = workers
+        self.wisdom_file = wisdom_file
+
+    def fft2(self, a, axes=AXES, out=None):
+        return _store(np.fft.fft2(a, axes=axes), out)
+
+    def ifft2(self, a, axes=AXES, out=None):
+        return _store(np.fft.ifft2(a, axes=axes), out)
+
+    def fftshift(self, a, axes=None):
+        return np.fft.fftshift(a, axes=axes)
+
+    def ifftshift(self, a, axes=None):
+        return np.fft.ifftshift(a, axes=axes)
+
+    def plan(self, shape, dtype=np.complex128, axes=AXES):
+        """ Prepares the transforms of the given shape. Nothing to do here.
+        """
+        return
+
+    def save_wisdom(self):
+        return
+
+
+class ScipyBackend(NumpyBackend):
+    """ scipy.fft transforms, multithreaded by means of its workers argument.
+    """
+    name = 'scipy'
+
+    def fft2(self, a, axes=AXES, out=None):
+        return _store(scipy_fft.fft2(a, axes=axes, workers=self.workers), out)
+
+    def ifft2(self, a, axes=AXES, out=None):
+        return _store(scipy_fft.ifft2(a, axes=axes, workers=self.workers), out)
+
+
+class FFTWBackend(NumpyBackend):
+    """ pyFFTW transforms. Every (direction, shape, dtype, axes) combination
+    is planned once and the FFTW object is reused afterwards. The wisdom
+    file is read when the backend is created and written once, at exit,
+    if new plans were measured.
+    """
+    name = 'fftw'
+
+    def __init__(self, workers=1, wisdom_file=None):
+        super(FFTWBackend, self).__init__(workers, wisdom_file)
+        self._plans = dict()
+        self._learned = False
+        self.load_wisdom()
+        atexit.register(self.save_wisdom)
+
+    def _get_plan(self, direction, shape, dtype, axes):
+        key = (direction, tuple(shape), np.dtype(dtype).str, tuple(axes))
+        if key not in self._plans:
+            dummy = pyfftw.empty_aligned(shape, dtype=dtype)
+            builder = getattr(pyfftw.builders, direction)
+            self._plans[key] = builder(dummy, axes=axes,
+                                       threads=self.workers,
+                                       planner_effort='FFTW_MEASURE')
+            self._learned = True
+        return self._plans[key]
+
+    def _execute(self, direction, a, axes, out):
+        a = np.asarray(a)
+        if not np.iscomplexobj(a):
+            # Same precision as the input (float32 gives complex64 plans)
+            a = a.astype(np.result_type(a.dtype, np.complex64))
+        # The FFTW object owns its output array, it is copied out of it
+        result = self._get_plan(direction, a.shape, a.dtype, axes)(a)
+        if out is None:
+            return result.copy()
+        np.copyto(out, result)
+        return out
+
+    def fft2(self, a, axes=AXES, out=None):
+        return self._execute('fft2', a, axes, out)
+
+    def ifft2(self, a, axes=AXES, out=None):
+        return self._execute('ifft2', a, axes, out)
+
+    def plan(self, shape, dtype=np.complex128, axes=AXES):
+        for direction in ['fft2', 'ifft2']:
+            self._get_plan(direction, shape, dtype, axes)
+
+    def load_wisdom(self):
+        if self.wisdom_file is None or not os.path.exists(self.wisdom_file):
+            return
+        with open(self.wisdom_file, 'rb') as wisdom:
+            pyfftw.import_wisdom(pickle.load(wisdom))
+
+    def save_wisdom(self):
+        """ Writes the wisdom if new plans were measured. It goes through a
+        temporary file renamed over the old one, so concurrent runs (or pool
+        workers) never leave a truncated file behind.
+        """
+        if self.wisdom_file is None or not self._learned:
+            return
+        folder = os.path.dirname(os.path.abspath(self.wisdom_file))
+        os.makedirs(folder, exist_ok=True)
+        handle, tmpname = tempfile.mkstemp(suffix='.tmp', dir=folder)
+        try:
+            with os.fdopen(handle, 'wb') as wisdom:
+                pickle.dump(pyfftw.export_wisdom(), wisdom)
+            os.replace(tmpname, self.wisdom_file)
+        except BaseException:
+            os.remove(tmpname)
+            raise
+        self._learned = False
+
+
+def _store(result, out):
+    """ Copies result into out (when given) so callers can keep working on
+    their preallocated buffers.
+    """
+    if out is None:
+        return result
+    np.copyto(out, result)
+    return out
+
+
+BACKENDS = {'numpy': NumpyBackend, 'scipy': ScipyBackend, 'fftw': FFTWBackend}
+_backend = NumpyBackend()
+
+
+def set_backend(cfg=None, name=None, workers=None, wisdom_file=None):
+    """ Selects the FFT backend used by every pyfpm module. Explicit arguments
+    take precedence over the configuration fields (fft_backend, fft_workers,
+    fft_wisdom).
+
+    Returns:
+    --------
+        the backend in use.
+    """
+    global _backend
+    if name is None:
+        name = getattr(cfg, 'fft_backend', 'numpy')
+    if workers is None:
+        workers = int(getattr(cfg, 'fft_workers', 1))
+    if workers < 1:
+        workers = multiprocessing.cpu_count()
+    if wisdom_file is None:
+        wisdom_file = getattr(cfg, 'fft_wisdom', None) or default_wisdom()
+    wisdom_file = os.path.expanduser(wisdom_file)
+    if name == 'scipy' and scipy_fft is None:
+        print("scipy.fft not available, using numpy FFTs.")
+        name = 'numpy'
+    if name == 'fftw' and pyfftw is None:
+        print("pyFFTW not available, using numpy FFTs.")
+        name = 'numpy'
+    if (_backend.name == name and _backend.workers == workers and
+            _backend.wisdom_file == wisdom_file):
+        return _backend  # keeps the plans already built
+    _backend = BACKENDS[name](workers=workers, wisdom_file=wisdom_file)
+    return _backend
+
+
+def default_wisdom():
+    """ FFTW wisdom file in the per user cache folder.
+    """
+    from .cache import default_directory
+    return os.path.join(default_directory(), WISDOM_NAME)
+
+
+def get_backend():
+    return _backend
+
+
+def plan_transforms(shapes, dtype=np.complex128, axes=AXES):
+    """ Builds the plans for the recurring transform shapes of a run.
+    """
+    for shape in shapes:
+        _backend.plan(shape, dtype, axes)
+
+
+def fast_length(n):
+    """ Smallest length >= n with no prime factors other than 2, 3, 5 and 7,
+    which every backend transforms efficiently.
+    """
+    n = max(int(np.ceil(n)), 1)
+    while True:
+        rest = n
+        for prime in (2, 3, 5, 7):
+            while rest % prime == 0:
+                rest //= prime
+        if rest == 1:
+            return n
+        n += 1
+
+
+def fft2(a, axes=AXES, out=None):
+    return _backend.fft2(a, axes=axes, out=out)
+
+
+def ifft2(a, axes=AXES, out=None):
+    return _backend.ifft2(a, axes=axes, out=out)
+
+
+def fftshift(a, axes=None):
+    return _backend.fftshift(a, axes=axes)
+
+
+def ifftshift(a, axes=None):
+    return _backend.ifftshift(a, axes=axes)
@@ -10,7 +10,8 @@ Usage:
 __version__ = "1.1.1"
 __author__ = 'Juan M. Bujjamer'
 __all__ = ['image_center', 'generate_pupil', 'fpm_reconstruct', 'calculate_pupil_radius', 'adjust_shutter_speed',
-           'pixel_size_required', 'crop_image']
+           'pixel_size_required', 'crop_image', 'forward_model',
+           'simulate_samples', 'simulate_stack', 'quality_metric']
 
 from io import BytesIO
 from io import StringIO
@@ -18,14 +19,38 @@ import time
 import yaml
 
 import numpy as np
-from numpy.fft import fft2, ifft2, fftshift, ifftshift
+from pyfpm.fftbackend import fft2, ifft2, fftshift, ifftshift
 from scipy.optimize import fsolve
 from PIL import Image
 from scipy import ndimage
 import random
 
 import pyfpm.coordtrans as ct
+from pyfpm.stack import SampleStack, as_stack, INDEX_DTYPE
 
+PRECISIONS = {'double': (np.float64, np.complex128),
+              'single': (np.float32, np.complex64)}
+PRECISION_ALIASES = {'float64': 'double', 'complex128': 'double',
+                     'float32': 'single', 'complex64': 'single'}
+
+
+def precision_dtypes(precision=None):
+    """ Real and complex data types for the given precision.
+
+    Args:
+        precision (str): 'double' (complex128) or 'single' (complex64). The
+                         dtype names are also accepted. None is 'double'.
+
+    Returns:
+        (tuple): (real dtype, complex dtype)
+    """
+    if precision is None:
+        precision = 'double'
+    precision = PRECISION_ALIASES.get(str(precision), str(precision))
+    if precision not in PRECISIONS:
+        raise ValueError("Unknown precision '%s', use 'double' or 'single'."
+                         % precision)
+    return PRECISIONS[precision]
 
 
 def image_center(image_size=None):
@@ -199,13 +224,14 @@ def pupil_image(cx=None, cy=None, pup_rad=None, image_size=None):
 #     return image_gray
 
 def generate_pupil(fx=None, fy=None, image_size=None,
-                   pupil_radius=None):
+                   pupil_radius=None, precision=None):
     """ Pupil center in cartesian coordinates.
 
     Args:
         theta (int):      azimuthal angle
         phi (int):        zenithal angle
         image_size(list): size of the image of the pupil
+        precision (str):  'double' or 'single', data type of the pupil
 
     Return:
         (array) image of the pupil
@@ -217,13 +243,16 @@ def generate_pupil(fx=None, fy=None, image_size=None,
         # return np.zeros(image_size, dtype=np.uint8)
     xc, yc = image_center(image_size)
     image_gray = pupil_image(xc+fx, yc+fy, pupil_radius, image_size)
-    return image_gray
+    real_dtype, complex_dtype = precision_dtypes(precision)
+    return image_gray.astype(real_dtype)
 
 def filter_by_pupil_simulate(im_array, theta, phi, lrsize,
-                             pupil_radius, kdsc):
+                             pupil_radius, kdsc, precision=None):
     """ Filtered image by a pupil calculated using generate_pupil
     """
+    real_dtype, complex_dtype = precision_dtypes(precision)
     if im_array is not None:
+        im_array = np.asarray(im_array).astype(complex_dtype, copy=False)
         npx = im_array.shape[0]  # Half image size  each side
     if theta is not None:
         theta_rad = np.radians(theta)
@@ -240,8 +269,9 @@ def filter_by_pupil_simulate(im_array, theta, phi, lrsize,
     #[kx, ky] = (1/wavelength)*coords*(pixel_size*npx)
     # [kx, ky] = coords*kdsc
 
-    pupil = generate_pupil(0, 0, [lrsize-1, lrsize-1], pupil_radius)
-    f_ih_shift = fftshift(fft2(im_array))
+    pupil = generate_pupil(0, 0, [lrsize-1, lrsize-1], pupil_radius,
+                           precision)
+    f_ih_shift = fftshift(fft2(im_array)).astype(complex_dtype, copy=False)
     kyl = int(np.round(yc+ky-(lrsize)/2))
     kyh = kyl + lrsize - 1
     kxl = int(np.round(xc+kx-(lrsize)/2))
@@ -253,7 +283,93 @@ def filter_by_pupil_simulate(im_array, theta, phi, lrsize,
     proc_array = ifft2(ifftshift(proc_array))
     # proc_array = resize_complex_image(proc_array, original_shape)
     # proc_array = np.abs(proc_array*np.conj(proc_array))
-    return proc_array
+    return proc_array.astype(complex_dtype, copy=False)
+
+
+def forward_model(im_array, plan, pupil, batch=None):
+    """ Low resolution amplitudes of every LED in a reconstruction plan, all
+    at once: a single FFT of the high resolution field, every LED window
+    gathered with one fancy index (plan.flat_windows()) and batched
+    (n, lrsize, lrsize) inverse FFTs.
+
+    Args:
+        im_array (ndarray): complex high resolution field, resampled to
+                            plan.hrshape if its shape differs.
+        plan (ReconstructionPlan): illumination geometry.
+        pupil (ndarray): centered (lrsize, lrsize) pupil.
+        batch (int): LEDs transformed together, all of them if None. Limits
+                     the memory of the (batch, lrsize, lrsize) buffers.
+
+    Returns:
+        (ndarray): (n_leds, lrsize, lrsize) amplitudes in plan order, real
+                   dtype matching the pupil precision.
+    """
+    lrsize = plan.lrsize
+    if np.shape(im_array) != plan.hrshape:
+        zoom = [float(size)/old for size, old in zip(plan.hrshape,
+                                                       np.shape(im_array))]
+        im_array = (ndimage.zoom(np.real(im_array), zoom, order=1) +
+                    1j*ndimage.zoom(np.imag(im_array), zoom, order=1))
+    complex_dtype = np.result_type(pupil.dtype, np.complex64)
+    spectrum = fftshift(fft2(im_array)).astype(complex_dtype, copy=False)
+    spectrum = spectrum.ravel()
+    flat_index = plan.flat_windows()
+    scaled_pupil = (plan.factor*pupil).astype(complex_dtype)
+    amplitudes = np.empty((len(plan), lrsize, lrsize),
+                          dtype=np.finfo(complex_dtype).dtype)
+    batch = len(plan) if batch is None else max(int(batch), 1)
+    for first in range(0, len(plan), batch):
+        windows = spectrum[flat_index[first:first+batch]]
+        windows *= scaled_pupil
+        # No ifftshift needed, it only modulates the phase
+        np.abs(ifft2(windows, axes=(-2, -1)),
+               out=amplitudes[first:first+batch])
+    return amplitudes
+
+
+def simulate_samples(im_array, plan, pupil):
+    """ Simulated low resolution amplitudes of every LED in a reconstruction
+    plan, following the same spectrum windows used to reconstruct them (see
+    forward_model()).
+
+    Args:
+        im_array (ndarray): complex high resolution field, resampled to
+                            plan.hrshape if its shape differs.
+        plan (ReconstructionPlan): illumination geometry.
+        pupil (ndarray): centered (lrsize, lrsize) pupil.
+
+    Returns:
+        (ndarray): (n_leds, lrsize, lrsize) amplitudes, real dtype matching
+                   the pupil precision.
+    """
+    return forward_model(im_array, plan, pupil)
+
+
+def simulate_stack(im_array, plan, pupil, noise=0., seed=0):
+    """ Simulated samples of every LED in a reconstruction plan as a
+    (normalised, float64) SampleStack, see simulate_samples().
+
+    Args:
+        im_array (ndarray): complex high resolution field.
+        plan (ReconstructionPlan): illumination geometry.
+        pupil (ndarray): centered (lrsize, lrsize) pupil.
+        noise (float): relative standard deviation of the gaussian noise
+                       added to the intensities (0 for noiseless samples).
+        seed (int): seed of the noise generator.
+
+    Returns:
+        (SampleStack): the simulated amplitudes.
+    """
+    amplitudes = simulate_samples(im_array, plan, pupil)
+    if noise:
+        rng = np.random.RandomState(seed)
+        intensities = amplitudes**2*(1 + noise*rng.standard_normal(
+            amplitudes.shape))
+        amplitudes = np.sqrt(np.maximum(intensities, 0))
+    index = np.zeros(len(plan), dtype=INDEX_DTYPE)
+    for n, key in enumerate(plan.keys):
+        index[n] = (key[0], key[1], 0, 1, 0)
+    return SampleStack(amplitudes, index, normalize=False, dtype=np.float64)
 
 def filter_by_pupil(im_array, theta, phi, power, cfg):
     """ Filtered image by a pupil calculated using generate_pupil
@@ -334,19 +450,33 @@ def crop_image(im_array, image_size, osx, osy):
     return im_array[osx:(osx+image_size[0]), osy:(osy+image_size[1])]
 
 
-def quality_metric(image_dict, image_lowq, cfg):
-    import coordtrans as ct
+def quality_metric(samples, im_array, plan, pupil, cfg=None, batch=None):
+    """ Agreement of a candidate high resolution field with the measured
+    samples, for the whole LED set in one vectorised call (see
+    forward_model()). Every LED contributes its RMS amplitude divided by
+    its residual, sum |model - sample|, so higher is better.
 
-    iterator = set_iterator(cfg)
-    accum = 0
-    for index, theta, shift in iterator:
-        theta, phi = ct.corrected_coordinates(theta=theta, shift=shift,
-                                              cfg=cfg)
-        im_i = image_dict[(theta, shift)]
-        il_i = filter_by_pupil(image_lowq, theta, phi, 255, cfg)
-        accum += np.sqrt(np.mean(im_i))/ \
-                 (np.sum(np.abs(np.sqrt(il_i)-np.sqrt(im_i))))
-    return accum
+    Args:
+        samples: the measured amplitudes as a SampleStack (legacy
+                 dictionaries are converted with cfg).
+        im_array (ndarray): complex high resolution field.
+        plan (ReconstructionPlan): illumination geometry.
+        pupil (ndarray): centered (lrsize, lrsize) pupil.
+        cfg (named tuple): configuration, to convert legacy dictionaries.
+        batch (int): LEDs transformed together, see forward_model().
+
+    Returns:
+        (float) the metric and (ndarray) the residual of every LED, in plan
+        order.
+    """
+    samples = as_stack(samples, cfg)
+    images = samples.images[samples.rows(plan.keys)]
+    model = forward_model(im_array, plan, pupil, batch)
+    model -= images
+    residuals = np.sum(np.abs(model), axis=(1, 2))
+    rms = np.sqrt(np.mean(np.square(images, dtype=np.float64), axis=(1, 2)))
+    metric = float(np.sum(rms/np.maximum(residuals, np.finfo(float).tiny)))
+    return metric, residuals
 
 
 def laser_beam_simulation(xx, yy, theta, phi, acqpars, cfg):
@@ -14,6 +14,8 @@ from io import StringIO
 import os
 ## To work with py 2 or
 import pyfpm.fpmmath as fpmm
+import pyfpm.fftbackend as fftb
+from pyfpm.plan import ReconstructionPlan, offset_grid_shape
 
 class BaseClient(object):
     def acquire_to(self, filename, theta, phi, power):
@@ -59,6 +61,17 @@ class LedMatrixClient(BaseClient):
         self.led_matrix.set_pixel(nx, ny, power, color)
         return
 
+    def acquire_pattern(self, pattern=None, power=None, color=None,
+                        shutter_speed=100, iso=100):
+        """ Exposure with every (nx, ny) LED of pattern lit at once.
+        """
+        self.led_matrix.set_pattern(pattern, power, color)
+        return self.camera.capture_png(shutter_speed, iso)
+
+    def set_pattern(self, pattern=None, power=None, color=None):
+        self.led_matrix.set_pattern(pattern, power, color)
+        return
+
 class LedClient(BaseClient):
     def __init__(self, camera, ledaim, **metadata):
         self.camera = camera
@@ -187,6 +200,8 @@ class Laser3dCalibrate(BaseClient):
 class SimClient(BaseClient):
     def __init__(self, cfg):# Y Datos del microscopio
         self.cfg = cfg
+        self.precision = getattr(cfg, 'precision', 'double')
+        real_dtype, complex_dtype = fpmm.precision_dtypes(self.precision)
         HOME_FOLDER = os.path.expanduser("~/pyfpm")
         try:
             self.image_mag = self.load_image(os.path.join(HOME_FOLDER, cfg.input_mag))
@@ -194,7 +209,7 @@ class SimClient(BaseClient):
             # Transform into complete field image
             mag_array = self.image_mag
             ph_array = np.pi*(self.image_phase)/np.amax(self.image_phase)
-            self.im_array = mag_array*np.exp(1j*ph_array)
+            self.im_array = (mag_array*np.exp(1j*ph_array)).astype(complex_dtype)
         except:
             print('File not found.')
             self.image_mag = None
@@ -217,9 +232,24 @@ class SimClient(BaseClient):
         # k_discrete = sin(theta)*k0/dk = sin(t)*2pi/l*1/(2*pi/(ps*npx))
         # NOTE: The same observation about ps and ps_req
         self.kdsc = self.ps_req*npx/self.wavelength
+        fftb.set_backend(cfg)
         # self.pupil_rad = cfg.pupil_size
         # self.image_size = cfg.video_size
 
+    def reconstruction_plan(self, xoff=0, yoff=0, offsets=None):
+        """ ReconstructionPlan of the simulated geometry, on the smallest fast
+        FFT high resolution grid its illumination needs. When offsets (a
+        list of (xoff, yoff)) are given the grid fits all of them, so it can
+        be shared by the plans of an offset sweep.
+        """
+        hrshape = None
+        if offsets is not None:
+            hrshape = offset_grid_shape(self.cfg, self.kdsc, self.lrsize,
+                                        self.pupil_radius,
+                                        list(offsets) + [(xoff, yoff)])
+        return ReconstructionPlan(self.cfg, self.kdsc, self.lrsize, hrshape,
+                                  xoff, yoff, pupil_radius=self.pupil_radius)
+
     def load_image(self, input_image):
         """ Loads phase and magnitude input images and crops to patch size.
         """
@@ -242,7 +272,8 @@ class SimClient(BaseClient):
         phi = float(phi)
         # fpm.simulate_acquisition(theta, phi, acqpars)
         filtered = fpmm.filter_by_pupil_simulate(self.im_array, theta, phi,
-                            self.lrsize, self.pupil_radius, self.kdsc)
+                            self.lrsize, self.pupil_radius, self.kdsc,
+                            self.precision)
         return np.abs(filtered)
 
     def show_filtered(self, theta=None, phi=None, power=None):
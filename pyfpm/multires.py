@@ -0,0 +1,178 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" File multires.py
+
+Last update: 17/10/2026
+
+Description:
+Coarse to fine reconstruction. The first stage only uses the low angle
+(bright field) LEDs, on the small high resolution grid they need; every
+following stage zero pads the spectrum of the previous one to its larger
+grid, adds the LEDs up to its illumination NA and keeps iterating. The
+early iterations are then run on a fraction of the LEDs and pixels, and
+the full set starts from an estimate of the low frequencies instead of a
+flat object.
+
+The schedule is a list of [na_ratio, iterations] stages, where na_ratio is
+the largest illumination NA taken, relative to the objective NA (1 is the
+bright field limit, None takes every LED). The last stage always takes
+every LED, on the full grid. The schedule is read from cfg.multires_stages
+if not given.
+
+Usage:
+    result = coarse_to_fine(samples, pupil_radius, kdsc, cfg,
+                            stages=[[1, 5], [None, 15]])
+    for stage in result.metadata['stages']:
+        print(stage['leds'], stage['hrshape'], stage['time'])
+"""
+__version__ = "1.1.1"
+__author__ = 'Juan M. Bujjamer'
+__all__ = ['coarse_to_fine', 'pad_spectrum', 'led_na_ratio', 'stage_shape']
+
+import time
+
+import numpy as np
+
+from . import fftbackend as fftb
+from .convergence import StoppingRule
+from .plan import ReconstructionPlan, hr_grid_shape
+from .stack import as_stack
+
+DEFAULT_STAGES = [[1, 5], [None, 15]]
+
+
+def led_na_ratio(plan=None, pupil_radius=None):
+    """ Illumination NA of every LED of the plan relative to the objective
+    NA (|k| over the pupil radius, both in spectrum pixels).
+    """
+    radius = plan.kdsc*np.hypot(plan.krels[:, 0], plan.krels[:, 1])
+    return radius/float(pupil_radius)
+
+
+def pad_spectrum(spectrum=None, shape=None):
+    """ Centered spectrum zero padded (or cropped) to shape. It is scaled by
+    the ratio of grid sizes, so it gives the same field amplitude on the new
+    grid, interpolated.
+    """
+    old_shape = np.shape(spectrum)
+    padded = np.zeros(shape, dtype=spectrum.dtype)
+    source, target = list(), list()
+    for old, new in zip(old_shape, shape):
+        # The zero frequency sits at size//2 (fftshift convention)
+        offset = new//2 - old//2
+        start = max(offset, 0)
+        stop = min(offset + old, new)
+        target.append(slice(start, stop))
+        source.append(slice(start - offset, stop - offset))
+    padded[tuple(target)] = spectrum[tuple(source)]
+    padded *= float(shape[0]*shape[1])/(old_shape[0]*old_shape[1])
+    return padded
+
+
+def stage_shape(plan=None, positions=None, pupil_radius=None):
+    """ Smallest fast grid for the LEDs at positions whose center has the
+    parity of the plan grid center. Window corners are rounded half to even
+    from the center, so only then every LED window keeps its position
+    relative to the zero frequency when the spectrum is padded.
+    """
+    shape = list()
+    minimum = hr_grid_shape(plan.krels[positions], plan.kdsc, plan.lrsize,
+                            pupil_radius)
+    for size, final in zip(minimum, plan.hrshape):
+        while (size//2 - final//2) % 2:
+            size = fftb.fast_length(size + 1)
+        shape.append(min(size, final))
+    return tuple(shape)
+
+
+def coarse_to_fine(samples=None, pupil_radius=None, kdsc=None, cfg=None,
+                   stages=None, hrshape=None, plan=None, pupil=None,
+                   **kwargs):
+    """ FPM reconstruction in stages of increasing illumination NA and grid
+    size (see the module description).
+
+    Args:
+    -----
+        samples: the acquired samples as a SampleStack (legacy dictionaries
+                 are converted).
+        pupil_radius: radius of the pupil in pixels.
+        kdsc: conversion factor from relative k to discrete spectrum pixels.
+        cfg: configuration (named tuple)
+        stages: list of [na_ratio, iterations], cfg.multires_stages if not
+                given. Stages taking no new LEDs are skipped, the last one
+                takes every LED whatever its na_ratio.
+        hrshape: shape of the last stage, sized from the illumination if
+                 None (see plan.hr_grid_shape()).
+        plan: a ReconstructionPlan with every LED, built from cfg if not
+              given. Stage plans are subsets of it.
+        pupil: initial pupil, carried (and recovered, with pupil_step) from
+               stage to stage.
+        kwargs: other fpm_reconstruct() arguments (precision, method,
+                ordering, pupil_step...).
+
+    Returns:
+    --------
+        (ReconstructionResult) the last stage result. Its errors and times
+        cover every stage, and metadata['stages'] lists the LEDs, grid,
+        iterations, final error and time of each one.
+    """
+    from .reconstruct import fpm_reconstruct
+
+    samples = as_stack(samples, cfg)
+    lrsize = samples.shape[1]
+    if plan is None:
+        plan = ReconstructionPlan(cfg, kdsc, lrsize, hrshape,
+                                  pupil_radius=pupil_radius)
+    if stages is None:
+        stages = getattr(cfg, 'multires_stages', None) or DEFAULT_STAGES
+    if len(stages) == 0:
+        raise ValueError("Expected at least one [na_ratio, iterations] "
+                         "stage.")
+    na_ratio = led_na_ratio(plan, pupil_radius)
+    order = np.argsort(na_ratio, kind='stable')
+    spectrum, result, used = None, None, 0
+    errors, times, report = list(), list(), list()
+    elapsed = 0.
+    for n, (limit, iterations) in enumerate(stages):
+        last = n == len(stages) - 1
+        if last or limit is None:
+            count = len(plan)
+        else:
+            count = int(np.count_nonzero(na_ratio <= float(limit) + 1E-9))
+        if count <= used and not last:
+            continue
+        used = count
+        # Stage LEDs keep the plan order, the full set uses the plan grid
+        positions = np.sort(order[:used])
+        if used == len(plan):
+            stage_plan = plan.subset(positions, plan.hrshape)
+        else:
+            stage_plan = plan.subset(positions, stage_shape(plan, positions,
+                                                            pupil_radius))
+        if spectrum is not None:
+            spectrum = pad_spectrum(spectrum, stage_plan.hrshape)
+        start_time = time.time()
+        result = fpm_reconstruct(samples, stage_plan.hrshape, None,
+                                 pupil_radius, kdsc, cfg, plan=stage_plan,
+                                 stopping=StoppingRule.from_config(
+                                     cfg, max_iter=iterations),
+                                 pupil=pupil, spectrum=spectrum, **kwargs)
+        stage_time = time.time() - start_time
+        spectrum, pupil = result.spectrum, result.pupil
+        errors.extend(result.errors)
+        times.extend(elapsed + result.times)
+        elapsed += stage_time
+        report.append({'leds': len(stage_plan), 'na_ratio': limit,
+                       'hrshape': list(stage_plan.hrshape),
+                       'iterations': int(result.iterations),
+                       'error': float(result.errors[-1]),
+                       'time': stage_time})
+        print('Stage %d: %d LEDs on %s, %d iterations in %.2f s, '
+              'error %.4e' % (len(report), len(stage_plan),
+                              stage_plan.hrshape, result.iterations,
+                              stage_time, result.errors[-1]))
+    result.errors = np.array(errors)
+    result.times = np.array(times)
+    result.iterations = len(errors)
+    result.metadata['stages'] = report
+    return result
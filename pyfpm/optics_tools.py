@@ -18,7 +18,7 @@ import yaml
 # matplotlib.use('gtkagg')
 import matplotlib.pyplot as plt
 import numpy as np
-from numpy.fft import fft2, ifft2, fftshift
+from .fftbackend import fft2, ifft2, fftshift
 from scipy.optimize import fsolve
 from PIL import Image
 from scipy import misc
@@ -0,0 +1,88 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" File ordering.py
+
+Last update: 17/10/2026
+
+Description:
+Order of the LED updates inside every pass of the sequential
+reconstruction. The plan keeps the acquisition order of ct.set_iterator();
+an LedOrdering permutes it for every pass without touching the plan:
+    * plan: the acquisition order (spiral, raster...).
+    * energy: brightest frames first (measured frame energy), so the strong
+              low frequency information settles before the weak dark field.
+    * radial: increasing distance of the LED k vector to the center.
+    * random: a new random permutation on every pass (reproducible from
+              the seed and the pass number).
+
+Usage:
+    ordering = LedOrdering.from_config(cfg)
+    order = ordering.order(plan, images, iteration)
+    for p in order:
+        workspace.update(spectrum, plan.kyl[p], plan.kxl[p], images[p])
+"""
+__version__ = "1.1.1"
+__author__ = 'Juan M. Bujjamer'
+__all__ = ['ORDERINGS', 'LedOrdering']
+
+import numpy as np
+
+ORDERINGS = ('plan', 'energy', 'radial', 'random')
+
+
+class LedOrdering(object):
+    """ LED update order strategy.
+
+    Args:
+    -----
+        strategy: one of ORDERINGS.
+        seed: seed of the 'random' strategy.
+    """
+    def __init__(self, strategy='plan', seed=0):
+        if strategy not in ORDERINGS:
+            raise ValueError("Unknown LED ordering '%s', expected one of %s."
+                             % (strategy, ', '.join(ORDERINGS)))
+        self.strategy = strategy
+        self.seed = int(seed)
+
+    @classmethod
+    def from_config(cls, cfg=None, **kwargs):
+        """ Ordering from the configuration fields led_ordering and
+        led_ordering_seed. Keyword arguments take precedence.
+        """
+        settings = {'strategy': getattr(cfg, 'led_ordering', 'plan'),
+                    'seed': getattr(cfg, 'led_ordering_seed', 0)}
+        settings.update((key, value) for key, value in kwargs.items()
+                        if value is not None)
+        return cls(**settings)
+
+    def order(self, plan=None, images=None, iteration=0):
+        """ Plan positions in update order for the given pass.
+
+        Args:
+        -----
+            plan: the ReconstructionPlan.
+            images: (n_leds, h, w) normalised frames in plan order, needed
+                    by the 'energy' strategy.
+            iteration: pass number (the 'random' strategy changes with it).
+
+        Returns:
+        --------
+            (ndarray) permutation of range(len(plan)).
+        """
+        if self.strategy == 'random':
+            rng = np.random.RandomState((self.seed, int(iteration)))
+            return rng.permutation(len(plan))
+        if self.strategy == 'energy':
+            energy = np.array([np.sum(image, dtype=np.float64)
+                               for image in images])
+            return np.argsort(-energy, kind='stable')
+        if self.strategy == 'radial':
+            radius = np.hypot(plan.krels[:, 0], plan.krels[:, 1])
+            return np.argsort(radius, kind='stable')
+        return np.arange(len(plan))
+
+    def describe(self):
+        """ Run metadata of the ordering.
+        """
+        return {'led_ordering': self.strategy, 'led_ordering_seed': self.seed}
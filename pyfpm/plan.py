@@ -0,0 +1,476 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" File plan.py
+
+Last update: 17/10/2026
+
+Description:
+Precompiled illumination geometry for the FPM reconstruction loop. The
+iterator, the LED to k-space conversion and the spectrum window arithmetic
+only depend on the configuration and on the grid sizes, so they are solved
+once here and reused for every iteration (and for every dataset taken with
+the same geometry).
+
+Usage:
+    plan = ReconstructionPlan(cfg, kdsc, lrsize, pupil_radius=pupil_radius)
+    workspace = UpdateWorkspace(plan, pupil)
+    for n, kyl, kxl in zip(rows, plan.kyl, plan.kxl):
+        workspace.update(spectrum, kyl, kxl, samples.images[n])
+"""
+__version__ = "1.1.1"
+__author__ = 'Juan M. Bujjamer'
+__all__ = ['ReconstructionPlan', 'UpdateWorkspace', 'hr_grid_shape',
+           'offset_grid_shape', 'led_geometry']
+
+import copy
+
+import numpy as np
+
+import pyfpm.fpmmath as fpmm
+from . import coordtrans as ct
+from . import fftbackend as fftb
+from . import solvers
+
+
+def hr_grid_shape(krels=None, kdsc=None, lrsize=None, pupil_radius=0):
+    """ Smallest fast FFT high resolution shape for the given illumination.
+    It covers the band limit of the recovered spectrum (max |k| plus the
+    pupil radius, on each side) and keeps every LED window inside the
+    spectrum, with the same rounding used by ReconstructionPlan.
+
+    Args:
+    -----
+        krels: (n_leds, 2) relative [kx, ky] of every LED.
+        kdsc: conversion factor from relative k to discrete spectrum pixels.
+        lrsize: size of the (square) low resolution samples.
+        pupil_radius: radius of the pupil in pixels.
+
+    Returns:
+    --------
+        (tuple) (rows, cols) of the high resolution grid.
+    """
+    lrsize = int(lrsize)
+    shape = list()
+    # Rows follow ky, columns kx
+    for k in (float(kdsc)*krels[:, 1], float(kdsc)*krels[:, 0]):
+        kmax = float(np.max(np.abs(k))) if len(k) else 0.
+        size = fftb.fast_length(max(2*(kmax + pupil_radius), 2*kmax + lrsize))
+        while True:
+            lower = np.round(int(size/2.) + k - (lrsize+1)/2.)
+            if len(k) == 0 or (lower.min() >= 0 and
+                               lower.max() + lrsize <= size):
+                break
+            size = fftb.fast_length(size + 1)
+        shape.append(size)
+    return tuple(shape)
+
+
+def led_geometry(cfg=None, xoff=0, yoff=0, led_range=(11, 19)):
+    """ Keys, relative [kx, ky] and acquisition parameters of the LEDs given
+    by ct.set_iterator(cfg) inside led_range, see ReconstructionPlan.
+    """
+    keys, krels, acqpars = list(), list(), list()
+    for it in ct.set_iterator(cfg):
+        indexes, kx_rel, ky_rel = ct.n_to_krels(it, cfg, xoff, yoff)
+        if led_range is not None:
+            lmin, lmax = led_range
+            if (indexes[0] < lmin or indexes[0] > lmax or
+                    indexes[1] < lmin or indexes[1] > lmax):
+                continue
+        keys.append(indexes)
+        krels.append([kx_rel, ky_rel])
+        acqpars.append(it['acqpars'])
+    return (keys, np.array(krels, dtype=np.float64).reshape(-1, 2),
+            np.array(acqpars, dtype=np.float64).reshape(-1, 3))
+
+
+def offset_grid_shape(cfg=None, kdsc=None, lrsize=None, pupil_radius=0,
+                      offsets=((0, 0),), led_range=(11, 19)):
+    """ hr_grid_shape() fitting the illumination of every LED matrix offset,
+    so a single grid can be shared by the plans of an offset sweep.
+
+    Args:
+    -----
+        cfg: configuration (named tuple)
+        kdsc: conversion factor from relative k to discrete spectrum pixels.
+        lrsize: size of the (square) low resolution samples.
+        pupil_radius: radius of the pupil in pixels.
+        offsets: (xoff, yoff) pairs the grid must fit.
+        led_range: see ReconstructionPlan.
+
+    Returns:
+    --------
+        (tuple) (rows, cols) of the high resolution grid.
+    """
+    krels = np.vstack([led_geometry(cfg, xoff, yoff, led_range)[1]
+                       for xoff, yoff in offsets])
+    return hr_grid_shape(krels, kdsc, lrsize, pupil_radius)
+
+
+class ReconstructionPlan(object):
+    """ Every LED's integer spectrum window, normalisation factor and sample
+    key, stored in compact arrays following the acquisition order given by
+    ct.set_iterator(cfg).
+
+    Args:
+    -----
+        cfg: configuration (named tuple)
+        kdsc: conversion factor from relative k to discrete spectrum pixels.
+        lrsize: size of the (square) low resolution samples.
+        hrshape: shape of the high resolution reconstruction. None sizes it
+                 with hr_grid_shape() for the LEDs of the plan (only for
+                 this offset, see offset_grid_shape() for a sweep).
+        xoff: offset of the LED matrix center in the 'x' direction.
+        yoff: offset of the LED matrix center in the 'y' direction.
+        led_range: [min, max] LED matrix indexes taken into account (both
+                   coordinates). None uses every LED given by the iterator.
+        pupil_radius: radius of the pupil in pixels, used to size hrshape.
+    """
+    def __init__(self, cfg=None, kdsc=None, lrsize=None, hrshape=None,
+                 xoff=0, yoff=0, led_range=(11, 19), pupil_radius=0):
+        self.cfg = cfg
+        self.kdsc = float(kdsc)
+        self.lrsize = int(lrsize)
+        self.xoff = xoff
+        self.yoff = yoff
+        self.led_range = led_range
+
+        self.keys, self.krels, self.acqpars = led_geometry(cfg, xoff, yoff,
+                                                           led_range)
+        if hrshape is None:
+            hrshape = hr_grid_shape(self.krels, self.kdsc, self.lrsize,
+                                    pupil_radius)
+        self.hrshape = tuple(int(s) for s in hrshape)
+        # Intensity scaling between the low and high resolution spectra
+        self.factor = float(self.lrsize)**2/(self.hrshape[0]*self.hrshape[1])
+        # Exposure normalisation (shutter speed) applied to each sample
+        self.norm = 1./self.acqpars[:, 1]
+        self.compute_windows()
+
+    def window_corners(self, krels=None):
+        """ Integer lower corners (kyl, kxl) of the LED spectrum windows for
+        the given relative k coordinates (the plan ones by default), and a
+        mask of the windows not fully inside the spectrum.
+        """
+        if krels is None:
+            krels = self.krels
+        xc, yc = fpmm.image_center(self.hrshape)
+        kx = self.kdsc*krels[:, 0]
+        ky = self.kdsc*krels[:, 1]
+        kyl = np.round(yc+ky-(self.lrsize+1)/2.).astype(np.intp)
+        kxl = np.round(xc+kx-(self.lrsize+1)/2.).astype(np.intp)
+        outside = ((kyl < 0) | (kxl < 0) |
+                   (kyl + self.lrsize > self.hrshape[0]) |
+                   (kxl + self.lrsize > self.hrshape[1]))
+        return kyl, kxl, outside
+
+    def compute_windows(self):
+        """ Integer lower corners [kyl, kxl] of every LED spectrum window,
+        from the current relative k coordinates. Windows falling outside the
+        spectrum raise a ValueError (the updates would wrap around it).
+        """
+        kyl, kxl, outside = self.window_corners()
+        if np.any(outside):
+            raise ValueError("%d LED windows fall outside the %s spectrum, "
+                             "use a larger hrshape (see hr_grid_shape() and "
+                             "offset_grid_shape())." %
+                             (np.count_nonzero(outside), self.hrshape))
+        self.kyl, self.kxl = kyl, kxl
+
+    def flat_windows(self):
+        """ Flat indexes into the high resolution spectrum of every pixel of
+        every LED window, as a (n_leds, lrsize, lrsize) array. Used to gather
+        all the windows at once and to scatter-add updates back.
+        """
+        span = np.arange(self.lrsize)
+        rows = self.kyl[:, np.newaxis, np.newaxis] + span[np.newaxis, :, np.newaxis]
+        cols = self.kxl[:, np.newaxis, np.newaxis] + span[np.newaxis, np.newaxis, :]
+        return rows*self.hrshape[1] + cols
+
+    def subset(self, positions=None, hrshape=None, pupil_radius=0):
+        """ A plan with only the LEDs at the given positions (in that
+        order), e.g. the bright field ones of a coarse reconstruction stage.
+        hrshape=None sizes the grid for those LEDs (see hr_grid_shape()).
+        """
+        positions = np.asarray(positions, dtype=np.intp)
+        plan = copy.copy(self)
+        plan.keys = [self.keys[n] for n in positions]
+        plan.krels = self.krels[positions]
+        plan.acqpars = self.acqpars[positions]
+        plan.norm = self.norm[positions]
+        if hrshape is None:
+            hrshape = hr_grid_shape(plan.krels, plan.kdsc, plan.lrsize,
+                                    pupil_radius)
+        plan.hrshape = tuple(int(s) for s in hrshape)
+        plan.factor = float(plan.lrsize)**2/(plan.hrshape[0]*plan.hrshape[1])
+        plan.compute_windows()
+        return plan
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __iter__(self):
+        """ Yields (key, kyl, kxl, norm) for every LED in update order.
+        """
+        for n, key in enumerate(self.keys):
+            yield key, int(self.kyl[n]), int(self.kxl[n]), self.norm[n]
+
+    def matches(self, cfg=None, kdsc=None, lrsize=None, hrshape=None):
+        """ True if the plan was built for the same geometry, so it can be
+        reused for another dataset.
+        """
+        return (self.cfg == cfg and self.kdsc == float(kdsc) and
+                self.lrsize == int(lrsize) and
+                (hrshape is None or
+                 self.hrshape == tuple(int(s) for s in hrshape)))
+
+
+class UpdateWorkspace(object):
+    """ Preallocated buffers for the single LED spectrum update of the
+    alternating projections loop. Every operation is done in place (out=
+    ufuncs), so the update does not allocate new arrays (except for the
+    FFTs of backends that do not support an output array).
+
+    With pupil_step > 0 the pupil is recovered jointly with the object
+    (embedded pupil recovery, EPRY): every update also corrects the pupil
+    inside its support, using the object window as the probe.
+
+    Args:
+    -----
+        plan: the ReconstructionPlan the workspace is used with.
+        pupil: complex (lrsize, lrsize) pupil, centered.
+        dtype: complex data type of the buffers.
+        pupil_step: pupil update step size (0 keeps the pupil fixed).
+        method: per LED update rule, 'gs' or 'gauss_newton' (see
+                solvers.py).
+        step: step size of the object update.
+        delta: regularisation of the Gauss-Newton update.
+        sparse: restricts the pupil products and the spectrum write-back to
+                the pupil support (flat indexes and weights computed once),
+                instead of running them over the whole window. Outside the
+                support the update leaves the spectrum unchanged, so both
+                give the same result. Updates with pupil recovery use the
+                dense path.
+    """
+    def __init__(self, plan=None, pupil=None, dtype=np.complex128,
+                 pupil_step=0., method='gs', step=1., delta=1., sparse=True):
+        lrsize = plan.lrsize
+        self.plan = plan
+        self.dtype = np.dtype(dtype)
+        self.pupil_step = float(pupil_step)
+        self.method = method
+        self.step = float(step)
+        self.delta = float(delta)
+        self.sparse = sparse
+        self.set_pupil(pupil)
+        self.field = np.empty((lrsize, lrsize), dtype=self.dtype)
+        self.lowres_ft = np.empty((lrsize, lrsize), dtype=self.dtype)
+        # Exit wave correction and object window, used by the pupil update
+        self.exit_diff = np.empty((lrsize, lrsize), dtype=self.dtype)
+        self.window_old = np.empty((lrsize, lrsize), dtype=self.dtype)
+        real_dtype = np.finfo(self.dtype).dtype
+        self.modulus = np.empty((lrsize, lrsize), dtype=real_dtype)
+        self.residual = np.empty((lrsize, lrsize), dtype=real_dtype)
+        # Estimates of every LED of a multiplexed exposure (allocated on the
+        # first update_multiplexed())
+        self._fields = None
+        # Sum of the amplitude residuals |sample - |estimate|| of the updates
+        # since the last reset_error()
+        self.error = 0.
+        # Offset giving exact zeros a null phase without overflowing the
+        # modulus division (also in single precision)
+        self.tiny = np.sqrt(np.finfo(real_dtype).tiny)
+
+    def set_pupil(self, pupil):
+        """ Stores (a copy of) the pupil and the products derived from it.
+        The pupil support is taken from its nonzero pixels.
+        """
+        self.pupil = np.array(pupil, dtype=self.dtype)
+        self.support = (np.abs(self.pupil) > 0).astype(self.pupil.real.dtype)
+        self.scaled_pupil = np.empty_like(self.pupil)
+        self.back_pupil = np.empty_like(self.pupil)
+        self.complement = np.empty_like(self.support)
+        # Sparse support: flat indexes into the window buffers and offsets
+        # into the flat high resolution spectrum (from the window corner)
+        self.support_index = np.flatnonzero(self.support)
+        rows, cols = np.divmod(self.support_index, self.plan.lrsize)
+        self.support_offsets = rows*self.plan.hrshape[1] + cols
+        self._spectrum_index = np.empty_like(self.support_offsets)
+        self._values = np.empty(len(self.support_index), dtype=self.dtype)
+        self._products = np.empty(len(self.support_index), dtype=self.dtype)
+        self._refresh_pupil()
+
+    def _refresh_pupil(self):
+        """ Recomputes (in place) the products derived from the pupil.
+        """
+        np.multiply(self.pupil, self.plan.factor, out=self.scaled_pupil)
+        # The update is projected back through the (conjugate) pupil, so
+        # aberrations (defocus) are undone inside the pupil support. The
+        # weights depend on the update rule, see solvers.pupil_weights().
+        back, complement = solvers.pupil_weights(self.pupil, self.method,
+                                                 self.step, self.delta)
+        np.copyto(self.back_pupil, back)
+        np.copyto(self.complement, complement)
+        # Weights at the support pixels, for the sparse update
+        self.scaled_weights = self.scaled_pupil.ravel()[self.support_index]
+        self.back_weights = self.back_pupil.ravel()[self.support_index]
+        self.complement_weights = self.complement.ravel()[self.support_index]
+
+    def reset_error(self):
+        """ Restarts the residual accumulation (call it on every iteration).
+        """
+        self.error = 0.
+
+    def update(self, spectrum, kyl, kxl, sample):
+        """ Replaces the modulus of the low resolution estimate at the
+        (kyl, kxl) window with the measured sample and writes the updated
+        pupil area back into spectrum (in place). The pupil is updated too
+        when pupil_step > 0.
+
+        Returns:
+        --------
+            (ndarray) the updated low resolution field (a view of the
+            workspace buffer, valid until the next update).
+        """
+        lrsize = self.plan.lrsize
+        self._check_window(spectrum, kyl, kxl)
+        if (self.sparse and not self.pupil_step and
+                spectrum.shape == self.plan.hrshape and
+                spectrum.flags.c_contiguous):
+            return self._update_sparse(spectrum, kyl, kxl, sample)
+        window = spectrum[kyl:kyl+lrsize, kxl:kxl+lrsize]
+        field, lowres_ft, modulus = self.field, self.lowres_ft, self.modulus
+        np.multiply(window, self.scaled_pupil, out=lowres_ft)
+        # The ifftshift/fftshift pair around the modulus constraint cancels
+        # out (the spatial modulation it adds has unit modulus), so the
+        # centered window is transformed directly.
+        fftb.ifft2(lowres_ft, out=field)
+        # Phase only normalisation x/|x|, exact zeros take a null phase
+        np.add(field, self.tiny, out=field)
+        np.abs(field, out=modulus)
+        # Residual of the current estimate, accumulated for the convergence
+        # monitor before the modulus is replaced
+        np.subtract(sample, modulus, out=self.residual)
+        np.abs(self.residual, out=self.residual)
+        self.error += float(self.residual.sum())
+        # The 1/factor scaling of the replaced field is folded in here
+        np.multiply(modulus, self.plan.factor, out=modulus)
+        np.divide(sample, modulus, out=modulus)
+        np.multiply(field, modulus, out=field)
+        fftb.fft2(field, out=lowres_ft)
+        if self.pupil_step:
+            # Exit wave correction: updated minus current (window*pupil)
+            np.copyto(self.window_old, window)
+            np.multiply(window, self.pupil, out=self.exit_diff)
+            np.subtract(lowres_ft, self.exit_diff, out=self.exit_diff)
+        np.multiply(lowres_ft, self.back_pupil, out=lowres_ft)
+        np.multiply(window, self.complement, out=window)
+        np.add(window, lowres_ft, out=window)
+        if self.pupil_step:
+            self._update_pupil()
+        return field
+
+    def _check_window(self, spectrum, kyl, kxl):
+        """ Raises a ValueError if the (kyl, kxl) window is not fully inside
+        spectrum. The sparse update would wrap it into the neighbouring rows
+        and the dense one would silently work on a clipped window.
+        """
+        lrsize = self.plan.lrsize
+        if (kyl < 0 or kxl < 0 or kyl + lrsize > spectrum.shape[0] or
+                kxl + lrsize > spectrum.shape[1]):
+            raise ValueError("Window at (%d, %d) falls outside the %s "
+                             "spectrum." % (kyl, kxl, spectrum.shape))
+
+    def _update_sparse(self, spectrum, kyl, kxl, sample):
+        """ update() touching the spectrum only at the pupil support: the
+        window pixels under the support are gathered, propagated and
+        scattered back, the rest of the window is left as it is.
+        """
+        field, lowres_ft, modulus = self.field, self.lowres_ft, self.modulus
+        values, products = self._values, self._products
+        flat_spectrum = spectrum.reshape(-1)
+        flat_lowres = lowres_ft.reshape(-1)
+        index = np.add(self.support_offsets,
+                       int(kyl)*self.plan.hrshape[1] + int(kxl),
+                       out=self._spectrum_index)
+        np.take(flat_spectrum, index, out=values)
+        lowres_ft.fill(0)
+        np.multiply(values, self.scaled_weights, out=products)
+        flat_lowres[self.support_index] = products
+        fftb.ifft2(lowres_ft, out=field)
+        # Modulus replacement, as in update()
+        np.add(field, self.tiny, out=field)
+        np.abs(field, out=modulus)
+        np.subtract(sample, modulus, out=self.residual)
+        np.abs(self.residual, out=self.residual)
+        self.error += float(self.residual.sum())
+        np.multiply(modulus, self.plan.factor, out=modulus)
+        np.divide(sample, modulus, out=modulus)
+        np.multiply(field, modulus, out=field)
+        fftb.fft2(field, out=lowres_ft)
+        # complement*window + back*update, at the support only
+        np.take(flat_lowres, self.support_index, out=products)
+        np.multiply(products, self.back_weights, out=products)
+        np.multiply(values, self.complement_weights, out=values)
+        np.add(values, products, out=values)
+        flat_spectrum[index] = values
+        return field
+
+    def update_multiplexed(self, spectrum, kyls, kxls, sample):
+        """ update() for an exposure taken with several LEDs lit at once.
+        The LEDs are mutually incoherent, so the predicted intensity is the
+        sum of the intensities of every LED estimate. The measured modulus
+        is split among them in proportion to their share of that sum (every
+        estimate is scaled by sample/sqrt(sum |estimate|^2)) and each one is
+        written back into its own spectrum window. The pupil is kept fixed.
+
+        Args:
+        -----
+            spectrum: centered high resolution spectrum (updated in place).
+            kyls, kxls: window corners of the LEDs lit in the exposure.
+            sample: measured (normalised) amplitude of the exposure.
+        """
+        lrsize = self.plan.lrsize
+        count = len(kyls)
+        if self._fields is None or len(self._fields) < count:
+            self._fields = np.empty((count, lrsize, lrsize), dtype=self.dtype)
+        fields = self._fields[:count]
+        lowres_ft, modulus, residual = self.lowres_ft, self.modulus, self.residual
+        modulus.fill(0)
+        for field, kyl, kxl in zip(fields, kyls, kxls):
+            self._check_window(spectrum, kyl, kxl)
+            window = spectrum[kyl:kyl+lrsize, kxl:kxl+lrsize]
+            np.multiply(window, self.scaled_pupil, out=lowres_ft)
+            fftb.ifft2(lowres_ft, out=field)
+            np.add(field, self.tiny, out=field)
+            np.abs(field, out=residual)
+            np.square(residual, out=residual)
+            np.add(modulus, residual, out=modulus)
+        np.sqrt(modulus, out=modulus)
+        np.subtract(sample, modulus, out=residual)
+        np.abs(residual, out=residual)
+        self.error += float(residual.sum())
+        # Common scaling of every estimate, 1/factor folded in as in update()
+        np.multiply(modulus, self.plan.factor, out=modulus)
+        np.divide(sample, modulus, out=modulus)
+        for field, kyl, kxl in zip(fields, kyls, kxls):
+            window = spectrum[kyl:kyl+lrsize, kxl:kxl+lrsize]
+            np.multiply(field, modulus, out=field)
+            fftb.fft2(field, out=lowres_ft)
+            np.multiply(lowres_ft, self.back_pupil, out=lowres_ft)
+            np.multiply(window, self.complement, out=window)
+            np.add(window, lowres_ft, out=window)
+
+    def _update_pupil(self):
+        """ EPRY pupil correction, conj(O)/max|O|^2 * (psi' - psi), inside
+        the pupil support.
+        """
+        window_old, exit_diff = self.window_old, self.exit_diff
+        np.abs(window_old, out=self.residual)
+        norm = float(self.residual.max())**2 or 1.
+        np.conj(window_old, out=window_old)
+        np.multiply(exit_diff, window_old, out=exit_diff)
+        np.multiply(exit_diff, self.support, out=exit_diff)
+        np.multiply(exit_diff, self.pupil_step/norm, out=exit_diff)
+        np.add(self.pupil, exit_diff, out=self.pupil)
+        self._refresh_pupil()
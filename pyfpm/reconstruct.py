@@ -9,6 +9,7 @@ alternating projections (Gerchberg-Saxton) method.
 Usage:
 
 """
+import copy
 import time
 import yaml
 
@@ -16,13 +17,24 @@ import matplotlib
 matplotlib.use('TkAgg')
 import matplotlib.pyplot as plt
 import numpy as np
-from numpy.fft import fft2, ifft2, fftshift, ifftshift
 from PIL import Image
 from scipy import ndimage
 
 # from pyfpm.coordinates import PlatformCoordinates
 import pyfpm.fpmmath as fpmm
+import pyfpm.data as dt
 from . import coordtrans as ct
+from .plan import ReconstructionPlan, UpdateWorkspace, offset_grid_shape
+from .convergence import StoppingRule, ReconstructionResult
+from .checkpoint import Checkpointer, load_checkpoint
+from .viewer import LiveViewer, spectrum_snapshot
+from .stack import SampleStack, as_stack
+from . import fftbackend as fftb
+from . import solvers
+from .ordering import LedOrdering
+from .cache import PreprocessCache
+from .calibration import LedCalibration
+from .fftbackend import fft2, ifft2, fftshift, ifftshift
 
 # from . import implot
 # import fpmmath.optics_tools as ot
@@ -34,10 +46,10 @@ def get_mask(samples, backgrounds=None, xoff=None, yoff=None, cfg=None):
 
     Args:
     -----
-        samples: the acquired samples as a dictionary with angles as keys.
-        backgrounds: the acquired background as a dictionary with angles as
-                     keys. They must be acquired right after or before taking
-                     the samples.
+        samples: the acquired samples as a SampleStack (legacy dictionaries
+                 are converted).
+        backgrounds: the acquired background as a SampleStack. They must be
+                     acquired right after or before taking the samples.
         xoff: offset in the 'x' direction of this sample's center.
         yoff: offset in the 'y' direction of this sample's center.
         cfg: configuration (named tuple)
@@ -45,17 +57,12 @@ def get_mask(samples, backgrounds=None, xoff=None, yoff=None, cfg=None):
     --------
         (ndarray) mask containing the object to be reconstructed.
     """
-    corr_ims = list()
-    iterator = fpmm.set_iterator(cfg)
-    for index, theta, shift in iterator:
-        image = samples[(theta, shift)]
-        image = fpmm.crop_image(image, cfg.patch_size, xoff, yoff)
-        # image, image_size = image_rescaling(image, cfg)
-        background = backgrounds[(theta, shift)]
-        background = fpmm.crop_image(background, cfg.patch_size, xoff, yoff)
-        # background, image_size = image_rescaling(background, cfg)
-        corr_ims.append(image_correction(image, background, mode='background'))
-    mask = np.mean(corr_ims, axis=0)
+    samples = as_stack(samples, cfg)
+    backgrounds = as_stack(backgrounds, cfg).subset(samples.keys())
+    images = samples.crop(cfg.patch_size, xoff, yoff).images
+    background = backgrounds.crop(cfg.patch_size, xoff, yoff).images
+    mask = np.mean(image_correction(images, background, mode='background'),
+                   axis=0)
     #
     thres = 140 # hardcoded
     mask[mask < thres] = 1
@@ -108,7 +115,8 @@ def image_rescaling(lr_image, cfg):
 
     Args:
     -----
-        image: the (xpy, npx) image to be rescaled
+        image: the (xpy, npx) image to be rescaled, or a (n_leds, xpy, npx)
+               stack of images (rescaled all at once).
         cfg: configuration (named tuple)
 
     Returns:
@@ -120,57 +128,79 @@ def image_rescaling(lr_image, cfg):
     na = float(cfg.objective_na)
     ps_required = fpmm.ps_required(phi_max, wavelength, na)
     scale_factor = cfg.pixel_size/ps_required
-    Ih = ndimage.zoom(lr_image, scale_factor, order=0)  # HR image
-    hr_shape = np.shape(Ih)
+    # Upsampled sizes rounded up to fast FFT lengths
+    lr_shape = np.shape(lr_image)[-2:]
+    zoom = [fftb.fast_length(size*scale_factor)/float(size)
+            for size in lr_shape]
+    if np.ndim(lr_image) == 3:
+        Ih = ndimage.zoom(lr_image, [1] + zoom, order=0)
+        hr_shape = np.shape(Ih)[1:]
+    else:
+        Ih = ndimage.zoom(lr_image, zoom, order=0)  # HR image
+        hr_shape = np.shape(Ih)
     return Ih, hr_shape
 
 
-def preprocess_images(samples, backgrounds, xoff, yoff, cfg, corr_mode='background'):
+def preprocess_images(samples, backgrounds, xoff, yoff, cfg, corr_mode='background',
+                      cache=None):
     """ Applies a correction method to all the sampled images. Some of the
     methods need backroung images to substract illumination inhomogeneities.
 
     Args:
     -----
-        samples: the acquired samples as a dictionary with angles as keys.
-        backgrounds: the acquired background as a dictionary with angles as
-                     keys. They must be acquired right after or before taking
-                     the samples.
+        samples: the acquired samples as a SampleStack (legacy dictionaries
+                 are converted).
+        backgrounds: the acquired background as a SampleStack. They must be
+                     acquired right after or before taking the samples.
         xoff: offset in the 'x' direction of this sample's center.
         yoff: offset in the 'y' direction of this sample's center.
         cfg: configuration (named tuple)
         corr_mode: the correction method
             * background: substracts  backround from samples.
             * bypass: does nothing (what a wonderful method!)
+        cache: a PreprocessCache (see cache.py) the corrected stack is read
+               from or stored in, True for the one set by cfg, False for
+               none. Taken from cfg.preprocess_cache if not given.
 
     Returns:
     --------
-        (dictionary) dictionary with teh corrected samples.
+        (SampleStack) stack with the corrected samples.
     """
-    iterator = ct.set_iterator(cfg)
+    samples = as_stack(samples, cfg)
     if corr_mode == 'background':
-        for index, theta, shift, aqcpars in iterator:
-            sample = fpmm.crop_image(samples[(theta, shift)],
-                                     cfg.patch_size, xoff, yoff)
-            background = fpmm.crop_image(backgrounds[(theta, shift)],
-                                         cfg.patch_size, xoff, yoff)
-            im_array = image_correction(sample, background, mode=corr_mode)
-            im_array, resc_size = image_rescaling(im_array, cfg)
-            samples[(theta, shift)] = im_array
+        backgrounds = as_stack(backgrounds, cfg)
+        if cache is None:
+            cache = getattr(cfg, 'preprocess_cache', False)
+        if cache is True:
+            cache = PreprocessCache.from_config(cfg)
+        if cache:
+            key = cache.key(samples, backgrounds, xoff, yoff, cfg, corr_mode)
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+        backgrounds = backgrounds.subset(samples.keys())
+        sample = samples.crop(cfg.patch_size, xoff, yoff).images
+        background = backgrounds.crop(cfg.patch_size, xoff, yoff).images
+        im_array = image_correction(sample, background, mode=corr_mode)
+        im_array, resc_size = image_rescaling(im_array, cfg)
+        samples = SampleStack(im_array, samples.index, normalize=False)
+        if cache:
+            cache.put(key, samples)
     if corr_mode == 'bypass':
         do_nothing = 1
     return samples
 
 
 def initialize(hrsize=None, backgrounds=None, xoff=None, yoff=None, cfg=None,
-               mode='zero'):
+               mode='zero', samples=None, precision=None, pupil_radius=None,
+               kdsc=None, plan=None, pupil=None):
     """ Initializes the algorithm using one of various modalities.
 
     Args:
     -----
-        samples: the acquired samples as a dictionary with angles as keys.
-        backgrounds: the acquired background as a dictionary with angles as
-                     keys. They must be acquired right after or before taking
-                     the samples.
+        hrsize: shape of the high resolution image.
+        backgrounds: the acquired background as a SampleStack. They must be
+                     acquired right after or before taking the samples.
         xoff: offset in the 'x' direction of this sample's center.
         yoff: offset in the 'y' direction of this sample's center.
         cfg: configuration (named tuple)
@@ -180,6 +210,13 @@ def initialize(hrsize=None, backgrounds=None, xoff=None, yoff=None, cfg=None,
             * transmission: the transmitted image at (0, 0) angles.
             * mean: takes all the samples and substracts the (measured)
                     backround. Then takes the mean of all of them.
+            * dpc: the closed form DPC estimate of the bright field samples
+                   (see dpc_init()), no backgrounds needed.
+        samples: the acquired samples as a SampleStack (legacy dictionaries
+                 are converted).
+        precision: 'double' (complex128) or 'single' (complex64).
+        pupil_radius, kdsc, plan, pupil: reconstruction settings of the dpc
+                                         mode, see dpc_init().
 
     Returns:
     --------
@@ -199,21 +236,25 @@ def initialize(hrsize=None, backgrounds=None, xoff=None, yoff=None, cfg=None,
         Ph = np.zeros_like(Ih_sq)  # and null phase
         Et = Ih_sq * np.exp(1j*Ph)
     elif mode == 'mean':
-        corr_ims = list()
-        iterator = fpmm.set_iterator(cfg)
-        for index, theta, shift in iterator:
-            # Final step: squared inverse fft for visualization
-            image = fpmm.crop_image(samples[(theta, shift)],
-                                       cfg.patch_size, xoff, yoff)
-            background = fpmm.crop_image(backgrounds[(theta, shift)],
-                                         cfg.patch_size, xoff, yoff)
-            image, image_size = image_rescaling(image, cfg)
-            background, image_size = image_rescaling(background, cfg)
-            corr_ims.append(image_correction(image, background, mode='background'))
-        Ih = np.mean(corr_ims, axis=0)
+        samples = as_stack(samples, cfg)
+        backgrounds = as_stack(backgrounds, cfg).subset(samples.keys())
+        image = samples.crop(cfg.patch_size, xoff, yoff).images
+        background = backgrounds.crop(cfg.patch_size, xoff, yoff).images
+        image, image_size = image_rescaling(image, cfg)
+        background, image_size = image_rescaling(background, cfg)
+        Ih = np.mean(image_correction(image, background, mode='background'),
+                     axis=0)
         # Ph = 0.5+np.pi*np.abs(Et)/np.max(Et)
         Et = np.sqrt(Ih) * np.exp(1j*0)
-    return Et
+    elif mode == 'dpc':
+        samples = as_stack(samples, cfg).crop(cfg.patch_size, xoff, yoff)
+        spectrum = dpc_init(samples, pupil_radius, kdsc, cfg, hrsize, plan,
+                            pupil, precision=precision)
+        Et = ifft2(ifftshift(spectrum))
+    else:
+        raise ValueError("Unknown initialization mode '%s'." % mode)
+    real_dtype, complex_dtype = fpmm.precision_dtypes(precision)
+    return Et.astype(complex_dtype)
 
 
 def generate_il(im_array, f_ih, theta, phi, cfg):
@@ -242,114 +283,574 @@ def generate_il(im_array, f_ih, theta, phi, cfg):
     # Iupdate *= 150
     return Iupdate
 
+def defocus_pupil(lrsize=None, pupil_radius=None, zfocus=0, cfg=None,
+                  precision=None):
+    """ Coherent transfer function (circular pupil) with an added defocus
+    aberration.
+
+    Args:
+    -----
+        lrsize: size of the low resolution samples.
+        pupil_radius: radius of the pupil in pixels.
+        zfocus: defocus distance (in meters).
+        cfg: configuration (named tuple)
+        precision: 'double' (complex128) or 'single' (complex64).
+
+    Returns:
+    --------
+        (ndarray) complex (lrsize, lrsize) pupil, centered (shifted).
+    """
+    CTF = fpmm.generate_pupil(0, 0, [lrsize, lrsize], pupil_radius)
+    # focus test
+    # dky = 2*np.pi/(float(cfg.ps_req)*hrshape[0])
+    kmax = np.pi/float(cfg.pixel_size)
+    step = kmax/((lrsize-1)/2)
+    kxm, kym = np.meshgrid(np.arange(-kmax,kmax+1,step), np.arange(-kmax,kmax+1, step));
+    k0 = 2*np.pi/float(cfg.wavelength)
+    kzm = np.sqrt(k0**2-kxm**2-kym**2);
+    pupil = np.exp(1j*zfocus*np.real(kzm))*np.exp(-np.abs(zfocus)*np.abs(np.imag(kzm)));
+    real_dtype, complex_dtype = fpmm.precision_dtypes(precision)
+    return (CTF*pupil).astype(complex_dtype)
+
 # im_array, theta, phi, lrsize, pupil_radius, kdsc
 
 def fpm_reconstruct(samples=None, hrshape=None, it=None, pupil_radius=None,
-                    kdsc=None, cfg=None,  debug=False):
+                    kdsc=None, cfg=None, plan=None, precision=None,
+                    stopping=None, pupil=None, pupil_step=None, spectrum=None,
+                    checkpoint=None, checkpoint_every=None, resume=None,
+                    method=None, step=None, momentum=None, ordering=None,
+                    calibration=None, debug=False):
     """ FPM reconstructon using the alternating projections algorithm. Here
     the complete samples and (optional) background images are loaded and Then
     cropped according to the patch size set in the configuration tuple (cfg).
 
     Args:
     -----
-        samples: the acquired samples as a dictionary with angles as keys.
+        samples: the acquired samples as a SampleStack. Legacy dictionaries
+                 with (nx, ny) keys are converted (and normalised) once.
+        hrshape: shape of the high resolution reconstruction. None takes
+                 the smallest fast FFT grid the illumination needs (see
+                 plan.hr_grid_shape()).
         backgrounds: the acquired background as a dictionary with angles as
                      keys. They must be acquired right after or before taking
                      the samples.
         it: iterator with additional sampling information for each sample.
         init_point: [xoff, yoff] center of the patch to be reconstructed.
         cfg: configuration (named tuple)
-        debug: set it to 'True' if you want to see the reconstruction proccess
-               (it slows down the reconstruction).
+        plan: a ReconstructionPlan with the illumination geometry. It is built
+              from cfg, kdsc and hrshape if not given, and can be reused for
+              datasets sharing the same geometry.
+        precision: 'double' (complex128) or 'single' (complex64). Taken from
+                   cfg.precision if not given.
+        stopping: a StoppingRule, built from cfg (n_iter, stop_tolerance,
+                  stop_patience and stop_max_time) if not given.
+        pupil: initial pupil, as an array or a file saved by
+               data.save_pupil(). The defocused CTF is used if not given.
+        pupil_step: step size of the embedded pupil recovery (EPRY), taken
+                    from cfg.pupil_step if not given. 0 keeps the pupil fixed.
+                    The pupil is updated from the second iteration on, once
+                    the object estimate has settled.
+        spectrum: initial (centered) high resolution spectrum, e.g. from a
+                  previous ReconstructionResult, or 'dpc' for the closed
+                  form DPC estimate (see dpc_init()). A flat object if not
+                  given.
+        checkpoint: file where the state of the run (spectrum, pupil,
+                    iteration, LED cursor and errors) is periodically saved,
+                    in a background thread.
+        checkpoint_every: LED updates between checkpoints, taken from
+                          cfg.checkpoint_every if not given (0 or None
+                          checkpoints once per iteration).
+        resume: checkpoint file to continue a previous run from. Its
+                spectrum and pupil replace the spectrum and pupil arguments,
+                and the state of the momentum and adam methods is restored
+                (the method must be the one of the checkpoint), as well
+                as the LED positions and the state of the calibration.
+        method: update rule, 'gs', 'gauss_newton', 'momentum' or 'adam' (see
+                solvers.py). Taken from cfg.solver if not given.
+        step: step size of the update rule (cfg.solver_step if not given).
+        momentum: momentum of the 'momentum' and 'adam' (beta1) rules
+                  (cfg.solver_momentum if not given).
+        ordering: LED update order within every pass, an LedOrdering or one
+                  of its strategies ('plan', 'energy', 'radial', 'random',
+                  see ordering.py). Taken from cfg.led_ordering if not
+                  given. It is recorded in the result metadata.
+        calibration: LED position self-calibration (see calibration.py), an
+                     LedCalibration, or taken from cfg.led_calibration_every
+                     (0 disables it) if not given. The calibrated plan is a
+                     copy, the one given is not modified. The fitted matrix
+                     model and LED positions are recorded in the result
+                     metadata.
+        debug: set it to 'True' if you want to see the reconstruction proccess.
+               Snapshots are drawn by a separate process (see viewer.py), at
+               most cfg.viewer_fps per second.
 
     Returns:
     --------
-        (ndarray) The reconstructed modulus and phase of the sampled image.
+        (ReconstructionResult) The reconstructed modulus and phase of the
+        sampled image (it unpacks as mag, phase) with the error of every
+        iteration.
     """
+    if precision is None:
+        precision = getattr(cfg, 'precision', 'double')
+    real_dtype, complex_dtype = fpmm.precision_dtypes(precision)
     # Getting the maximum angle by the given configuration
     # Step 1: initial estimation
     # objectRecover = initialize(hrshape, cfg, 'zero')
-    objectRecover = np.ones(hrshape)
-    lrsize = samples[(15, 15)].shape[0]
-    xc, yc = fpmm.image_center(hrshape)
-    print(lrsize, pupil_radius)
-    CTF = fpmm.generate_pupil(0, 0, [lrsize, lrsize], pupil_radius)
-    # focus test
-    # dky = 2*np.pi/(float(cfg.ps_req)*hrshape[0])
-    kmax = np.pi/float(cfg.pixel_size)
-    step = kmax/((lrsize-1)/2)
-    kxm, kym = np.meshgrid(np.arange(-kmax,kmax+1,step), np.arange(-kmax,kmax+1, step));
-    z = -.35E-6
-    k0 = 2*np.pi/float(cfg.wavelength)
-    kzm = np.sqrt(k0**2-kxm**2-kym**2);
-    pupil = np.exp(1j*z*np.real(kzm))*np.exp(-np.abs(z)*np.abs(np.imag(kzm)));
-    pupil = CTF*pupil;
+    samples = as_stack(samples, cfg, dtype=real_dtype)
+    lrsize = samples.shape[1]
+    if plan is None:
+        plan = ReconstructionPlan(cfg, kdsc, lrsize, hrshape,
+                                  pupil_radius=pupil_radius)
+    hrshape = plan.hrshape
+    objectRecover = np.ones(hrshape, dtype=real_dtype)
+    rows = samples.rows(plan.keys)
+    state = None
+    if resume is not None:
+        state = load_checkpoint(resume)
+        spectrum, pupil = state['spectrum'], state['pupil']
+        if np.shape(spectrum) != tuple(hrshape):
+            raise ValueError("Checkpoint spectrum shape %s does not match %s."
+                             % (np.shape(spectrum), tuple(hrshape)))
+    if pupil is None:
+        pupil = defocus_pupil(lrsize, pupil_radius, -.35E-6, cfg, precision)
+    elif isinstance(pupil, str):
+        pupil = dt.load_pupil(pupil)[0]
+    if np.shape(pupil) != (lrsize, lrsize):
+        raise ValueError("Pupil shape %s does not match the samples (%d, %d)."
+                         % (np.shape(pupil), lrsize, lrsize))
+    if pupil_step is None:
+        pupil_step = float(getattr(cfg, 'pupil_step', 0.))
+    fftb.set_backend(cfg)
+    fftb.plan_transforms([(lrsize, lrsize), tuple(hrshape)], complex_dtype)
 
-    objectRecoverFT = fftshift(fft2(objectRecover))  # shifted transform
+    if isinstance(spectrum, str) and spectrum == 'dpc':
+        spectrum = dpc_init(samples, pupil_radius, kdsc, cfg, plan=plan,
+                            pupil=pupil, precision=precision)
+    if spectrum is None:
+        objectRecoverFT = fftshift(fft2(objectRecover))  # shifted transform
+    else:
+        objectRecoverFT = np.array(spectrum)  # updated in place, keep a copy
+    objectRecoverFT = objectRecoverFT.astype(complex_dtype, copy=False)
+    viewer = None
     if debug:
-        fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(25, 15))
-        fig.show()
+        viewer = LiveViewer(max_fps=getattr(cfg, 'viewer_fps', 5))
     # Steps 2-5
-    factor = (lrsize/hrshape[0])**2
-    for iteration in range(cfg.n_iter):
-        iterator = ct.set_iterator(cfg)
-        print('Iteration n. %d' % iteration)
-        # Patching for testing
-        for it in iterator:
-            acqpars = it['acqpars']
-            # indexes, theta, phi = it['indexes'], it['theta'], it['phi']
-            indexes, kx_rel, ky_rel = ct.n_to_krels(it, cfg)
-            print(indexes, kx_rel, ky_rel)
-            if indexes[0] > 19 or indexes[0] < 11 or indexes[1] > 19 or indexes[1] < 11:
-                 continue
-            lr_sample = samples[it['indexes']]/(acqpars[1])
-            # From generate_il
-            # Calculating coordinates
-            [kx, ky] = kdsc*kx_rel, kdsc*ky_rel
-            # if kx > 80 or ky > 80:
-            #      continue
-            # [kx, ky] = ct.angles_to_k(theta, phi, kdsc)
-            # coords = np.array([np.sin(phi_rad)*np.cos(theta_rad),
-            #                    np.sin(phi_rad)*np.sin(theta_rad)])
-            # [kx, ky] = coords*kdsc
-            # f_ih_shift = fftshift(fft2(lr_sample))
-            kyl = int(np.round(yc+ky-(lrsize+1)/2))
-            kyh = kyl + lrsize
-            kxl = int(np.round(xc+kx-(lrsize+1)/2))
-            kxh = kxl + lrsize
-
-            # Il = generate_il(im_array, f_ih, theta, phi, cfg)
-            lowResFT = factor * objectRecoverFT[kyl:kyh, kxl:kxh]*pupil
-            # Step 2: lr of the estimated image using the known pupil
-            im_lowRes = ifft2(ifftshift(lowResFT))  # space pupil * fourier image
-            im_lowRes = 1/factor * lr_sample * np.exp(1j*np.angle(im_lowRes))
-            lowResFT = fftshift(fft2(im_lowRes))*pupil
-            objectRecoverFT[kyl:kyh, kxl:kxh] = (1-pupil)*objectRecoverFT[kyl:kyh, kxl:kxh] + lowResFT
-            # Step 3: spectral pupil area replacement
-            ####################################################################
-            # If debug mode is on
-            if debug and indexes[0] % 5 == 0:
-                im_out = ifft2(ifftshift(objectRecoverFT))
-                fft_rec = np.log10(np.abs(objectRecoverFT))
-                # fft_rec *= (255.0/fft_rec.max())
-                # Il = Image.fromarray(np.uint8(Il), 'L')
-                # im_rec *= (255.0/im_rec.max())
-                def plot_image(ax, image, title):
-                    ax.cla()
-                    ax.imshow(image, cmap=plt.get_cmap('gray'))
-                    ax.set_title(title)
-                axiter = iter([(ax1, 'Reconstructed FFT'), (ax2, 'Reconstructed magnitude'),
-                            (ax3, 'Acquired image'), (ax4, 'Reconstructed phase')])
-                for image in [np.abs(fft_rec), np.abs(im_out), lr_sample, np.angle(im_out)]:
-                    ax, title = next(axiter)
-                    plot_image(ax, image, title)
-                fig.canvas.draw()
+    if method is None:
+        method = getattr(cfg, 'solver', 'gs')
+    if step is None:
+        step = getattr(cfg, 'solver_step', None)
+    if momentum is None:
+        momentum = getattr(cfg, 'solver_momentum', None)
+    accelerator = solvers.make_accelerator(method, step, momentum)
+    if accelerator is None:
+        if step is None:
+            step = solvers.DEFAULT_STEPS[method]
+        workspace = UpdateWorkspace(plan, pupil, complex_dtype, method=method,
+                                    step=step,
+                                    delta=getattr(cfg, 'solver_delta', 1.))
+    else:
+        workspace = UpdateWorkspace(plan, pupil, complex_dtype)
+    if stopping is None:
+        stopping = StoppingRule.from_config(cfg)
+    stopping.reset()
+    start_iteration, cursor = 0, 0
+    if state is not None:
+        stopping.restore(state['errors'], state['times'])
+        start_iteration, cursor = state['iteration'], state['cursor']
+        if 'solver' in state and str(state['solver']) != method:
+            raise ValueError("Checkpoint written by the '%s' method, cannot "
+                             "resume it with '%s'." % (state['solver'], method))
+        if accelerator is not None:
+            if 'solver_pass_start' not in state:
+                raise ValueError("Checkpoint has no '%s' solver state to "
+                                 "resume from." % method)
+            # Resumes the pass in course with its saved starting spectrum
+            accelerator.set_state(state)
+    checkpointer = None
+    if checkpoint is not None:
+        if checkpoint_every is None:
+            checkpoint_every = getattr(cfg, 'checkpoint_every', 0)
+        checkpointer = Checkpointer(checkpoint, checkpoint_every or len(plan))
+    if not isinstance(ordering, LedOrdering):
+        ordering = LedOrdering.from_config(cfg, strategy=ordering)
+    if calibration is None:
+        calibration = LedCalibration.from_config(cfg)
+    if calibration.every or (state is not None and 'krels' in state):
+        plan = copy.copy(plan)  # its windows are replaced below
+    if state is not None and 'krels' in state:
+        plan.krels = state['krels']
+        plan.compute_windows()
+    if state is not None and 'calibration_params' in state:
+        calibration.set_state(state)
+    plan_images = [samples.images[n] for n in rows]
+    order = ordering.order(plan, plan_images)
+
+    def run_state(iteration, cursor):
+        """ Checkpoint of the run, cursor LEDs into the given iteration.
+        """
+        run = {'spectrum': objectRecoverFT, 'pupil': workspace.pupil,
+               'iteration': iteration, 'cursor': cursor,
+               'error': workspace.error, 'errors': stopping.errors,
+               'times': stopping.times, 'krels': plan.krels,
+               'solver': method}
+        if accelerator is not None:
+            run.update(accelerator.get_state())
+        if calibration.every or calibration.steps:
+            run.update(calibration.get_state())
+        return run
+
+    total = float(np.sum(samples.images[rows], dtype=np.float64))
+    for iteration in range(start_iteration, stopping.max_iter):
+        workspace.reset_error()
+        workspace.pupil_step = pupil_step if iteration > 0 else 0.
+        if iteration == start_iteration and cursor:
+            workspace.error = state['error']
+        if accelerator is not None and not (iteration == start_iteration
+                                            and cursor):
+            accelerator.start(objectRecoverFT)
+        if ordering.strategy == 'random':
+            order = ordering.order(plan, plan_images, iteration)
+        for position, p in enumerate(order):
+            if iteration == start_iteration and position < cursor:
+                continue  # already done before the checkpoint
+            lr_sample = plan_images[p]
+            # Steps 2 and 3: lr estimate using the known pupil, modulus
+            # replacement and spectral pupil area replacement (in place)
+            workspace.update(objectRecoverFT, plan.kyl[p], plan.kxl[p],
+                             lr_sample)
+            if checkpointer is not None:
+                checkpointer.step(lambda: run_state(iteration, position + 1))
+            # If debug mode is on (the viewer never blocks the loop)
+            if viewer is not None and viewer.due():
+                viewer.submit(spectrum_snapshot(objectRecoverFT, lr_sample,
+                                                viewer.size))
             # print("Testing quality metric", fpmm.quality_metric(samples, Il, cfg))
-    return np.abs(im_out), np.angle(im_out)
+        if accelerator is not None:
+            accelerator.apply(objectRecoverFT)
+        error = workspace.error/total
+        print('Iteration n. %d, error %.4e' % (iteration, error))
+        if stopping.update(error):
+            break
+        if calibration.due(iteration):
+            moved = calibration.step(plan, objectRecoverFT, workspace.pupil,
+                                     np.asarray(plan_images))
+            print('LED calibration: %d windows moved, rms residual %.2f px'
+                  % (moved, calibration.residual))
+    print('Stopped after %d iterations (%s)' % (len(stopping.errors),
+                                                 stopping.reason))
+    if checkpointer is not None:
+        checkpointer.close()
+    if viewer is not None:
+        viewer.close()
+    im_out = ifft2(ifftshift(objectRecoverFT))
+    result = ReconstructionResult(im_out, stopping, objectRecoverFT,
+                                  workspace.pupil)
+    result.metadata.update(ordering.describe(), solver=method)
+    if calibration.steps:
+        result.metadata.update(calibration.describe())
+        result.metadata['led_calibration']['krels'] = plan.krels.tolist()
+    return result
+
+
+def scatter_add(flat_index, values, size):
+    """ Sums complex values into a flat array of the given size, adding up
+    the contributions of repeated indexes (overlapping LED windows).
+    """
+    flat_index = flat_index.ravel()
+    values = values.ravel()
+    real = np.bincount(flat_index, weights=values.real, minlength=size)
+    imag = np.bincount(flat_index, weights=values.imag, minlength=size)
+    return real + 1j*imag
+
+
+def fpm_reconstruct_batch(samples=None, hrshape=None, pupil_radius=None,
+                          kdsc=None, cfg=None, plan=None, step=1.,
+                          momentum=.6, pupil_step=0., precision=None,
+                          stopping=None, pupil=None, debug=False):
+    """ FPM reconstruction using parallel (gradient) updates. In contrast to
+    fpm_reconstruct(), where the spectrum is updated after every LED, here
+    all the LED windows are extracted at once, propagated with batched
+    (n_leds, lrsize, lrsize) FFTs and the corrections of every LED are
+    accumulated (scatter-add) into a single spectrum update per iteration.
+
+    A pass runs a handful of array operations instead of one update per
+    LED, so it costs about the same as a sequential pass with numpy's
+    single threaded FFTs and gains from multithreaded backends (see
+    fftbackend.py). Parallel updates converge more slowly than sequential
+    ones though: even with the heavy-ball momentum they need several times
+    more passes to reach the same error (see
+    simulations/benchmark_batch.py), so this is an alternative for many
+    core nodes rather than a faster default.
+
+    Args:
+    -----
+        samples: the acquired samples as a SampleStack (legacy dictionaries
+                 are converted).
+        hrshape: shape of the high resolution reconstruction (None sizes
+                 it from the illumination, see fpm_reconstruct()).
+        pupil_radius: radius of the pupil in pixels.
+        kdsc: conversion factor from relative k to discrete spectrum pixels.
+        cfg: configuration (named tuple)
+        plan: a ReconstructionPlan, built from cfg if not given.
+        step: spectrum update step size (1 is a full projection).
+        momentum: heavy-ball momentum of the spectrum update, the update of
+                  every iteration adds momentum times the previous one
+                  (0 for plain gradient steps).
+        pupil_step: pupil update step size (0 keeps the pupil fixed).
+        precision: 'double' (complex128) or 'single' (complex64). Taken from
+                   cfg.precision if not given.
+        stopping: a StoppingRule, built from cfg if not given.
+        pupil: initial pupil, as an array or a file saved by
+               data.save_pupil(). The defocused CTF is used if not given.
+        debug: prints the update norm on every iteration.
+
+    Returns:
+    --------
+        (ReconstructionResult) The reconstructed modulus and phase of the
+        sampled image, see fpm_reconstruct().
+    """
+    if precision is None:
+        precision = getattr(cfg, 'precision', 'double')
+    real_dtype, complex_dtype = fpmm.precision_dtypes(precision)
+    samples = as_stack(samples, cfg, dtype=real_dtype)
+    lrsize = samples.shape[1]
+    if plan is None:
+        plan = ReconstructionPlan(cfg, kdsc, lrsize, hrshape,
+                                  pupil_radius=pupil_radius)
+    images = samples.images[samples.rows(plan.keys)].astype(real_dtype,
+                                                             copy=False)
+    if pupil is None:
+        pupil = defocus_pupil(lrsize, pupil_radius, -.35E-6, cfg, precision)
+    elif isinstance(pupil, str):
+        pupil = dt.load_pupil(pupil)[0]
+    if np.shape(pupil) != (lrsize, lrsize):
+        raise ValueError("Pupil shape %s does not match the samples (%d, %d)."
+                         % (np.shape(pupil), lrsize, lrsize))
+    # Updated in place by the pupil recovery, the caller's pupil is kept
+    pupil = np.array(pupil, dtype=complex_dtype)
+    support = np.abs(pupil) > 0
+    factor = plan.factor
+    flat_index = plan.flat_windows()
+    # Only the pixels under the pupil support are gathered and scattered
+    support_index = np.flatnonzero(support)
+    sparse_index = flat_index.reshape(len(plan), -1)[:, support_index]
+    size = plan.hrshape[0]*plan.hrshape[1]
+    axes = (-2, -1)
+
+    fftb.set_backend(cfg)
+    fftb.plan_transforms([(len(plan), lrsize, lrsize)], complex_dtype, axes)
+    objectRecoverFT = fftshift(fft2(np.ones(plan.hrshape, dtype=real_dtype)))
+    objectRecoverFT = objectRecoverFT.astype(complex_dtype, copy=False).ravel()
+    # Preallocated buffers, the loop works in place as UpdateWorkspace does
+    lowResFT = np.zeros((len(plan), lrsize, lrsize), dtype=complex_dtype)
+    flat_lowres = lowResFT.reshape(len(plan), -1)
+    field = np.empty_like(lowResFT)
+    updated = np.empty_like(lowResFT)
+    modulus = np.empty(lowResFT.shape, dtype=real_dtype)
+    residual = np.empty(lowResFT.shape, dtype=real_dtype)
+    windows = np.empty(sparse_index.shape, dtype=complex_dtype)
+    exit_waves = np.empty_like(windows)
+    velocity = np.zeros_like(objectRecoverFT)
+    tiny = np.sqrt(np.finfo(real_dtype).tiny)
+    if stopping is None:
+        stopping = StoppingRule.from_config(cfg)
+    stopping.reset()
+    total = float(np.sum(images, dtype=np.float64))
+    overlap = None
+    for iteration in range(stopping.max_iter):
+        support_pupil = pupil.ravel()[support_index]
+        np.take(objectRecoverFT, sparse_index, out=windows)
+        np.multiply(windows, support_pupil, out=exit_waves)
+        flat_lowres[:, support_index] = factor * exit_waves
+        # Shift-free transforms, see fpm_reconstruct()
+        ifft2(lowResFT, axes=axes, out=field)
+        # Modulus constraint applied to every LED at once, as in
+        # UpdateWorkspace.update() (exact zeros take a null phase)
+        np.add(field, tiny, out=field)
+        np.abs(field, out=modulus)
+        np.subtract(images, modulus, out=residual)
+        np.abs(residual, out=residual)
+        error = float(residual.sum(dtype=np.float64))/total
+        print('Iteration n. %d, error %.4e' % (iteration, error))
+        np.multiply(modulus, factor, out=modulus)
+        np.divide(images, modulus, out=modulus)
+        np.multiply(field, modulus, out=field)
+        fft2(field, axes=axes, out=updated)
+        # Exit wave correction of every LED
+        np.subtract(updated.reshape(len(plan), -1)[:, support_index],
+                    exit_waves, out=exit_waves)
+        # Spectrum gradient, normalised by the pupil overlap of each pixel
+        gradient = scatter_add(sparse_index,
+                               np.conj(support_pupil)*exit_waves, size)
+        if overlap is None or pupil_step:
+            overlap = scatter_add(sparse_index,
+                                  np.broadcast_to(np.abs(support_pupil)**2,
+                                                  exit_waves.shape),
+                                  size).real
+        if pupil_step:
+            # Normalised by the whole windows, before the spectrum update
+            norm = np.max(np.sum(np.abs(objectRecoverFT[flat_index])**2,
+                                 axis=0))
+        velocity *= momentum
+        velocity += (step * gradient/(overlap + 1E-12)).astype(complex_dtype)
+        objectRecoverFT += velocity
+        if pupil_step:
+            pupil_grad = np.sum(np.conj(windows)*exit_waves, axis=0)
+            pupil.ravel()[support_index] += (
+                pupil_step * pupil_grad/norm).astype(complex_dtype)
+        if debug:
+            print('Update norm %.3e' % np.linalg.norm(gradient))
+        if stopping.update(error):
+            break
+    print('Stopped after %d iterations (%s)' % (iteration + 1, stopping.reason))
+    objectRecoverFT = objectRecoverFT.reshape(plan.hrshape)
+    im_out = ifft2(ifftshift(objectRecoverFT))
+    return ReconstructionResult(im_out, stopping, objectRecoverFT, pupil)
+
+
+def fpm_reconstruct_multiplexed(samples=None, hrshape=None, pupil_radius=None,
+                                kdsc=None, cfg=None, plan=None, precision=None,
+                                stopping=None, pupil=None, method=None,
+                                step=None, momentum=None, n_leds=None):
+    """ FPM reconstruction of a multiplexed acquisition, where every exposure
+    was taken with several LEDs lit at once (see ct.multiplex_iterator()).
+    Each exposure's intensity is split among its LEDs by the incoherent
+    forward model (see UpdateWorkspace.update_multiplexed()), so the
+    spectrum is recovered from fewer exposures than LEDs.
+
+    Args:
+    -----
+        samples: dictionary of the acquired samples keyed by the tuple of
+                 (nx, ny) LEDs of each exposure (the 'indexes' of
+                 ct.multiplex_iterator()). They are normalised by the
+                 shutter speed of their pattern, patterns the iterator does
+                 not schedule raise a ValueError. Or a SampleStack (or
+                 on-disk stack) with one row per exposure, keyed by the
+                 first LED of its pattern, e.g. written with
+                 StackWriter.add(it['pattern'][0], frame, it['acqpars']).
+                 Stacks are already normalised.
+        hrshape: shape of the high resolution reconstruction (None sizes
+                 it from the illumination, see fpm_reconstruct()).
+        pupil_radius: radius of the pupil in pixels.
+        kdsc: conversion factor from relative k to discrete spectrum pixels.
+        cfg: configuration (named tuple)
+        plan: a ReconstructionPlan with every LED in the patterns, built from
+              cfg if not given.
+        precision: 'double' (complex128) or 'single' (complex64). Taken from
+                   cfg.precision if not given.
+        stopping: a StoppingRule, built from cfg if not given.
+        pupil: initial pupil (array or data.save_pupil() file), the defocused
+               CTF if not given. It is not updated.
+        method, step, momentum: update rule, see fpm_reconstruct().
+        n_leds: LEDs per pattern the stack was acquired with, taken from
+                cfg.multiplex if not given (dictionaries carry their patterns
+                in the keys).
+
+    Returns:
+    --------
+        (ReconstructionResult) The reconstructed modulus and phase of the
+        sampled image, see fpm_reconstruct().
+    """
+    if precision is None:
+        precision = getattr(cfg, 'precision', 'double')
+    real_dtype, complex_dtype = fpmm.precision_dtypes(precision)
+    if isinstance(samples, dict):
+        keys = [tuple(tuple(int(n) for n in led) for led in key)
+                for key in samples.keys()]
+        images = np.array([samples[key] for key in samples.keys()],
+                          dtype=real_dtype)
+        # Exposure normalisation, from the schedule the patterns were taken
+        # with
+        n_leds = max(len(key) for key in keys)
+        acqpars = dict((it['indexes'], it['acqpars'])
+                       for it in ct.multiplex_iterator(cfg, n_leds))
+        unknown = [key for key in keys if key not in acqpars]
+        if unknown:
+            raise ValueError("Patterns %s are not scheduled by "
+                             "ct.multiplex_iterator(), their exposure is "
+                             "unknown." % sorted(unknown))
+        for image, key in zip(images, keys):
+            image /= acqpars[key][1]
+    else:
+        stack = as_stack(samples, cfg, real_dtype)
+        if n_leds is None:
+            n_leds = getattr(cfg, 'multiplex', 1)
+        patterns = dict((it['pattern'][0], it['indexes'])
+                        for it in ct.multiplex_iterator(cfg, n_leds))
+        firsts = [(int(nx), int(ny)) for nx, ny in zip(stack.index['nx'],
+                                                      stack.index['ny'])]
+        unknown = [led for led in firsts if led not in patterns]
+        if unknown:
+            raise ValueError("No pattern of %d LEDs starts at %s in "
+                             "ct.multiplex_iterator()." %
+                             (n_leds, sorted(unknown)))
+        keys = [patterns[led] for led in firsts]
+        images = np.array(stack.images, dtype=real_dtype)
+    lrsize = images.shape[1]
+    if plan is None:
+        plan = ReconstructionPlan(cfg, kdsc, lrsize, hrshape,
+                                  pupil_radius=pupil_radius)
+    hrshape = plan.hrshape
+    positions = dict((tuple(key), n) for n, key in enumerate(plan.keys))
+    missing = set(led for key in keys for led in key) - set(positions)
+    if missing:
+        raise ValueError("LEDs %s are not in the reconstruction plan." %
+                         sorted(missing))
+    groups = [np.array([positions[led] for led in key]) for key in keys]
+    # Follow the plan order of the first LED of every exposure
+    order = np.argsort([group.min() for group in groups], kind='stable')
+    if pupil is None:
+        pupil = defocus_pupil(lrsize, pupil_radius, -.35E-6, cfg, precision)
+    elif isinstance(pupil, str):
+        pupil = dt.load_pupil(pupil)[0]
+    fftb.set_backend(cfg)
+    fftb.plan_transforms([(lrsize, lrsize), tuple(hrshape)], complex_dtype)
+    objectRecoverFT = fftshift(fft2(np.ones(hrshape, dtype=real_dtype)))
+    objectRecoverFT = objectRecoverFT.astype(complex_dtype, copy=False)
+    if method is None:
+        method = getattr(cfg, 'solver', 'gs')
+    if step is None:
+        step = getattr(cfg, 'solver_step', None)
+    if momentum is None:
+        momentum = getattr(cfg, 'solver_momentum', None)
+    accelerator = solvers.make_accelerator(method, step, momentum)
+    if accelerator is None:
+        if step is None:
+            step = solvers.DEFAULT_STEPS[method]
+        workspace = UpdateWorkspace(plan, pupil, complex_dtype, method=method,
+                                    step=step,
+                                    delta=getattr(cfg, 'solver_delta', 1.))
+    else:
+        workspace = UpdateWorkspace(plan, pupil, complex_dtype)
+    if stopping is None:
+        stopping = StoppingRule.from_config(cfg)
+    stopping.reset()
+    total = float(np.sum(images, dtype=np.float64))
+    print('%d exposures for %d LEDs' % (len(keys),
+                                         sum(len(key) for key in keys)))
+    for iteration in range(stopping.max_iter):
+        workspace.reset_error()
+        if accelerator is not None:
+            accelerator.start(objectRecoverFT)
+        for n in order:
+            group = groups[n]
+            workspace.update_multiplexed(objectRecoverFT, plan.kyl[group],
+                                         plan.kxl[group], images[n])
+        if accelerator is not None:
+            accelerator.apply(objectRecoverFT)
+        error = workspace.error/total
+        print('Iteration n. %d, error %.4e' % (iteration, error))
+        if stopping.update(error):
+            break
+    print('Stopped after %d iterations (%s)' % (len(stopping.errors),
+                                                 stopping.reason))
+    im_out = ifft2(ifftshift(objectRecoverFT))
+    return ReconstructionResult(im_out, stopping, objectRecoverFT,
+                                workspace.pupil)
 
 
 def fpm_reconstruct_wrap(samples=None, hrshape=None, it=None, pupil_radius=None,
-                    kdsc=None, cfg=None,  debug=False):
+                    kdsc=None, cfg=None,  debug=False, offsets=None):
     """ FPM reconstructon using the alternating projections algorithm. Here
     the complete samples and (optional) background images are loaded and Then
     cropped according to the patch size set in the configuration tuple (cfg).
@@ -365,6 +866,11 @@ def fpm_reconstruct_wrap(samples=None, hrshape=None, it=None, pupil_radius=None,
         cfg: configuration (named tuple)
         debug: set it to 'True' if you want to see the reconstruction proccess
                (it slows down the reconstruction).
+        offsets: (xoff, yoff) LED matrix offsets tried, xoff from -0.45 to
+                 1.45 (yoff -0.1) by default.
+        hrshape: shape of the high resolution reconstruction, shared by
+                 every offset. None sizes it to fit all of them (see
+                 plan.offset_grid_shape()).
 
     Returns:
     --------
@@ -376,21 +882,17 @@ def fpm_reconstruct_wrap(samples=None, hrshape=None, it=None, pupil_radius=None,
     # Step 1: initial estimation
     # objectRecover = initialize(hrshape, cfg, 'zero')
     im_out = None
+    samples = as_stack(samples, cfg)
+    lrsize = samples.shape[1]
+    if offsets is None:
+        offsets = [(-0.45+0.1*n, -.1) for n in range(20)]
+    if hrshape is None:
+        hrshape = offset_grid_shape(cfg, kdsc, lrsize, pupil_radius, offsets)
     objectRecover = np.ones(hrshape)
-    lrsize = samples[(15, 15)].shape[0]
     xc, yc = fpmm.image_center(hrshape)
 
     def pupil_wrap(zfocus, radius):
-        CTF = fpmm.generate_pupil(0, 0, [lrsize, lrsize], pupil_radius)
-        # focus test
-        # dky = 2*np.pi/(float(cfg.ps_req)*hrshape[0])
-        kmax = np.pi/float(cfg.pixel_size)
-        step = kmax/((lrsize-1)/2)
-        kxm, kym = np.meshgrid(np.arange(-kmax,kmax+1,step), np.arange(-kmax,kmax+1, step));
-        k0 = 2*np.pi/float(cfg.wavelength)
-        kzm = np.sqrt(k0**2-kxm**2-kym**2);
-        pupil = np.exp(1j*zfocus*np.real(kzm))*np.exp(-np.abs(zfocus)*np.abs(np.imag(kzm)));
-        return CTF*pupil;
+        return defocus_pupil(lrsize, radius, zfocus, cfg)
 
     objectRecoverFT = fftshift(fft2(objectRecover))  # shifted transform
     if debug:
@@ -403,43 +905,23 @@ def fpm_reconstruct_wrap(samples=None, hrshape=None, it=None, pupil_radius=None,
     im_cmp = im_cmp.resize(hrshape)
     im_cmp = np.array(im_cmp)
     im_cmp = im_cmp.astype('float64')
-    for iteration in range(20):
+    for xoff, yoff in offsets:
         objectRecoverFT = fftshift(fft2(objectRecover))  # shifted transform
 
         zfocus = (-.4E-6)
-        xoff = -0.45+0.1*iteration
-        yoff = -.1.
         pupil = pupil_wrap(zfocus, pupil_radius)
         print(xoff, yoff, zfocus*1E6)
         if im_out is not None:
             im_out /= np.amax(im_out)
             im_cmp /= np.amax(im_cmp)
             print('ssim %.2f' % ssim(im_cmp, im_out))
+        plan = ReconstructionPlan(cfg, kdsc, lrsize, hrshape, xoff, yoff)
+        rows = samples.rows(plan.keys)
+        workspace = UpdateWorkspace(plan, pupil)
         for iteration in range(5):
-            iterator = ct.set_iterator(cfg)
             print('Iteration n. %d' % iteration)
-            # Patching for testing
-            for it in iterator:
-                acqpars = it['acqpars']
-                indexes, kx_rel, ky_rel = ct.n_to_krels(it, cfg, xoff, yoff)
-                if indexes[0] > 19 or indexes[0] < 11 or indexes[1] > 19 or indexes[1] < 11:
-                     continue
-                lr_sample = samples[it['indexes']]/(acqpars[1])
-                # From generate_il
-                # Calculating coordinates
-                [kx, ky] = kdsc*kx_rel, kdsc*ky_rel
-                kyl = int(np.round(yc+ky-(lrsize+1)/2))
-                kyh = kyl + lrsize
-                kxl = int(np.round(xc+kx-(lrsize+1)/2))
-                kxh = kxl + lrsize
-
-                # Il = generate_il(im_array, f_ih, theta, phi, cfg)
-                lowResFT = factor * objectRecoverFT[kyl:kyh, kxl:kxh]*pupil
-                # Step 2: lr of the estimated image using the known pupil
-                im_lowRes = ifft2(ifftshift(lowResFT))  # space pupil * fourier image
-                im_lowRes = 1/factor * lr_sample * np.exp(1j*np.angle(im_lowRes))
-                lowResFT = fftshift(fft2(im_lowRes))*pupil
-                objectRecoverFT[kyl:kyh, kxl:kxh] = (1-pupil)*objectRecoverFT[kyl:kyh, kxl:kxh] + lowResFT
+            for n, kyl, kxl in zip(rows, plan.kyl, plan.kxl):
+                workspace.update(objectRecoverFT, kyl, kxl, samples.images[n])
                 # Step 3: spectral pupil area replacement
                 ####################################################################
         im_out = np.abs(ifft2(ifftshift(objectRecoverFT)))
@@ -543,62 +1025,52 @@ def fpm_reconstruct_wrap(samples=None, hrshape=None, it=None, pupil_radius=None,
 #     return np.abs(np.power(ifft2(f_ih), 2)), np.angle(ifft2(f_ih+1))
 
 
-def dpc_init(samples=None, backgrounds=None, it=None, init_point=None,
-             cfg=None,  debug=False):
-    """ Absolutely experimental reconstruction function. Virtually analog to
-    fpm_reconstruct() to be used as a test sandbox.
+def dpc_init(samples=None, pupil_radius=None, kdsc=None, cfg=None,
+             hrshape=None, plan=None, pupil=None, regularization=None,
+             precision=None):
+    """ Closed form differential phase contrast initial estimate (see
+    dpc.py), from the bright field LEDs of the samples. It takes a few
+    milliseconds and starts the iterative reconstruction from the low
+    frequency phase instead of a flat object.
+
+    Args:
+    -----
+        samples: the acquired samples as a SampleStack (legacy dictionaries
+                 are converted).
+        pupil_radius: radius of the pupil in pixels.
+        kdsc: conversion factor from relative k to discrete spectrum pixels.
+        cfg: configuration (named tuple)
+        hrshape: shape of the high resolution reconstruction, see
+                 fpm_reconstruct().
+        plan: a ReconstructionPlan, built from cfg if not given.
+        pupil: pupil, as an array or a file saved by data.save_pupil(). The
+               defocused CTF of fpm_reconstruct() is used if not given.
+        regularization: Tikhonov parameter, cfg.dpc_regularization if not
+                        given.
+        precision: 'double' or 'single', taken from cfg.precision if not
+                   given.
+
+    Returns:
+    --------
+        (ndarray) initial centered high resolution spectrum, to be passed
+        as fpm_reconstruct(spectrum=...).
     """
-    # pc = PlatformCoordinates(theta=0, phi=0, height=cfg.sample_height, cfg=cfg)
-    xoff, yoff = init_point  # Selection of the image patch
-    ps_required = fpmm.ps_required(cfg.phi[1], cfg.wavelength, cfg.na)
-    # mask = get_mask(samples, backgrounds, xoff, yoff, cfg)
-    # Getting the maximum angle by the given configuration
-    # Step 1: initial estimation
-    Et = initialize(samples, backgrounds, xoff, yoff, cfg, 'zero')
-    f_ih = fft2(Et)  # unshifted transform, shift is later applied to the pupil
-    if debug:
-        fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(25, 15))
-        fig.show()
-        # fig, axes = implot.init_plot(4)
-    # Steps 2-5
-    for iteration in range(cfg.n_iter):
-        iterator = ct.set_iterator(cfg)
-        print('Iteration n. %d' % iteration)
-        # Patching for testing
-        for index, theta, shift in iterator:
-            theta, phi = ct.corrected_coordinates(theta=theta, shift=shift,
-                                                  cfg=cfg)
-            print(theta, phi)
-            # Final step: squared inverse fft for visualization
-            im_array = fpmm.crop_image(samples[(theta, shift)],
-                                       cfg.patch_size, xoff, yoff)
-            background = fpmm.crop_image(backgrounds[(theta, shift)],
-                                         cfg.patch_size, xoff, yoff)
-
-            im_array = image_correction(im_array, background, mode='background')
-            im_array, resc_size = image_rescaling(im_array, cfg)
-            Il = generate_il(im_array, f_ih, theta, phi, cfg)
-            #     print("Testing quality metric", quality_metric(image_dict, Il, cfg), phi)
-            pupil = fpmm.generate_pupil(theta=theta, phi=phi,
-                                        image_size=resc_size, wavelength=cfg.wavelength,
-                                        pixel_size=ps_required, na=cfg.objective_na)
-            pupil_shift = fftshift(pupil)
-            f_il = fft2(Il)
-            f_ih = f_il*pupil_shift + f_ih*(1 - pupil_shift)
-            if debug and index % 1 == 0:
-                fft_rec = np.log10(np.abs(f_ih)+1)
-                fft_rec *= (255.0/fft_rec.max())
-                fft_rec = fftshift(fft_rec)
-                # fft_rec = Image.fromarray(np.uint8(fft_rec*255), 'L')
-                im_rec = ifft2(f_ih)
-                # im_rec *= (255.0/im_rec.max())
-                im_rec_abs = np.abs(im_rec*np.conj(im_rec))
-                def plot_image(ax, image):
-                    ax.cla()
-                    ax.imshow(image, cmap=plt.get_cmap('hot'))
-                ax = iter([ax1, ax2, ax3, ax4])
-                for image in [np.abs(fft_rec), im_rec, im_array, np.angle(im_rec)]:
-                    plot_image(ax.next(), image)
-                fig.canvas.draw()
-        # print("Testing quality metric", quality_metric(image_dict, Il, cfg, max_phi))
-    return np.abs(np.power(ifft2(f_ih), 2)), np.angle(ifft2(f_ih+1))
+    from .dpc import dpc_spectrum, DEFAULT_REGULARIZATION
+
+    if precision is None:
+        precision = getattr(cfg, 'precision', 'double')
+    real_dtype, complex_dtype = fpmm.precision_dtypes(precision)
+    samples = as_stack(samples, cfg, dtype=real_dtype)
+    lrsize = samples.shape[1]
+    if plan is None:
+        plan = ReconstructionPlan(cfg, kdsc, lrsize, hrshape,
+                                  pupil_radius=pupil_radius)
+    if pupil is None:
+        pupil = defocus_pupil(lrsize, pupil_radius, -.35E-6, cfg, precision)
+    elif isinstance(pupil, str):
+        pupil = dt.load_pupil(pupil)[0]
+    if regularization is None:
+        regularization = getattr(cfg, 'dpc_regularization',
+                                 DEFAULT_REGULARIZATION)
+    return dpc_spectrum(samples, plan, pupil, float(regularization),
+                        complex_dtype)
@@ -0,0 +1,205 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" File solvers.py
+
+Last update: 17/10/2026
+
+Description:
+Update rules selectable with fpm_reconstruct(..., method=...):
+    * gs: Gerchberg-Saxton spectrum replacement (the original one).
+    * gauss_newton: sequential regularised quasi-Newton update, weighting the
+                    correction by |P| conj(P)/(|P|max (|P|^2 + delta)).
+    * momentum: GS passes accelerated with Nesterov momentum (in the
+                reformulation of Bengio et al. 2013), applied to the whole
+                spectrum after every pass.
+    * adam: GS passes whose spectrum change is rescaled with Adam-style
+            adaptive (per frequency) steps.
+The per LED rules only change the back-projection weights of the update
+(pupil_weights()), so they cost the same as GS. The accelerated ones add
+one operation on the high resolution spectrum per pass.
+
+Usage:
+    back, complement = pupil_weights(pupil, 'gauss_newton', step, delta)
+    accelerator = make_accelerator('momentum', step, momentum)
+    accelerator.start(spectrum)
+    ... sequential pass over every LED ...
+    accelerator.apply(spectrum)
+    state = accelerator.get_state()  # checkpoint entries, see set_state()
+"""
+__version__ = "1.1.1"
+__author__ = 'Juan M. Bujjamer'
+__all__ = ['METHODS', 'DEFAULT_STEPS', 'DEFAULT_MOMENTUM', 'pupil_weights',
+           'make_accelerator', 'MomentumAccelerator', 'AdamAccelerator']
+
+import numpy as np
+
+METHODS = ('gs', 'gauss_newton', 'momentum', 'adam')
+DEFAULT_STEPS = {'gs': 1., 'gauss_newton': 1., 'momentum': 1., 'adam': 2.}
+DEFAULT_MOMENTUM = {'momentum': .5, 'adam': .3}
+
+
+def pupil_weights(pupil=None, method='gs', step=1., delta=1.):
+    """ Back-projection weights of the per LED update
+
+        window += back*(psi' - pupil*window)
+               == complement*window + back*psi'
+
+    Args:
+    -----
+        pupil: complex (lrsize, lrsize) pupil.
+        method: one of METHODS. The accelerated methods use GS weights.
+        step: step size of the update.
+        delta: regularisation of the Gauss-Newton update.
+
+    Returns:
+    --------
+        (ndarray) back (complex) and complement (real) weights.
+    """
+    modulus = np.abs(pupil)
+    if method == 'gauss_newton':
+        max_modulus = float(modulus.max()) or 1.
+        back = step*modulus*np.conj(pupil)/(max_modulus*(modulus**2 + delta))
+    else:
+        # Normalised by max|P|^2 to keep the step stable while the pupil is
+        # being recovered (it is 1 for a pure phase pupil)
+        norm = float(modulus.max())**2 or 1.
+        back = step*np.conj(pupil)/norm
+    complement = 1 - np.real(back*pupil)
+    return back, complement
+
+
+class MomentumAccelerator(object):
+    """ Nesterov momentum on the spectrum change d = F - F_start of every
+    sequential pass, taken as the gradient step. With the spectrum kept at
+    the look-ahead point (Bengio et al. 2013) the update is
+
+        v = momentum*v + d
+        F = F_start + d + momentum*v
+          = F_start + (1 + momentum)*d + momentum**2*v_previous
+
+    while heavy-ball momentum would give F_start + d + momentum*v_previous:
+    the look-ahead applies the momentum to the fresh change as well. The
+    default momentum (DEFAULT_MOMENTUM) halves the passes GS needs on slowly
+    converging samples, larger values overshoot.
+    """
+    def __init__(self, step=1., momentum=.5):
+        self.step = float(step)
+        self.momentum = float(momentum)
+        self.velocity = None
+        self._start = None
+
+    def start(self, spectrum):
+        """ Remembers the spectrum at the beginning of a pass.
+        """
+        if self._start is None:
+            self._start = np.empty_like(spectrum)
+            self.velocity = np.zeros_like(spectrum)
+        np.copyto(self._start, spectrum)
+
+    def apply(self, spectrum):
+        """ Accelerates the change made by the pass (in place).
+        """
+        change = np.subtract(spectrum, self._start, out=self._start)
+        self.velocity *= self.momentum
+        self.velocity += change
+        if self.step != 1.:
+            spectrum += (self.step - 1.)*change
+        spectrum += self.momentum*self.velocity
+
+    def get_state(self):
+        """ Checkpoint entries: the velocity and the spectrum at the
+        beginning of the pass in course.
+        """
+        return {'solver_velocity': self.velocity,
+                'solver_pass_start': self._start}
+
+    def set_state(self, state):
+        """ Restores get_state(), the pass in course is resumed without
+        calling start() again.
+        """
+        self.velocity = np.array(state['solver_velocity'])
+        self._start = np.array(state['solver_pass_start'])
+
+
+class AdamAccelerator(object):
+    """ Adam-style adaptive steps on the spectrum change of every sequential
+    pass. The bias corrected first moment m of the change is applied with a
+    per frequency step scaled by its consistency |m|/sqrt(v) (v the second
+    moment): frequencies corrected in a consistent direction move by up to
+    step times the averaged change, oscillating ones are damped. Unlike the
+    textbook Adam the step keeps the spectrum units, which span several
+    orders of magnitude between low and high frequencies. The short second
+    moment memory (beta2) lets the consistency follow the pass to pass
+    changes, with the textbook .999 it stalls once the change shrinks.
+    """
+    def __init__(self, step=2., beta1=.3, beta2=.3, eps=1E-30):
+        self.step = float(step)
+        self.beta1 = float(beta1)
+        self.beta2 = float(beta2)
+        self.eps = float(eps)
+        self.count = 0
+        self.moment = None
+        self.second_moment = None
+        self._start = None
+
+    def start(self, spectrum):
+        """ Remembers the spectrum at the beginning of a pass.
+        """
+        if self._start is None:
+            self._start = np.empty_like(spectrum)
+            self.moment = np.zeros_like(spectrum)
+            self.second_moment = np.zeros(np.shape(spectrum),
+                                          dtype=spectrum.real.dtype)
+        np.copyto(self._start, spectrum)
+
+    def apply(self, spectrum):
+        """ Replaces the change made by the pass by the adaptive one.
+        """
+        change = np.subtract(spectrum, self._start, out=self._start)
+        self.count += 1
+        self.moment *= self.beta1
+        self.moment += (1 - self.beta1)*change
+        self.second_moment *= self.beta2
+        self.second_moment += (1 - self.beta2)*np.abs(change)**2
+        moment = self.moment/(1 - self.beta1**self.count)
+        scale = np.sqrt(self.second_moment/(1 - self.beta2**self.count))
+        consistency = np.abs(moment)/(scale + self.eps)
+        # Undo the plain pass and apply the adaptive one
+        spectrum -= change
+        spectrum += self.step*consistency*moment
+
+    def get_state(self):
+        """ Checkpoint entries: the step count, both moments and the
+        spectrum at the beginning of the pass in course.
+        """
+        return {'solver_count': self.count, 'solver_moment': self.moment,
+                'solver_second_moment': self.second_moment,
+                'solver_pass_start': self._start}
+
+    def set_state(self, state):
+        """ Restores get_state(), the pass in course is resumed without
+        calling start() again.
+        """
+        self.count = int(state['solver_count'])
+        self.moment = np.array(state['solver_moment'])
+        self.second_moment = np.array(state['solver_second_moment'])
+        self._start = np.array(state['solver_pass_start'])
+
+
+def make_accelerator(method='gs', step=None, momentum=None):
+    """ Accelerator of the given method, None for the per LED rules. The
+    step and momentum (beta1 of adam) default to DEFAULT_STEPS and
+    DEFAULT_MOMENTUM.
+    """
+    if method not in METHODS:
+        raise ValueError("Unknown method '%s', expected one of %s." %
+                         (method, ', '.join(METHODS)))
+    if step is None:
+        step = DEFAULT_STEPS[method]
+    if momentum is None:
+        momentum = DEFAULT_MOMENTUM.get(method, 0.)
+    if method == 'momentum':
+        return MomentumAccelerator(step, momentum)
+    if method == 'adam':
+        return AdamAccelerator(step, momentum)
+    return None
@@ -0,0 +1,314 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" File stack.py
+
+Last update: 17/10/2026
+
+Description:
+Contiguous storage for a sampled LED set. All the frames live in a single
+(n_leds, h, w) float32 array, and a structured index holds the LED
+coordinates and acquisition parameters of every row. Exposure normalisation
+is applied once, when the stack is built.
+
+Stacks too large for memory are kept on disk: StackWriter writes the raw
+frames one by one into a memory mappable .npy file (with the index in a
+companion _index.npz file) and MappedStack reads them back, cropping only
+the patch a reconstruction needs, a few frames at a time.
+
+Usage:
+    stack = SampleStack.from_dict(samples, cfg)
+    frame = stack[(15, 15)]
+    rows = stack.rows(plan.keys)
+
+    with StackWriter('stack.npy', n_leds, frame_shape) as writer:
+        writer.add((nx, ny), frame, acqpars)
+    patch = open_stack('stack.npy').crop(cfg.patch_size, osx, osy)
+"""
+__version__ = "1.1.1"
+__author__ = 'Juan M. Bujjamer'
+__all__ = ['SampleStack', 'MappedStack', 'StackWriter', 'as_stack',
+           'open_stack', 'write_stack', 'stack_files',
+           'acquisition_parameters', 'INDEX_DTYPE']
+
+import os
+
+import numpy as np
+
+from . import coordtrans as ct
+
+INDEX_DTYPE = np.dtype([('nx', np.int32), ('ny', np.int32),
+                        ('iso', np.float64), ('shutter_speed', np.float64),
+                        ('led_power', np.float64)])
+
+
+class SampleStack(object):
+    """ Sampled images stored as one contiguous (n_leds, h, w) array.
+
+    Args:
+    -----
+        images: (n_leds, h, w) array with the sampled images.
+        index: structured array (INDEX_DTYPE) with one entry per image.
+        normalize: divides every image by its shutter speed. Leave it False
+                   if the images are already normalised.
+        dtype: data type of the stored images.
+    """
+    def __init__(self, images=None, index=None, normalize=True,
+                 dtype=np.float32):
+        if normalize:
+            # Normalised in place, never on the caller's array
+            images = np.array(images, dtype=dtype)
+        else:
+            images = np.ascontiguousarray(images, dtype=dtype)
+        index = np.asarray(index, dtype=INDEX_DTYPE)
+        if images.ndim != 3 or len(images) != len(index):
+            raise ValueError("Expected (n_leds, h, w) images and one index "
+                             "entry per image.")
+        if normalize:
+            shutter = index['shutter_speed'].astype(dtype)
+            images /= shutter[:, np.newaxis, np.newaxis]
+        self.images = images
+        self.index = index
+        self._rows = dict(((int(nx), int(ny)), n) for n, (nx, ny)
+                          in enumerate(zip(index['nx'], index['ny'])))
+
+    @classmethod
+    def from_dict(cls, samples, cfg=None, dtype=np.float32):
+        """ Converts a legacy sample dictionary, keyed by (nx, ny) tuples,
+        into a stack. Acquisition parameters are taken from the iterator set
+        by cfg (every sample must be in it); without cfg the samples are
+        left unnormalised.
+        """
+        keys = sorted(samples.keys())
+        index = np.zeros(len(keys), dtype=INDEX_DTYPE)
+        for n, (key, pars) in enumerate(zip(keys,
+                                            acquisition_parameters(keys,
+                                                                   cfg))):
+            iso, shutter_speed, led_power = pars
+            index[n] = (key[0], key[1], iso, shutter_speed, led_power)
+        images = np.empty((len(keys),) + np.shape(samples[keys[0]]),
+                          dtype=dtype)
+        for n, key in enumerate(keys):
+            images[n] = samples[key]
+        return cls(images, index, normalize=True, dtype=dtype)
+
+    def to_dict(self):
+        """ The legacy dictionary representation (views of the stack).
+        """
+        return dict((key, self.images[n]) for key, n in self._rows.items())
+
+    def __len__(self):
+        return len(self.images)
+
+    def __contains__(self, key):
+        return tuple(key) in self._rows
+
+    def __getitem__(self, key):
+        return self.images[self._rows[tuple(key)]]
+
+    def keys(self):
+        return list(self._rows.keys())
+
+    @property
+    def shape(self):
+        return self.images.shape
+
+    def rows(self, keys):
+        """ Stack rows (int array) of the given (nx, ny) keys.
+        """
+        return np.array([self._rows[tuple(key)] for key in keys],
+                        dtype=np.intp)
+
+    def crop(self, image_size, osx, osy):
+        """ Same as fpmmath.crop_image() applied to every frame at once.
+        """
+        images = self.images[:, osx:(osx+image_size[0]),
+                             osy:(osy+image_size[1])]
+        return SampleStack(images, self.index, normalize=False,
+                           dtype=self.images.dtype)
+
+    def subset(self, keys):
+        """ A new stack with only the given keys, in that order.
+        """
+        rows = self.rows(keys)
+        return SampleStack(self.images[rows], self.index[rows],
+                           normalize=False, dtype=self.images.dtype)
+
+
+def acquisition_parameters(keys, cfg=None):
+    """ (iso, shutter_speed, led_power) of every (nx, ny) key, from the
+    iterator set by cfg. Without cfg every key gets a unit shutter speed, so
+    the whole set stays unnormalised. Keys missing from the iterator raise
+    a ValueError rather than leaving those frames unnormalised next to
+    normalised ones.
+    """
+    if cfg is None:
+        return [(0, 1, 0)]*len(keys)
+    acqpars = dict((tuple(it['indexes']), it['acqpars'])
+                   for it in ct.set_iterator(cfg))
+    missing = [tuple(key) for key in keys if tuple(key) not in acqpars]
+    if missing:
+        raise ValueError("LEDs %s are not in the iterator set by cfg, their "
+                         "exposure is unknown." % sorted(missing))
+    return [tuple(acqpars[tuple(key)]) for key in keys]
+
+
+def stack_files(filename=None):
+    """ Frames and index file names of an on-disk stack.
+    """
+    base = os.path.splitext(filename)[0]
+    return base + '.npy', base + '_index.npz'
+
+
+class StackWriter(object):
+    """ Writes a sampled set frame by frame into an on-disk stack, so only
+    one frame is held in memory (see open_stack()).
+
+    Args:
+    -----
+        filename: the .npy file of the frames.
+        n_frames: number of frames to be written.
+        frame_shape: (h, w) of the raw frames.
+        dtype: data type stored on disk.
+        normalized: True if the frames are already divided by their shutter
+                    speed.
+    """
+    def __init__(self, filename=None, n_frames=None, frame_shape=None,
+                 dtype=np.float32, normalized=False):
+        self.images_file, self.index_file = stack_files(filename)
+        self.images = np.lib.format.open_memmap(
+            self.images_file, mode='w+', dtype=dtype,
+            shape=(int(n_frames),) + tuple(frame_shape))
+        self.index = np.zeros(int(n_frames), dtype=INDEX_DTYPE)
+        self.normalized = normalized
+        self.count = 0
+
+    def add(self, key=None, image=None, acqpars=(0, 1, 0)):
+        """ Writes the frame taken with the LED (nx, ny) = key and its
+        acquisition parameters [iso, shutter_speed, led_power].
+        """
+        if self.count >= len(self.index):
+            raise ValueError("The stack is full (%d frames)." % self.count)
+        self.images[self.count] = image
+        iso, shutter_speed, led_power = acqpars
+        self.index[self.count] = (key[0], key[1], iso, shutter_speed,
+                                  led_power)
+        self.count += 1
+
+    def close(self):
+        """ Flushes the frames and writes the index of the ones added.
+        """
+        if self.images is None:
+            return
+        self.images.flush()
+        self.images = None
+        np.savez(self.index_file, index=self.index[:self.count],
+                 normalized=self.normalized)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class MappedStack(object):
+    """ Read only, memory mapped on-disk stack (see StackWriter). Frames are
+    only read when a patch is cropped, so its size is limited by the disk.
+
+    Args:
+    -----
+        filename: the .npy file of the frames.
+    """
+    def __init__(self, filename=None):
+        self.filename = filename
+        images_file, index_file = stack_files(filename)
+        with np.load(index_file) as data:
+            self.index = np.asarray(data['index'], dtype=INDEX_DTYPE)
+            self.normalized = bool(data['normalized'])
+        self.images = np.load(images_file, mmap_mode='r')[:len(self.index)]
+        self._rows = dict(((int(nx), int(ny)), n) for n, (nx, ny)
+                          in enumerate(zip(self.index['nx'],
+                                           self.index['ny'])))
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return tuple(key) in self._rows
+
+    def keys(self):
+        return list(self._rows.keys())
+
+    @property
+    def shape(self):
+        return self.images.shape
+
+    def rows(self, keys):
+        """ Stack rows (int array) of the given (nx, ny) keys.
+        """
+        return np.array([self._rows[tuple(key)] for key in keys],
+                        dtype=np.intp)
+
+    def crop(self, image_size, osx, osy, dtype=np.float32, chunk=16):
+        """ In memory, normalised SampleStack of the patch (same arguments as
+        SampleStack.crop()). The patch is read chunk frames at a time.
+        """
+        rows = slice(osx, osx+image_size[0])
+        cols = slice(osy, osy+image_size[1])
+        patch = self.images[:1, rows, cols]
+        images = np.empty((len(self),) + patch.shape[1:], dtype=dtype)
+        for first in range(0, len(self), chunk):
+            images[first:first+chunk] = self.images[first:first+chunk,
+                                                    rows, cols]
+        return SampleStack(images, self.index, normalize=not self.normalized,
+                           dtype=dtype)
+
+    def load(self, dtype=np.float32):
+        """ The whole stack in memory.
+        """
+        return self.crop(self.shape[1:], 0, 0, dtype)
+
+
+def open_stack(filename=None):
+    """ Opens an on-disk stack written by StackWriter (or write_stack()).
+    """
+    return MappedStack(filename)
+
+
+def write_stack(filename=None, samples=None, cfg=None, dtype=np.float32):
+    """ Writes a sampled set into an on-disk stack. SampleStacks are written
+    as they are (normalised); legacy dictionaries are written frame by frame
+    with their acquisition parameters from the iterator set by cfg, see
+    acquisition_parameters().
+    """
+    if isinstance(samples, SampleStack):
+        with StackWriter(filename, len(samples), samples.shape[1:], dtype,
+                         normalized=True) as writer:
+            for image, entry in zip(samples.images, samples.index):
+                writer.add((entry['nx'], entry['ny']), image,
+                           (entry['iso'], entry['shutter_speed'],
+                            entry['led_power']))
+        return open_stack(filename)
+    keys = sorted(samples.keys())
+    with StackWriter(filename, len(keys), np.shape(samples[keys[0]]),
+                     dtype) as writer:
+        for key, pars in zip(keys, acquisition_parameters(keys, cfg)):
+            writer.add(key, samples[key], pars)
+    return open_stack(filename)
+
+
+def as_stack(samples, cfg=None, dtype=None):
+    """ Returns samples as a SampleStack, converting legacy dictionaries and
+    loading on-disk stacks. Stacks are converted to dtype when it is given
+    and differs; otherwise they keep theirs, and new ones are float32.
+    """
+    if isinstance(samples, SampleStack):
+        if dtype is None or samples.images.dtype == dtype:
+            return samples
+        return SampleStack(samples.images, samples.index, normalize=False,
+                           dtype=dtype)
+    if dtype is None:
+        dtype = np.float32
+    if isinstance(samples, MappedStack):
+        return samples.load(dtype)
+    return SampleStack.from_dict(samples, cfg, dtype=dtype)
@@ -0,0 +1,232 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" File streaming.py
+
+Last update: 17/10/2026
+
+Description:
+Reconstruction overlapped with the acquisition. The acquisition side puts
+every LED frame in a queue as soon as it is captured; the reconstructor
+applies its spectrum update right away and, while waiting for the next
+frame, keeps refining with the frames already received. Once the set is
+complete the usual iterations over all the LEDs follow.
+
+Usage:
+    stream = StreamingReconstructor(cfg, kdsc, lrsize, hrshape, pupil_radius)
+    stream.start()
+    stream_acquisition(acquire, ct.set_iterator(cfg), stream)
+    result = stream.join()
+"""
+__version__ = "1.1.1"
+__author__ = 'Juan M. Bujjamer'
+__all__ = ['StreamingReconstructor', 'stream_acquisition']
+
+import queue
+import threading
+import time
+
+import numpy as np
+
+import pyfpm.fpmmath as fpmm
+from . import fftbackend as fftb
+from .convergence import StoppingRule, ReconstructionResult
+from .fftbackend import fft2, ifft2, fftshift, ifftshift
+from .plan import ReconstructionPlan, UpdateWorkspace
+
+
+class StreamingReconstructor(object):
+    """ Reconstruction fed by a frame queue.
+
+    Args:
+    -----
+        cfg: configuration (named tuple)
+        kdsc: conversion factor from relative k to discrete spectrum pixels.
+        lrsize: size of the (square) low resolution frames.
+        hrshape: shape of the high resolution reconstruction (None sizes
+                 it from the illumination, see plan.hr_grid_shape()).
+        pupil_radius: radius of the pupil in pixels.
+        plan: a ReconstructionPlan, built from cfg if not given.
+        pupil: initial pupil, the defocused CTF if not given.
+        precision: 'double' or 'single', see fpm_reconstruct().
+        preprocess: optional function applied to every raw frame (cropping,
+                    background correction...) before it is used. Frames are
+                    normalised by their shutter speed afterwards.
+        maxsize: maximum number of frames waiting in the queue (0 is
+                 unbounded).
+    """
+    def __init__(self, cfg=None, kdsc=None, lrsize=None, hrshape=None,
+                 pupil_radius=None, plan=None, pupil=None, precision=None,
+                 preprocess=None, maxsize=0):
+        from .reconstruct import defocus_pupil
+
+        if precision is None:
+            precision = getattr(cfg, 'precision', 'double')
+        real_dtype, complex_dtype = fpmm.precision_dtypes(precision)
+        if plan is None:
+            plan = ReconstructionPlan(cfg, kdsc, lrsize, hrshape,
+                                      pupil_radius=pupil_radius)
+        if pupil is None:
+            pupil = defocus_pupil(lrsize, pupil_radius, -.35E-6, cfg,
+                                  precision)
+        self.cfg = cfg
+        self.plan = plan
+        self.preprocess = preprocess
+        self.complex_dtype = complex_dtype
+        self.frames = queue.Queue(maxsize)
+        self.images = np.zeros((len(plan), plan.lrsize, plan.lrsize),
+                               dtype=real_dtype)
+        self.received = np.zeros(len(plan), dtype=bool)
+        self._positions = dict((tuple(key), n)
+                               for n, key in enumerate(plan.keys))
+        self.workspace = UpdateWorkspace(plan, pupil, complex_dtype)
+        self.spectrum = None
+        # Timings (seconds from the start of run())
+        self.first_update_time = None
+        self.capture_time = None
+        self.refine_updates = 0
+        self._thread = None
+        self._result = None
+        self._error = None
+
+    def put(self, key, image):
+        """ Queues the frame taken with the LED (nx, ny) = key.
+        """
+        self.frames.put((tuple(key), image))
+
+    def finish(self):
+        """ Signals the end of the acquisition.
+        """
+        self.frames.put(None)
+
+    def _receive(self, item):
+        """ Stores a frame, returning its position in the plan (None for
+        LEDs the plan does not use).
+        """
+        key, image = item
+        n = self._positions.get(key)
+        if n is None:
+            return None
+        if self.preprocess is not None:
+            image = self.preprocess(image)
+        np.multiply(image, self.plan.norm[n], out=self.images[n])
+        self.received[n] = True
+        return n
+
+    def _update(self, n):
+        self.workspace.update(self.spectrum, self.plan.kyl[n],
+                              self.plan.kxl[n], self.images[n])
+
+    def run(self, stopping=None, refine=True, poll=0.005):
+        """ Consumes the queue until finish() is called and then iterates
+        over the complete set.
+
+        Args:
+        -----
+            stopping: a StoppingRule for the iterations after the capture,
+                      built from cfg if not given.
+            refine: keep updating with the received frames while the queue
+                    is empty.
+            poll: seconds waited for a new frame before every refinement
+                  update, so an idle capture does not keep a core busy.
+
+        Returns:
+        --------
+            (ReconstructionResult) see fpm_reconstruct().
+        """
+        plan = self.plan
+        fftb.set_backend(self.cfg)
+        fftb.plan_transforms([(plan.lrsize, plan.lrsize), plan.hrshape],
+                             self.complex_dtype)
+        self.spectrum = fftshift(fft2(np.ones(plan.hrshape)))
+        self.spectrum = self.spectrum.astype(self.complex_dtype, copy=False)
+        start_time = time.time()
+        # Capture: one update per arriving frame, refinement in between
+        arrived = list()
+        while True:
+            try:
+                if refine and arrived:
+                    item = self.frames.get(timeout=poll)
+                else:
+                    item = self.frames.get()
+            except queue.Empty:
+                self._update(arrived[self.refine_updates % len(arrived)])
+                self.refine_updates += 1
+                continue
+            if item is None:
+                break
+            n = self._receive(item)
+            if n is None:
+                continue
+            self._update(n)
+            arrived.append(n)
+            if self.first_update_time is None:
+                self.first_update_time = time.time() - start_time
+        self.capture_time = time.time() - start_time
+        print('Capture done in %.2f s, %d refinement updates' %
+              (self.capture_time, self.refine_updates))
+        # Iterations over the complete set, in the plan order
+        if stopping is None:
+            stopping = StoppingRule.from_config(self.cfg)
+        stopping.reset()
+        rows = np.flatnonzero(self.received)
+        total = float(np.sum(self.images[rows], dtype=np.float64))
+        for iteration in range(stopping.max_iter):
+            self.workspace.reset_error()
+            for n in rows:
+                self._update(n)
+            error = self.workspace.error/total
+            print('Iteration n. %d, error %.4e' % (iteration, error))
+            if stopping.update(error):
+                break
+        im_out = ifft2(ifftshift(self.spectrum))
+        return ReconstructionResult(im_out, stopping, self.spectrum,
+                                    self.workspace.pupil)
+
+    def start(self, stopping=None, refine=True, poll=0.005):
+        """ Runs run() in a background thread, see join().
+        """
+        def target():
+            try:
+                self._result = self.run(stopping, refine, poll)
+            except Exception as error:
+                self._error = error
+        self._result, self._error = None, None
+        self._thread = threading.Thread(target=target, daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def join(self):
+        """ Waits for the reconstruction started by start() to finish and
+        returns its result. An exception raised by run() in the background
+        thread is raised again here.
+        """
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+def stream_acquisition(acquire=None, iterator=None, sink=None):
+    """ Acquires every LED of iterator, handing each frame to sink (a
+    StreamingReconstructor) as soon as it is captured.
+
+    Args:
+    -----
+        acquire: function taking an iterator element and returning the
+                 frame (see simulations/stream_reconstruct.py).
+        iterator: the acquisition iterator (ct.set_iterator(cfg)).
+        sink: object with put(key, image) and finish() methods.
+
+    Returns:
+    --------
+        (dict) the acquired frames with (nx, ny) keys, to be saved as usual.
+    """
+    image_dict = dict()
+    try:
+        for it in iterator:
+            image = acquire(it)
+            image_dict[it['indexes']] = image
+            sink.put(it['indexes'], image)
+    finally:
+        sink.finish()
+    return image_dict
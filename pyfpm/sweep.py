@@ -0,0 +1,256 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" File sweep.py
+
+Last update: 17/10/2026
+
+Description:
+Parallel search of the focus and LED matrix offsets. Every (zfocus, xoff,
+yoff) candidate is a short reconstruction run on a process pool, warm
+started from a spectrum reconstructed beforehand, and candidates falling far
+behind after a few probe iterations are rejected. Two warm starts are
+available:
+    * common: the central candidate is reconstructed first and every
+              candidate starts from its spectrum, with the same iteration
+              budget and rejection threshold, so the ranking does not depend
+              on the evaluation order.
+    * neighbour: candidates are evaluated from the center of the grid
+                 outwards, each one from the spectrum of its best already
+                 evaluated neighbour and rejected against the best error so
+                 far. Later candidates start closer to convergence and face
+                 a stricter threshold, so the ranking is biased towards the
+                 order they are visited in; use it to explore large grids.
+
+Usage:
+    candidates = candidate_grid(zfocus=[-.4E-6], xoff=np.arange(-.45, .5, .1),
+                                yoff=[-.1])
+    table, best = parameter_sweep(samples, hrshape, pupil_radius, kdsc, cfg,
+                                  candidates)
+    zfocus, xoff, yoff = table[0][['zfocus', 'xoff', 'yoff']]
+"""
+__version__ = "1.1.1"
+__author__ = 'Juan M. Bujjamer'
+__all__ = ['SWEEP_DTYPE', 'STARTS', 'candidate_grid', 'parameter_sweep']
+
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+from PIL import Image
+
+try:
+    from skimage.metrics import structural_similarity as ssim
+except ImportError:
+    try:
+        from skimage.measure import compare_ssim as ssim
+    except ImportError:
+        ssim = None
+
+import pyfpm.data as dt
+from .convergence import StoppingRule
+from .plan import ReconstructionPlan, offset_grid_shape
+from .stack import as_stack
+
+STARTS = ('common', 'neighbour')
+SWEEP_DTYPE = np.dtype([('index', np.int32), ('zfocus', np.float64),
+                        ('xoff', np.float64), ('yoff', np.float64),
+                        ('score', np.float64),
+                        ('error', np.float64), ('iterations', np.int32),
+                        ('rejected', np.bool_), ('warm_start', np.int32)])
+
+_shared = dict()  # Worker side state, set by _init_worker()
+
+
+def candidate_grid(zfocus=(0,), xoff=(0,), yoff=(0,)):
+    """ Every (zfocus, xoff, yoff) combination of the given values.
+    """
+    return [tuple(float(v) for v in candidate)
+            for candidate in itertools.product(zfocus, xoff, yoff)]
+
+
+def _normalized(candidates):
+    """ Candidates scaled to a unit range per parameter, to measure
+    distances between them.
+    """
+    candidates = np.array(candidates, dtype=np.float64).reshape(-1, 3)
+    span = np.ptp(candidates, axis=0)
+    span[span == 0] = 1
+    return (candidates - candidates.min(axis=0))/span
+
+
+def _init_worker(settings):
+    _shared.update(settings)
+    _shared['cfg'] = dt.config_from_dict(settings['cfg_dict'])
+
+
+def _evaluate(candidate, spectrum, best_error):
+    """ Short reconstruction of a candidate: probe_iter iterations, then the
+    remaining ones unless its error is reject_ratio times best_error.
+    """
+    from .reconstruct import fpm_reconstruct, defocus_pupil
+
+    cfg = _shared['cfg']
+    samples = _shared['samples']
+    zfocus, xoff, yoff = candidate
+    lrsize = samples.shape[1]
+    plan = ReconstructionPlan(cfg, _shared['kdsc'], lrsize,
+                              _shared['hrshape'], xoff, yoff)
+    pupil = defocus_pupil(lrsize, _shared['pupil_radius'], zfocus, cfg,
+                          _shared['precision'])
+    args = (samples, _shared['hrshape'], None, _shared['pupil_radius'],
+            _shared['kdsc'], cfg)
+    probe_iter = min(_shared['probe_iter'], _shared['n_iter'])
+    result = fpm_reconstruct(*args, plan=plan,
+                             precision=_shared['precision'],
+                             stopping=StoppingRule(probe_iter), pupil=pupil,
+                             pupil_step=0., spectrum=spectrum)
+    errors = list(result.errors)
+    rejected = errors[-1] > _shared['reject_ratio']*best_error
+    if not rejected and _shared['n_iter'] > probe_iter:
+        result = fpm_reconstruct(*args, plan=plan,
+                                 precision=_shared['precision'],
+                                 stopping=StoppingRule(_shared['n_iter'] -
+                                                       probe_iter),
+                                 pupil=pupil, pupil_step=0.,
+                                 spectrum=result.spectrum)
+        errors.extend(result.errors)
+    score = errors[-1]
+    reference = _shared['reference']
+    if reference is not None and not rejected:
+        # Structural dissimilarity against the reference (lower is better)
+        magnitude = result.modulus/np.amax(result.modulus)
+        score = 1 - ssim(reference, magnitude,
+                         data_range=magnitude.max() - magnitude.min())
+    return {'error': errors[-1], 'score': score, 'iterations': len(errors),
+            'rejected': rejected, 'spectrum': result.spectrum}
+
+
+def parameter_sweep(samples=None, hrshape=None, pupil_radius=None, kdsc=None,
+                    cfg=None, candidates=None, n_iter=5, probe_iter=2,
+                    reject_ratio=2., neighbours=4, workers=None,
+                    reference=None, precision=None, start='common'):
+    """ Evaluates (zfocus, xoff, yoff) candidates in parallel and ranks them.
+
+    Args:
+    -----
+        samples: the acquired samples as a SampleStack (legacy dictionaries
+                 are converted).
+        hrshape: shape of the high resolution reconstruction. None sizes it
+                 to fit the LED windows of every candidate offset (see
+                 plan.offset_grid_shape()).
+        pupil_radius: radius of the pupil in pixels.
+        kdsc: conversion factor from relative k to discrete spectrum pixels.
+        cfg: configuration (named tuple)
+        candidates: list of (zfocus, xoff, yoff), see candidate_grid().
+        n_iter: iterations run for every accepted candidate.
+        probe_iter: iterations run before deciding on early rejection.
+        reject_ratio: candidates whose error after probe_iter iterations is
+                      larger than reject_ratio times the reference error
+                      (the common start one, or the best so far) are
+                      rejected.
+        neighbours: number of nearest evaluated candidates considered for
+                    the 'neighbour' warm start.
+        workers: number of processes, every core by default.
+        reference: optional brightfield image. When given candidates are
+                   scored by 1 - SSIM against it (requires scikit-image)
+                   instead of by their residual error.
+        precision: 'double' or 'single', see fpm_reconstruct().
+        start: 'common' or 'neighbour' warm start (see the module
+               description).
+
+    Returns:
+    --------
+        (ndarray) SWEEP_DTYPE table sorted by score (lower is better), where
+        index and warm_start refer to positions in candidates (warm_start is
+        the candidate whose spectrum the run started from, -1 for a cold
+        start), and (dict) the evaluation of the best candidate, with its
+        spectrum.
+    """
+    if start not in STARTS:
+        raise ValueError("Unknown start '%s', expected one of %s." %
+                         (start, ', '.join(STARTS)))
+    samples = as_stack(samples, cfg)
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    candidates = [tuple(c) for c in candidates]
+    if hrshape is None:
+        hrshape = offset_grid_shape(cfg, kdsc, samples.shape[1], pupil_radius,
+                                    [(xoff, yoff) for _, xoff, yoff
+                                     in candidates])
+    if reference is not None:
+        if ssim is None:
+            raise ImportError("SSIM scoring requires scikit-image.")
+        reference = Image.fromarray(np.asarray(reference, dtype=np.float32))
+        reference = np.array(reference.resize(tuple(hrshape)[::-1]),
+                             dtype=np.float64)
+        reference /= np.amax(reference)
+    positions = _normalized(candidates)
+    # Center out order, so every wave has evaluated neighbours to start from
+    center = positions.mean(axis=0)
+    pending = list(np.argsort(np.sum((positions - center)**2, axis=1)))
+    table = np.zeros(len(candidates), dtype=SWEEP_DTYPE)
+    results = dict()
+
+    def warm_start(index):
+        """ Best scored candidate among the nearest evaluated ones.
+        """
+        done = [n for n in results if not table['rejected'][n]]
+        if not done:
+            return -1
+        distance = np.sum((positions[done] - positions[index])**2, axis=1)
+        nearest = [done[n] for n in np.argsort(distance)[:neighbours]]
+        return min(nearest, key=lambda n: table['score'][n])
+
+    def best_error():
+        done = [table['error'][n] for n in results]
+        return min(done) if done else np.inf
+
+    settings = {'samples': samples, 'cfg_dict': cfg._asdict(),
+                'hrshape': tuple(hrshape), 'pupil_radius': pupil_radius,
+                'kdsc': kdsc, 'precision': precision, 'n_iter': n_iter,
+                'probe_iter': probe_iter, 'reject_ratio': reject_ratio,
+                'reference': reference}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(settings,)) as pool:
+        if start == 'common':
+            # Cold reconstruction of the central candidate, the start (and
+            # the rejection reference) of every candidate
+            seed = pending[0]
+            common = pool.submit(_evaluate, candidates[seed], None,
+                                 np.inf).result()
+            print('Common start from candidate z=%.2e xoff=%.2f yoff=%.2f, '
+                  'error %.4e' % (candidates[seed] + (common['error'],)))
+        running = dict()
+        while pending or running:
+            while pending and len(running) < workers:
+                index = pending.pop(0)
+                if start == 'common':
+                    origin, spectrum = seed, common['spectrum']
+                    reference_error = common['error']
+                else:
+                    origin = warm_start(index)
+                    spectrum = (results[origin]['spectrum'] if origin >= 0
+                                else None)
+                    reference_error = best_error()
+                table[index]['warm_start'] = origin
+                future = pool.submit(_evaluate, candidates[index], spectrum,
+                                     reference_error)
+                running[future] = index
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                index = running.pop(future)
+                result = future.result()
+                results[index] = result
+                zfocus, xoff, yoff = candidates[index]
+                table[index] = (index, zfocus, xoff, yoff, result['score'],
+                                result['error'], result['iterations'],
+                                result['rejected'],
+                                table[index]['warm_start'])
+                print('Candidate z=%.2e xoff=%.2f yoff=%.2f: score %.4e%s' %
+                      (zfocus, xoff, yoff, result['score'],
+                       ' (rejected)' if result['rejected'] else ''))
+    # Rejected candidates go last, whatever their score
+    order = np.lexsort((table['score'], table['rejected']))
+    best = results[order[0]]
+    return table[order], best
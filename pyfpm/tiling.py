@@ -0,0 +1,284 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" File tiling.py
+
+Last update: 17/10/2026
+
+Description:
+Full-field reconstruction by tiles. The sensor is split in overlapping
+patches, each one reconstructed with its own illumination angles (the LEDs
+are seen under different angles from every point of the sample). Tiles are
+reconstructed in a process pool that reads the raw stack from shared memory,
+and the results are feather-blended into amplitude and phase mosaics.
+
+Out of core: with an on-disk stack (stack.MappedStack, see
+stack.StackWriter) every worker maps the frames file and only reads the
+patch of its tile, at most two tiles per worker are in flight, and the
+mosaic accumulators can also live on disk (mosaic_file), so the dataset
+size is limited by the disk instead of the memory.
+
+Usage:
+    mag, phase = reconstruct_tiled(samples, cfg, kdsc, pupil_radius,
+                                   upsampling=3, overlap=32)
+    mag, phase = reconstruct_tiled(open_stack('stack.npy'), cfg, kdsc,
+                                   pupil_radius, upsampling=3,
+                                   mosaic_file='mosaic.npy')
+"""
+__version__ = "1.1.1"
+__author__ = 'Juan M. Bujjamer'
+__all__ = ['tile_grid', 'tile_offsets', 'feather_weights', 'TileMosaic',
+           'reconstruct_tiled']
+
+import os
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import pyfpm.data as dt
+from .plan import ReconstructionPlan
+from .stack import MappedStack, SampleStack, as_stack, open_stack
+
+_shared = dict()  # Worker side state, set by _init_worker()
+
+
+def tile_grid(sensor_shape=None, patch_size=None, overlap=0):
+    """ Origins of the overlapping patches covering the sensor. The last row
+    and column of tiles are aligned with the sensor border.
+
+    Args:
+    -----
+        sensor_shape: [rows, cols] of the raw frames.
+        patch_size: [rows, cols] of every tile.
+        overlap: pixels shared between neighbouring tiles.
+
+    Returns:
+    --------
+        (list) [row, col] origin of every tile.
+    """
+    origins = list()
+    for size, patch in zip(sensor_shape, patch_size):
+        step = max(1, patch - overlap)
+        starts = list(range(0, max(size - patch, 0) + 1, step))
+        if starts[-1] + patch < size:
+            starts.append(size - patch)
+        origins.append(starts)
+    return [[row, col] for row in origins[0] for col in origins[1]]
+
+
+def tile_offsets(origin=None, patch_size=None, sensor_shape=None, cfg=None):
+    """ LED matrix offsets (in LED units, see coordtrans.n_to_krels) that
+    give the local illumination angles of a tile. Columns map to the 'x'
+    direction (kx) and rows to 'y'.
+
+    Returns:
+    --------
+        (tuple) xoff, yoff
+    """
+    sample_pixel = float(cfg.pixel_size)/float(cfg.x)*1E3  # mm at sample
+    led_gap = float(cfg.led_gap)
+    dy = origin[0] + patch_size[0]/2. - sensor_shape[0]/2.
+    dx = origin[1] + patch_size[1]/2. - sensor_shape[1]/2.
+    return -dx*sample_pixel/led_gap, -dy*sample_pixel/led_gap
+
+
+def feather_weights(shape=None, ramp=None):
+    """ Separable blending weights, rising linearly over ramp pixels at
+    every border of the tile.
+    """
+    def profile(size):
+        position = np.arange(size) + .5
+        edge = np.minimum(position, size - position)
+        return np.clip(edge/max(ramp, 1), 1E-3, 1)
+    return np.outer(profile(shape[0]), profile(shape[1]))
+
+
+class TileMosaic(object):
+    """ Accumulates reconstructed tiles into full-field amplitude and phase
+    images, feather-blending the overlaps. Phases are blended as unit
+    phasors to avoid wrapping artifacts.
+
+    Args:
+    -----
+        shape: [rows, cols] of the high resolution mosaic.
+        tile_shape: [rows, cols] of the high resolution tiles.
+        ramp: width (in high resolution pixels) of the blending ramp.
+        filename: if given, the accumulators are memory mapped .npy files
+                  next to it (see result()).
+    """
+    def __init__(self, shape=None, tile_shape=None, ramp=None,
+                 filename=None):
+        self.shape = tuple(shape)
+        self.tile_shape = tuple(tile_shape)
+        self.weights = feather_weights(tile_shape, ramp)
+        self.filename = filename
+        self.amplitude = self._allocate('amplitude', np.float64)
+        self.phasor = self._allocate('phasor', np.complex128)
+        self.norm = self._allocate('norm', np.float64)
+
+    def _allocate(self, name, dtype):
+        if self.filename is None:
+            return np.zeros(self.shape, dtype=dtype)
+        base = os.path.splitext(self.filename)[0]
+        return np.lib.format.open_memmap('%s_%s.npy' % (base, name),
+                                         mode='w+', dtype=dtype,
+                                         shape=self.shape)
+
+    def add(self, origin, magnitude, phase):
+        """ Blends a tile with its (high resolution) origin [row, col].
+        """
+        rows = slice(origin[0], origin[0] + self.tile_shape[0])
+        cols = slice(origin[1], origin[1] + self.tile_shape[1])
+        self.amplitude[rows, cols] += self.weights*magnitude
+        self.phasor[rows, cols] += self.weights*np.exp(1j*phase)
+        self.norm[rows, cols] += self.weights
+
+    def result(self, block=256):
+        """ Blended amplitude and phase mosaics. On disk mosaics are
+        normalised in place, block rows at a time, and the phase is written
+        over the real part of the phasor file (returned as a view of it).
+        """
+        if self.filename is None:
+            norm = np.where(self.norm > 0, self.norm, 1)
+            return self.amplitude/norm, np.angle(self.phasor)
+        phase = self.phasor.view(np.float64)[:, ::2]
+        for first in range(0, self.shape[0], block):
+            rows = slice(first, first + block)
+            norm = self.norm[rows]
+            self.amplitude[rows] /= np.where(norm > 0, norm, 1)
+            phase[rows] = np.angle(self.phasor[rows])
+        self.amplitude.flush()
+        self.phasor.flush()
+        return self.amplitude, phase
+
+
+def _init_worker(settings):
+    """ Attaches the shared raw stack (or maps the on-disk one) on every
+    worker process.
+    """
+    _shared.update(settings)
+    if settings.get('stack_file') is not None:
+        _shared['stack'] = open_stack(settings['stack_file'])
+    else:
+        shm = shared_memory.SharedMemory(name=settings['shm_name'])
+        _shared['shm'] = shm
+        _shared['images'] = np.ndarray(settings['stack_shape'],
+                                       dtype=settings['stack_dtype'],
+                                       buffer=shm.buf)
+    _shared['cfg'] = dt.config_from_dict(settings['cfg_dict'])
+
+
+def _reconstruct_tile(origin, offsets=None):
+    """ Reconstructs the tile at origin from the shared (or on-disk) stack,
+    with the LED matrix offsets (xoff, yoff) given or from tile_offsets().
+    """
+    from .reconstruct import fpm_reconstruct
+
+    cfg = _shared['cfg']
+    patch_size = _shared['patch_size']
+    if 'stack' in _shared:
+        tile = _shared['stack'].crop(patch_size, origin[0], origin[1],
+                                     _shared['stack_dtype'])
+    else:
+        rows = slice(origin[0], origin[0] + patch_size[0])
+        cols = slice(origin[1], origin[1] + patch_size[1])
+        tile = SampleStack(_shared['images'][:, rows, cols],
+                           _shared['index'], normalize=False,
+                           dtype=_shared['stack_dtype'])
+    if offsets is None:
+        offsets = tile_offsets(origin, patch_size,
+                               _shared['stack_shape'][1:], cfg)
+    xoff, yoff = offsets
+    plan = ReconstructionPlan(cfg, _shared['kdsc'], patch_size[0],
+                              _shared['hrshape'], xoff, yoff)
+    magnitude, phase = fpm_reconstruct(tile, _shared['hrshape'], None,
+                                       _shared['pupil_radius'],
+                                       _shared['kdsc'], cfg, plan=plan,
+                                       precision=_shared['precision'])
+    return origin, magnitude, phase
+
+
+def _run_tiles(settings=None, origins=None, workers=None, mosaic=None,
+               upsampling=None):
+    """ Reconstructs the tiles in a process pool, keeping at most two tiles
+    per worker in flight, and blends them into the mosaic.
+    """
+    pending = list(origins)[::-1]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(settings,)) as pool:
+        running = set()
+        while pending or running:
+            while pending and len(running) < 2*workers:
+                running.add(pool.submit(_reconstruct_tile, pending.pop()))
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                origin, magnitude, phase = future.result()
+                print('Tile at (%d, %d) done' % tuple(origin))
+                mosaic.add([upsampling*o for o in origin], magnitude, phase)
+
+
+def reconstruct_tiled(samples=None, cfg=None, kdsc=None, pupil_radius=None,
+                      upsampling=None, overlap=32, patch_size=None,
+                      workers=None, precision=None, mosaic_file=None):
+    """ Full-field reconstruction by overlapping tiles in a process pool.
+
+    Args:
+    -----
+        samples: the full frame samples as a SampleStack (legacy
+                 dictionaries are converted), or an on-disk MappedStack (or
+                 its file name), read tile by tile by the workers.
+        cfg: configuration (named tuple)
+        kdsc: conversion factor from relative k to discrete spectrum pixels,
+              for the tile size.
+        pupil_radius: radius of the pupil in pixels, for the tile size.
+        upsampling: integer ratio between high and low resolution pixels.
+        overlap: low resolution pixels shared by neighbouring tiles.
+        patch_size: [rows, cols] of every tile, cfg.patch_size by default.
+        workers: number of processes, every core by default.
+        precision: 'double' or 'single', see fpm_reconstruct().
+        mosaic_file: if given, the mosaic is accumulated in memory mapped
+                     files next to it (see TileMosaic).
+
+    Returns:
+    --------
+        (ndarray) The blended high resolution modulus and phase.
+    """
+    if isinstance(samples, str):
+        samples = open_stack(samples)
+    if not isinstance(samples, MappedStack):
+        samples = as_stack(samples, cfg)
+    if patch_size is None:
+        patch_size = [int(p) for p in cfg.patch_size]
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    upsampling = int(upsampling)
+    hrshape = [upsampling*patch_size[0], upsampling*patch_size[1]]
+    sensor_shape = samples.shape[1:]
+    origins = tile_grid(sensor_shape, patch_size, overlap)
+    mosaic = TileMosaic([upsampling*s for s in sensor_shape], hrshape,
+                        upsampling*overlap/2., mosaic_file)
+    settings = {'stack_shape': samples.shape, 'index': samples.index,
+                'cfg_dict': cfg._asdict(), 'patch_size': patch_size,
+                'hrshape': hrshape, 'kdsc': kdsc,
+                'pupil_radius': pupil_radius, 'precision': precision}
+
+    if isinstance(samples, MappedStack):
+        settings.update(stack_file=samples.filename,
+                        stack_dtype=np.dtype(np.float32))
+        _run_tiles(settings, origins, workers, mosaic, upsampling)
+        return mosaic.result()
+
+    images = samples.images
+    shm = shared_memory.SharedMemory(create=True, size=images.nbytes)
+    try:
+        shared_images = np.ndarray(images.shape, dtype=images.dtype,
+                                   buffer=shm.buf)
+        shared_images[:] = images
+        settings.update(shm_name=shm.name, stack_dtype=images.dtype)
+        _run_tiles(settings, origins, workers, mosaic, upsampling)
+        del shared_images
+    finally:
+        shm.close()
+        shm.unlink()
+    return mosaic.result()
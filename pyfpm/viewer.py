@@ -0,0 +1,151 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" File viewer.py
+
+Last update: 17/10/2026
+
+Description:
+Live view of a running reconstruction. The solver hands snapshots to a
+separate rendering process through a bounded queue: when the queue is full
+the snapshot is dropped, so the solver never waits on the plots. Snapshots
+are only taken at the capped frame rate and are downsampled before the
+transfer; the displayed image comes from the central part of the spectrum,
+so no full size inverse FFT is needed.
+
+Usage:
+    viewer = LiveViewer(max_fps=5)
+    for ...:
+        if viewer.due():
+            viewer.submit(spectrum_snapshot(spectrum, sample))
+    viewer.close()
+"""
+__version__ = "1.1.1"
+__author__ = 'Juan M. Bujjamer'
+__all__ = ['LiveViewer', 'spectrum_snapshot']
+
+import multiprocessing
+import queue
+import time
+
+import numpy as np
+
+from .fftbackend import ifft2, ifftshift
+
+
+def spectrum_snapshot(spectrum=None, sample=None, size=256):
+    """ Downsampled view of a reconstruction.
+
+    Args:
+    -----
+        spectrum: centered high resolution spectrum.
+        sample: last low resolution sample used (optional).
+        size: maximum side of the images sent to the viewer.
+
+    Returns:
+    --------
+        (dict) float32 images: log spectrum, magnitude, phase and sample.
+    """
+    rows, cols = np.shape(spectrum)
+    # Magnitude and phase from the central (low frequency) part of the
+    # spectrum: a size x size inverse FFT instead of the full one
+    crop_rows, crop_cols = min(rows, size), min(cols, size)
+    r0, c0 = (rows - crop_rows)//2, (cols - crop_cols)//2
+    field = ifft2(ifftshift(spectrum[r0:r0+crop_rows, c0:c0+crop_cols]))
+    step = max(1, max(rows, cols)//size)
+    snapshot = {'spectrum': np.log10(np.abs(spectrum[::step, ::step]) + 1),
+                'magnitude': np.abs(field), 'phase': np.angle(field)}
+    if sample is not None:
+        step = max(1, max(np.shape(sample))//size)
+        snapshot['sample'] = np.asarray(sample)[::step, ::step]
+    return dict((key, image.astype(np.float32))
+                for key, image in snapshot.items())
+
+
+def _render(snapshots, max_fps):
+    """ Rendering loop, run on the viewer process.
+    """
+    import matplotlib.pyplot as plt
+
+    fig, axes = plt.subplots(2, 2, figsize=(12, 9))
+    titles = [('spectrum', 'Reconstructed FFT'),
+              ('magnitude', 'Reconstructed magnitude'),
+              ('sample', 'Acquired image'),
+              ('phase', 'Reconstructed phase')]
+    artists = dict()
+    plt.show(block=False)
+    while True:
+        try:
+            snapshot = snapshots.get(timeout=1./max_fps)
+        except queue.Empty:
+            plt.pause(1./max_fps)  # keeps the window responsive
+            continue
+        if snapshot is None:
+            break
+        for ax, (key, title) in zip(axes.ravel(), titles):
+            if key not in snapshot:
+                continue
+            image = snapshot[key]
+            if key in artists and artists[key].get_array().shape == image.shape:
+                artists[key].set_data(image)
+                artists[key].autoscale()
+            else:
+                ax.cla()
+                artists[key] = ax.imshow(image,
+                                         cmap=plt.get_cmap('gray'))
+                ax.set_title(title)
+        fig.canvas.draw_idle()
+        plt.pause(1./max_fps)
+    plt.close(fig)
+
+
+class LiveViewer(object):
+    """ Non blocking, frame rate capped viewer for the reconstruction.
+
+    Args:
+    -----
+        max_fps: maximum number of snapshots per second.
+        size: maximum side of the transferred images.
+        queue_size: snapshots waiting to be drawn before new ones are
+                    dropped.
+    """
+    def __init__(self, max_fps=5, size=256, queue_size=2):
+        self.max_fps = float(max_fps)
+        self.size = int(size)
+        self.dropped = 0
+        self.sent = 0
+        self._last = 0.
+        self._snapshots = multiprocessing.Queue(queue_size)
+        self._process = multiprocessing.Process(
+            target=_render, args=(self._snapshots, self.max_fps), daemon=True)
+        self._process.start()
+
+    def due(self):
+        """ True if a new snapshot is allowed by the frame rate cap. Check it
+        before building the snapshot, to skip its cost too.
+        """
+        return time.time() - self._last >= 1./self.max_fps
+
+    def submit(self, snapshot):
+        """ Sends a snapshot (see spectrum_snapshot()) without waiting. It is
+        dropped if the viewer is still busy with the previous ones.
+        """
+        self._last = time.time()
+        try:
+            self._snapshots.put_nowait(snapshot)
+            self.sent += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """ Stops the viewer process.
+        """
+        try:
+            self._snapshots.put_nowait(None)
+        except queue.Full:
+            self._process.terminate()
+        self._process.join(timeout=1.)
+        if self._process.is_alive():
+            self._process.terminate()
+        # Snapshots never drawn must not block the interpreter exit
+        self._snapshots.cancel_join_thread()
+        self._snapshots.close()
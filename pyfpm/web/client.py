@@ -7,6 +7,7 @@
 import requests
 
 from ..local import BaseClient
+from .. import coordtrans as ct
 
 
 class Client(BaseClient):
@@ -34,6 +35,28 @@ class Client(BaseClient):
         else:
             print("Failed to load webpage")
 
+    def acquire_pattern(self, pattern, power=255, color='G', shutter_speed=100, iso=100):
+        """ Exposure with every (nx, ny) LED of pattern lit at once.
+        """
+        response = requests.get(self.url +
+                                '/acquire_pattern/%s/%d/%s/%d/%d' % (ct.encode_pattern(pattern),
+                                power, color, shutter_speed, iso),
+                                stream=True)
+        if response.status_code == 200:
+            return response.raw
+        else:
+            print("Failed to load webpage")
+
+    def set_pattern(self, pattern, power=255, color='G'):
+        response = requests.get(self.url +
+                                '/set_pattern/%s/%d/%s' % (ct.encode_pattern(pattern),
+                                power, color),
+                                stream=True)
+        if response.status_code == 200:
+            return response.raw
+        else:
+            print("Failed to load webpage")
+
     def acquire(self, theta, phi, shift=0, power=100, color='green', shutter_speed=100, iso=100):
         response = requests.get(self.url +
                                 '/acquire/%d/%d/%d/%d/%s/%d/%d' % (theta, phi, shift, power, color,
@@ -18,6 +18,7 @@ import yaml
 from flask import Flask, Response, render_template, request
 
 from .. import local
+from .. import coordtrans as ct
 
 FOLDER = os.path.abspath(os.path.dirname(__file__))
 
@@ -156,6 +157,26 @@ def create_server(client):
             print("An error")
             pass
 
+    @app.route("/acquire_pattern/<pattern>/<power>/<color>/<shutter_speed>/<iso>")
+    def acquire_pattern(pattern, power, color, shutter_speed, iso):
+        try:
+            return Response(client.acquire_pattern(
+                                ct.decode_pattern(pattern), power, color,
+                                shutter_speed, iso),
+                            mimetype='image/png')
+        except socket.error:
+            print("An error")
+            pass
+
+    @app.route("/set_pattern/<pattern>/<power>/<color>")
+    def set_pattern(pattern, power, color):
+        try:
+            return Response(client.set_pattern(ct.decode_pattern(pattern),
+                                               power, color))
+        except socket.error:
+            print("An error")
+            pass
+
 
     # @app.route("/acquire/<theta>/<phi>/<shift>/<power>/<color>/<shutter_speed>/<iso>")
     # def acquire_async(theta, phi, shift, power, color, shutter_speed, iso):
@@ -0,0 +1,67 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" File benchmark_batch.py
+
+Last update: 17/10/2026
+Compares the sequential engine (fpm_reconstruct) with the batched parallel
+update one (fpm_reconstruct_batch, with and without momentum) on noiseless
+simulated samples. For every engine the time per pass, the error after some
+passes and the passes (and time) needed to reach a target error are
+reported. The FFT backend and its threads can be given to see how both
+engines scale with multithreaded FFTs.
+
+Usage:
+    python benchmark_batch.py [backend] [workers] [target error]
+"""
+import sys
+
+import numpy as np
+
+import pyfpm.data as dt
+import pyfpm.fpmmath as fpmm
+from pyfpm.convergence import StoppingRule
+from pyfpm.plan import ReconstructionPlan
+from pyfpm.reconstruct import (fpm_reconstruct, fpm_reconstruct_batch,
+                               defocus_pupil)
+
+from common import LRSIZE, PUPIL_RADIUS, KDSC, correlation, load_field
+
+cfg = dt.load_config()
+lrsize, pupil_radius, kdsc = LRSIZE, PUPIL_RADIUS, KDSC
+n_pass = 100
+backend = sys.argv[1] if len(sys.argv) > 1 else 'numpy'
+workers = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+target = float(sys.argv[3]) if len(sys.argv) > 3 else 1E-4
+cfg = cfg._replace(fft_backend=backend, fft_workers=workers)
+engines = [('sequential', fpm_reconstruct, {}),
+           ('batch', fpm_reconstruct_batch, {'momentum': 0.}),
+           ('batch momentum', fpm_reconstruct_batch, {})]
+
+plan = ReconstructionPlan(cfg, kdsc, lrsize, None, pupil_radius=pupil_radius)
+pupil = defocus_pupil(lrsize, pupil_radius, -.35E-6, cfg)
+field = load_field(cfg, plan.hrshape)
+samples = fpmm.simulate_stack(field, plan, pupil)
+
+results = list()
+for name, engine, options in engines:
+    result = engine(samples, plan.hrshape, pupil_radius=pupil_radius,
+                    kdsc=kdsc, cfg=cfg, plan=plan, pupil=pupil,
+                    stopping=StoppingRule(n_pass), **options)
+    results.append((name, result, correlation(result.modulus, np.abs(field))))
+
+print('\n%d LEDs, %s FFTs with %d workers, target error %.0e' %
+      (len(plan), backend, workers, target))
+print('%-16s %9s %10s %10s %10s %8s %8s %8s' %
+      ('engine', 'pass', 'error@10', 'error@30', 'final', 'passes', 'time',
+       'corr'))
+for name, result, corr in results:
+    per_pass = np.median(np.diff(np.concatenate([[0], result.times])))
+    reached = np.flatnonzero(result.errors <= target)
+    if len(reached):
+        passes = '%d' % (reached[0] + 1)
+        elapsed = '%.2fs' % result.times[reached[0]]
+    else:
+        passes, elapsed = '>%d' % n_pass, '-'
+    print('%-16s %7.1fms %10.3e %10.3e %10.3e %8s %8s %8.4f' %
+          (name, 1E3*per_pass, result.errors[9], result.errors[29],
+           result.errors[-1], passes, elapsed, corr))
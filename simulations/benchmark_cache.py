@@ -0,0 +1,65 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" File benchmark_cache.py
+
+Last update: 17/10/2026
+Times reconstruct.preprocess_images() without the preprocessing cache, on
+a miss and on a hit (see cache.py), checks the cached stack is the same
+and that a different crop is a miss, and fills a small cache to show the
+least recently used entries being evicted.
+
+Usage:
+    python benchmark_cache.py [sensor size]
+"""
+import sys
+import time
+import tempfile
+
+import numpy as np
+
+import pyfpm.coordtrans as ct
+import pyfpm.data as dt
+from pyfpm.cache import PreprocessCache
+from pyfpm.reconstruct import preprocess_images
+from pyfpm.stack import SampleStack, INDEX_DTYPE
+
+cfg = dt.load_config()
+sensor = int(sys.argv[1]) if len(sys.argv) > 1 else 512
+rng = np.random.RandomState(0)
+iterator = list(ct.set_iterator(cfg))
+index = np.zeros(len(iterator), dtype=INDEX_DTYPE)
+for n, it in enumerate(iterator):
+    iso, shutter_speed, led_power = it['acqpars']
+    index[n] = (it['indexes'][0], it['indexes'][1], iso, shutter_speed,
+                led_power)
+shape = (len(index), sensor, sensor)
+samples = SampleStack(rng.uniform(50, 200, shape), index, normalize=False)
+backgrounds = SampleStack(rng.uniform(100, 120, shape), index,
+                          normalize=False)
+cache = PreprocessCache(tempfile.mkdtemp(), max_size=2048)
+
+
+def timed(**kwargs):
+    start_time = time.time()
+    stack = preprocess_images(samples, backgrounds, 0, 0, cfg, **kwargs)
+    return stack, time.time() - start_time
+
+
+reference, elapsed = timed(cache=False)
+print('no cache: %.3f s' % elapsed)
+stack, elapsed = timed(cache=cache)
+print('miss:     %.3f s' % elapsed)
+stack, elapsed = timed(cache=cache)
+print('hit:      %.3f s, max difference %g'
+      % (elapsed, np.max(np.abs(stack.images - reference.images))))
+key = cache.key(samples, backgrounds, 0, 0, cfg)
+print('other crop is a miss:', cache.get(cache.key(samples, backgrounds, 8, 0,
+                                                   cfg)) is None)
+
+entry_size = cache.entries()[0][1]
+cache.max_bytes = int(2.5*entry_size)
+for xoff in [8, 16]:
+    preprocess_images(samples, backgrounds, xoff, 0, cfg, cache=cache)
+    time.sleep(.05)
+print('entries after 3 runs with room for 2:', len(cache.entries()),
+      '(first one evicted: %s)' % (cache.get(key) is None))
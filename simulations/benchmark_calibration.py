@@ -0,0 +1,75 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" File benchmark_calibration.py
+
+Last update: 17/10/2026
+Simulates samples with a misplaced LED matrix (shifted, rotated and at a
+different height than the configuration says) and reconstructs them with
+the ideal geometry, with and without the in-loop LED calibration
+(calibration.py). The fitted matrix model, the calibration steps, the
+final error, the time and the correlation with the simulated magnitude are
+reported (the phase carries the ramp of the global shift ambiguity, see
+calibration.py).
+
+Usage:
+    python benchmark_calibration.py [sx (mm)] [sy (mm)] [rotation (deg)]
+                                    [height (mm)]
+"""
+import sys
+import copy
+import time
+
+import numpy as np
+
+import pyfpm.data as dt
+import pyfpm.fpmmath as fpmm
+from pyfpm.calibration import LedCalibration, matrix_krels
+from pyfpm.convergence import StoppingRule
+from pyfpm.plan import ReconstructionPlan
+from pyfpm.reconstruct import fpm_reconstruct, defocus_pupil
+
+from common import LRSIZE, PUPIL_RADIUS, KDSC, correlation, load_field
+
+cfg = dt.load_config()
+lrsize, pupil_radius, kdsc = LRSIZE, PUPIL_RADIUS, KDSC
+n_pass = 20
+arguments = [float(a) for a in sys.argv[1:5]]
+true_params = arguments + [1.5, -1., 2., .9*float(cfg.sample_height)][
+    len(arguments):]
+true_params[2] = np.radians(true_params[2])
+
+
+plan = ReconstructionPlan(cfg, kdsc, lrsize, None, pupil_radius=pupil_radius)
+plan = ReconstructionPlan(cfg, kdsc, lrsize,
+                          [s + 8 for s in plan.hrshape])
+true_plan = copy.copy(plan)
+true_plan.krels = matrix_krels(true_params,
+                               np.array(plan.keys, dtype=np.float64), cfg)
+true_plan.compute_windows()
+print('Ideal vs true windows: %.2f px rms' % np.sqrt(np.mean(
+    (plan.kyl - true_plan.kyl)**2 + (plan.kxl - true_plan.kxl)**2)))
+pupil = defocus_pupil(lrsize, pupil_radius, -.35E-6, cfg)
+field = load_field(cfg, plan.hrshape)
+samples = fpmm.simulate_stack(field, true_plan, pupil)
+
+print('\n%-12s %6s %10s %7s %8s %s' % ('run', 'steps', 'final', 'time',
+                                        'mag', 'model [sx, sy, deg, h]'))
+print('%-12s %35s %s' % ('true', '', np.round(
+    [true_params[0], true_params[1], np.degrees(true_params[2]),
+     true_params[3]], 2)))
+for name, every in [('ideal', 0), ('calibrated', 1)]:
+    start_time = time.time()
+    result = fpm_reconstruct(samples, plan.hrshape, None, pupil_radius, kdsc,
+                             cfg, plan=plan, pupil=pupil,
+                             stopping=StoppingRule(n_pass),
+                             calibration=LedCalibration(every, cfg=cfg))
+    elapsed = time.time() - start_time
+    model = result.metadata.get('led_calibration')
+    steps, fitted = 0, ''
+    if model is not None:
+        steps = model['steps']
+        fitted = np.round(model['shift'] + [model['rotation'],
+                                            model['height']], 2)
+    print('%-12s %6d %10.3e %6.2fs %8.4f %s' % (
+        name, steps, result.errors[-1], elapsed,
+        correlation(result.modulus, np.abs(field)), fitted))
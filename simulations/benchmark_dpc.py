@@ -0,0 +1,76 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" File benchmark_dpc.py
+
+Last update: 17/10/2026
+Compares the reconstruction from a flat object with the one started from
+the closed form DPC estimate (reconstruct.dpc_init) on simulated samples.
+The DPC time, the correlation of the initial and final phases with the
+simulated one and the passes each start needs to reach a given error are
+reported.
+
+Usage:
+    python benchmark_dpc.py [phase range (rad)] [noise level]
+"""
+import sys
+import time
+
+import numpy as np
+
+import pyfpm.data as dt
+import pyfpm.fpmmath as fpmm
+from pyfpm.convergence import StoppingRule
+from pyfpm.plan import ReconstructionPlan
+from pyfpm.reconstruct import fpm_reconstruct, defocus_pupil, dpc_init
+from pyfpm.fftbackend import ifft2, ifftshift
+
+from common import LRSIZE, PUPIL_RADIUS, KDSC, load_field
+
+cfg = dt.load_config()
+lrsize, pupil_radius, kdsc = LRSIZE, PUPIL_RADIUS, KDSC
+n_pass = 20
+phase_range = float(sys.argv[1]) if len(sys.argv) > 1 else 1.
+noise = float(sys.argv[2]) if len(sys.argv) > 2 else 0.
+
+
+def phase_correlation(phase, reference):
+    return np.corrcoef(phase.ravel(), reference.ravel())[0, 1]
+
+
+def passes_to(errors, target):
+    reached = np.flatnonzero(np.asarray(errors) <= target)
+    return reached[0] + 1 if len(reached) else None
+
+
+plan = ReconstructionPlan(cfg, kdsc, lrsize, None, pupil_radius=pupil_radius)
+pupil = defocus_pupil(lrsize, pupil_radius, -.35E-6, cfg)
+field = load_field(cfg, plan.hrshape, mag_range=(.5, 1.),
+                   phase_range=phase_range)
+samples = fpmm.simulate_stack(field, plan, pupil, noise)
+reference = np.angle(field)
+
+start_time = time.time()
+spectrum = dpc_init(samples, pupil_radius, kdsc, cfg, plan=plan, pupil=pupil)
+dpc_time = time.time() - start_time
+initial = ifft2(ifftshift(spectrum))
+print('DPC estimate in %.1f ms, phase correlation %.4f'
+      % (1E3*dpc_time, phase_correlation(np.angle(initial), reference)))
+
+results = dict()
+for name, start in [('flat', None), ('dpc', spectrum)]:
+    start_time = time.time()
+    results[name] = fpm_reconstruct(samples, plan.hrshape, None,
+                                    pupil_radius, kdsc, cfg, plan=plan,
+                                    pupil=pupil, spectrum=start,
+                                    stopping=StoppingRule(n_pass))
+    results[name].elapsed = time.time() - start_time
+
+print('\n%-6s %10s %10s %8s %s' % ('start', 'error(1)', 'final', 'phase',
+                                   'passes to reach error'))
+targets = [1E-2, 3E-3, 1E-3, 3E-4]
+for name, result in results.items():
+    print('%-6s %10.3e %10.3e %8.4f %s' % (
+        name, result.errors[0], result.errors[-1],
+        phase_correlation(result.phase, reference),
+        ' '.join('%.0e:%s' % (target, passes_to(result.errors, target))
+                 for target in targets)))
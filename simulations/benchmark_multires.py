@@ -0,0 +1,74 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" File benchmark_multires.py
+
+Last update: 17/10/2026
+Compares a single stage reconstruction with coarse to fine schedules
+(multires.coarse_to_fine) on simulated samples with multiplicative noise.
+The illumination spans a wider range of spectrum pixels than in the other
+benchmarks (a larger kdsc), so the grid of the full LED set is much larger
+than the one the bright field LEDs need. For every schedule the LED updates
+run, the stage grids, the final error (of the full LED set), the run time
+and the correlation of the reconstructed magnitude with the simulated one
+are reported. Per stage timings are printed as the stages finish.
+
+Usage:
+    python benchmark_multires.py [noise level]
+"""
+import sys
+import time
+
+import numpy as np
+
+import pyfpm.data as dt
+import pyfpm.fpmmath as fpmm
+from pyfpm.convergence import StoppingRule
+from pyfpm.multires import coarse_to_fine
+from pyfpm.plan import ReconstructionPlan
+from pyfpm.reconstruct import fpm_reconstruct, defocus_pupil
+
+from common import LRSIZE, PUPIL_RADIUS, KDSC, correlation, load_field
+
+cfg = dt.load_config()
+lrsize, pupil_radius = LRSIZE, PUPIL_RADIUS
+# Outer LEDs about three pupil radii away, the bright field ones fit on a
+# grid about half the size of the full one
+kdsc = 2.5*KDSC
+n_pass = 20
+noise = float(sys.argv[1]) if len(sys.argv) > 1 else 0.05
+schedules = [None, [[1, 5], [None, 15]], [[1, 3], [2, 5], [None, 12]],
+             [[2, 10], [None, 10]]]
+
+
+plan = ReconstructionPlan(cfg, kdsc, lrsize, None, pupil_radius=pupil_radius)
+field = load_field(cfg, plan.hrshape)
+samples = fpmm.simulate_stack(field, plan,
+                               defocus_pupil(lrsize, pupil_radius, -.35E-6,
+                                             cfg), noise)
+
+results = list()
+for stages in schedules:
+    start_time = time.time()
+    if stages is None:
+        result = fpm_reconstruct(samples, plan.hrshape, None, pupil_radius,
+                                 kdsc, cfg, plan=plan,
+                                 stopping=StoppingRule(n_pass))
+        updates = n_pass*len(plan)
+        grids = [plan.hrshape[0]]
+    else:
+        result = coarse_to_fine(samples, pupil_radius, kdsc, cfg,
+                                stages=stages, plan=plan)
+        updates = sum(stage['leds']*stage['iterations']
+                      for stage in result.metadata['stages'])
+        grids = [stage['hrshape'][0] for stage in result.metadata['stages']]
+    elapsed = time.time() - start_time
+    results.append((stages, updates, grids, result.errors[-1], elapsed,
+                    correlation(result.modulus, np.abs(field))))
+
+print('\nFull grid %s, %d LEDs' % (plan.hrshape, len(plan)))
+print('%-32s %8s %12s %10s %8s %8s' % ('schedule', 'updates', 'grids',
+                                       'final', 'time', 'corr'))
+for stages, updates, grids, error, elapsed, corr in results:
+    print('%-32s %8d %12s %10.3e %7.2fs %8.4f' %
+          (str(stages), updates, '/'.join(str(g) for g in grids), error,
+           elapsed, corr))
@@ -0,0 +1,61 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" File benchmark_ordering.py
+
+Last update: 17/10/2026
+Compares the LED update orderings of fpm_reconstruct (plan, energy, radial
+and random, see ordering.py) on simulated samples with multiplicative
+noise. For every ordering the error after some passes, the passes needed to
+get within 5% of the best final error, the run time and the correlation of
+the reconstructed magnitude with the simulated one are reported.
+
+Usage:
+    python benchmark_ordering.py [noise level] [update rule]
+"""
+import sys
+import time
+
+import numpy as np
+
+import pyfpm.data as dt
+import pyfpm.fpmmath as fpmm
+from pyfpm.convergence import StoppingRule
+from pyfpm.plan import ReconstructionPlan
+from pyfpm.reconstruct import fpm_reconstruct, defocus_pupil
+
+from common import LRSIZE, PUPIL_RADIUS, KDSC, correlation, load_field
+
+cfg = dt.load_config()
+lrsize, pupil_radius, kdsc = LRSIZE, PUPIL_RADIUS, KDSC
+hrshape = (3*lrsize, 3*lrsize)
+n_pass = 30
+noise = float(sys.argv[1]) if len(sys.argv) > 1 else 0.05
+method = sys.argv[2] if len(sys.argv) > 2 else 'gs'
+orderings = ['plan', 'energy', 'radial', 'random']
+
+
+plan = ReconstructionPlan(cfg, kdsc, lrsize, hrshape)
+field = load_field(cfg, hrshape)
+samples = fpmm.simulate_stack(field, plan,
+                               defocus_pupil(lrsize, pupil_radius, -.35E-6,
+                                             cfg), noise)
+
+results = list()
+for ordering in orderings:
+    start_time = time.time()
+    result = fpm_reconstruct(samples, hrshape, None, pupil_radius, kdsc, cfg,
+                             plan=plan, stopping=StoppingRule(n_pass),
+                             method=method, ordering=ordering)
+    elapsed = time.time() - start_time
+    results.append((ordering, result, elapsed,
+                    correlation(result.modulus, np.abs(field))))
+
+target = 1.05*min(result.errors[-1] for _, result, _, _ in results)
+print('\n%-14s %10s %10s %10s %8s %8s %8s' %
+      ('ordering', 'error@5', 'error@10', 'final', 'passes', 'time', 'corr'))
+for ordering, result, elapsed, corr in results:
+    reached = np.flatnonzero(result.errors <= target)
+    passes = '%d' % (reached[0] + 1) if len(reached) else '>%d' % n_pass
+    print('%-14s %10.3e %10.3e %10.3e %8s %7.2fs %8.4f' %
+          (ordering, result.errors[4], result.errors[9], result.errors[-1],
+           passes, elapsed, corr))
@@ -0,0 +1,73 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" File benchmark_solvers.py
+
+Last update: 17/10/2026
+Compares the update rules of fpm_reconstruct (gs, gauss_newton, momentum and
+adam, with their default steps) on a sample GS converges slowly on: a
+noiseless pure phase object spanning 2 pi with a dense LED spectrum overlap
+(kdsc 120) and a defocused pupil. For every rule the passes needed to reach
+some target errors, the final error, the run time and the rms error of the
+reconstructed phase (up to a global phase) are reported. On samples GS
+already converges in a few passes (e.g. kdsc 60) adam needs more passes
+than GS.
+
+Usage:
+    python benchmark_solvers.py [kdsc] [passes]
+"""
+import sys
+import time
+
+import numpy as np
+
+import pyfpm.data as dt
+import pyfpm.fpmmath as fpmm
+from pyfpm.convergence import StoppingRule
+from pyfpm.plan import ReconstructionPlan
+from pyfpm.reconstruct import fpm_reconstruct, defocus_pupil
+
+from common import LRSIZE, PUPIL_RADIUS, load_field
+
+cfg = dt.load_config()
+lrsize, pupil_radius = LRSIZE, PUPIL_RADIUS
+kdsc = int(sys.argv[1]) if len(sys.argv) > 1 else 120
+n_pass = int(sys.argv[2]) if len(sys.argv) > 2 else 60
+targets = (1E-2, 1E-3, 1E-4)
+methods = ['gs', 'gauss_newton', 'momentum', 'adam']
+
+plan = ReconstructionPlan(cfg, kdsc, lrsize, None, pupil_radius=pupil_radius)
+field = load_field(cfg, plan.hrshape, mag_range=(1, 1), phase_range=2*np.pi)
+pupil = defocus_pupil(lrsize, pupil_radius, -.35E-6, cfg)
+samples = fpmm.simulate_stack(field, plan, pupil)
+
+
+def phase_error(phase, reference):
+    """ Rms of the wrapped phase difference, without its global offset.
+    """
+    difference = np.exp(1j*(phase - reference))
+    difference *= np.exp(-1j*np.angle(difference.mean()))
+    return np.sqrt(np.mean(np.angle(difference)**2))
+
+
+results = list()
+for method in methods:
+    start_time = time.time()
+    result = fpm_reconstruct(samples, plan.hrshape, None, pupil_radius, kdsc,
+                             cfg, plan=plan, pupil=pupil,
+                             stopping=StoppingRule(n_pass), method=method)
+    elapsed = time.time() - start_time
+    results.append((method, result, elapsed,
+                    phase_error(result.phase, np.angle(field))))
+
+print('\nkdsc %d, %d LEDs, %d passes' % (kdsc, len(plan), n_pass))
+print('%-14s' % 'method' + ''.join('%9s' % ('%.0e' % target)
+                                   for target in targets) +
+      '%11s %8s %10s' % ('final', 'time', 'phase rms'))
+for method, result, elapsed, phase_rms in results:
+    passes = ''
+    for target in targets:
+        reached = np.flatnonzero(result.errors <= target)
+        passes += '%9s' % ('%d' % (reached[0] + 1) if len(reached)
+                           else '>%d' % n_pass)
+    print('%-14s%s %10.3e %7.2fs %10.2e' % (method, passes, result.errors[-1],
+                                           elapsed, phase_rms))
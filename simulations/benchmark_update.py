@@ -0,0 +1,104 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" File benchmark_update.py
+
+Last update: 17/10/2026
+Measures the single LED spectrum update of the reconstruction loop: the
+original allocating expressions against the preallocated UpdateWorkspace,
+with the dense (whole window) and the sparse (pupil support) kernels.
+Time per pass and the peak of newly allocated memory (tracemalloc) are
+reported for every pass. Both give the same result with an in focus (real)
+pupil. With a defocused (complex) one the original (1-P)*W + P*Psi
+write-back diverges, while the workspace projects back through conj(P);
+the error of both after some passes is reported for that case.
+
+Usage:
+    python benchmark_update.py
+"""
+import time
+import tracemalloc
+
+import numpy as np
+
+import pyfpm.data as dt
+import pyfpm.fpmmath as fpmm
+from pyfpm.plan import ReconstructionPlan, UpdateWorkspace
+from pyfpm.reconstruct import defocus_pupil
+from pyfpm.fftbackend import fft2, ifft2, fftshift
+
+from common import LRSIZE, PUPIL_RADIUS, KDSC, load_field
+
+cfg = dt.load_config()
+lrsize, pupil_radius, kdsc = LRSIZE, PUPIL_RADIUS, KDSC
+hrshape = (3*lrsize, 3*lrsize)
+n_pass = 5
+zfocus = -.35E-6
+
+
+def legacy_update(spectrum, kyl, kxl, sample, pupil, factor):
+    kyh = kyl + lrsize
+    kxh = kxl + lrsize
+    lowResFT = factor * spectrum[kyl:kyh, kxl:kxh]*pupil
+    im_lowRes = ifft2(lowResFT)
+    im_lowRes = 1/factor * sample * np.exp(1j*np.angle(im_lowRes))
+    lowResFT = fft2(im_lowRes)*pupil
+    spectrum[kyl:kyh, kxl:kxh] = (1-pupil)*spectrum[kyl:kyh, kxl:kxh] + lowResFT
+
+
+def amplitude_error(spectrum, samples, pupil):
+    """ Relative amplitude residual of the spectrum estimate.
+    """
+    error = 0.
+    for sample, kyl, kxl in zip(samples, plan.kyl, plan.kxl):
+        window = spectrum[kyl:kyl+lrsize, kxl:kxl+lrsize]
+        error += np.sum(np.abs(sample -
+                               np.abs(ifft2(plan.factor*window*pupil))))
+    return error/np.sum(samples)
+
+
+def run(update, name, report=True):
+    spectrum = fftshift(fft2(np.ones(hrshape)))
+    for n in range(n_pass):
+        tracemalloc.start()
+        start_time = time.time()
+        for sample, kyl, kxl in zip(samples, plan.kyl, plan.kxl):
+            update(spectrum, kyl, kxl, sample)
+        elapsed = time.time() - start_time
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        if report:
+            print('%s pass %d: %.2f ms, peak allocation %.1f kB' %
+                  (name, n, 1E3*elapsed, peak/1024.))
+    return spectrum
+
+
+plan = ReconstructionPlan(cfg, kdsc, lrsize, hrshape)
+pupil = defocus_pupil(lrsize, pupil_radius, 0, cfg)
+samples = fpmm.simulate_samples(load_field(cfg, hrshape), plan, pupil)
+dense = UpdateWorkspace(plan, pupil, sparse=False)
+sparse = UpdateWorkspace(plan, pupil)
+print('Pupil support: %d of %d window pixels' %
+      (len(sparse.support_index), lrsize**2))
+
+legacy = run(lambda spectrum, kyl, kxl, sample:
+             legacy_update(spectrum, kyl, kxl, sample, pupil, plan.factor),
+             'legacy')
+inplace = run(dense.update, 'dense')
+support = run(sparse.update, 'sparse')
+print('Max relative difference: %.2e (dense), %.2e (sparse)' %
+      (np.max(np.abs(legacy-inplace))/np.max(np.abs(legacy)),
+       np.max(np.abs(legacy-support))/np.max(np.abs(legacy))))
+
+# Write-back with a defocused pupil
+pupil = defocus_pupil(lrsize, pupil_radius, zfocus, cfg)
+samples = fpmm.simulate_samples(load_field(cfg, hrshape), plan, pupil)
+workspace = UpdateWorkspace(plan, pupil)
+with np.errstate(all='ignore'):
+    legacy = run(lambda spectrum, kyl, kxl, sample:
+                 legacy_update(spectrum, kyl, kxl, sample, pupil,
+                               plan.factor), 'legacy', False)
+    conjugate = run(workspace.update, 'conjugate', False)
+    print('Defocused pupil (z = %.2e), error after %d passes: %.3e with '
+          '(1-P), %.3e with conj(P)' %
+          (zfocus, n_pass, amplitude_error(legacy, samples, pupil),
+           amplitude_error(conjugate, samples, pupil)))
@@ -0,0 +1,62 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" File common.py
+
+Last update: 17/10/2026
+Settings and test fields shared by the simulation benchmarks. The samples
+themselves are simulated with fpmmath.simulate_samples() (amplitudes) or
+fpmmath.simulate_stack() (SampleStack, optionally noisy).
+
+Usage:
+    from common import LRSIZE, PUPIL_RADIUS, KDSC, load_field
+    field = load_field(cfg, plan.hrshape)
+"""
+import os
+
+import numpy as np
+from PIL import Image
+
+import pyfpm.data as dt
+
+# Geometry of the simulated samples
+LRSIZE = 64
+PUPIL_RADIUS = 10
+KDSC = 60
+
+
+def load_image(name, shape):
+    """ Image of the home folder as a float64 array of the given shape.
+    """
+    image = Image.open(os.path.join(dt.HOME_FOLDER, name)).convert('F')
+    return np.array(image.resize(shape[::-1]), dtype=np.float64)
+
+
+def load_field(cfg, shape, mag_file=None, phase_file=None, mag_range=(0, 1),
+               phase_range=np.pi):
+    """ Complex test field from a magnitude and a phase image (the
+    configured cfg.input_mag and cfg.input_phase if not given).
+
+    Args:
+    -----
+        cfg: configuration (named tuple).
+        shape: shape of the field.
+        mag_file, phase_file: images, relative to the home folder.
+        mag_range: (low, high), the magnitude image is rescaled so its
+                   maximum maps to high and zero to low.
+        phase_range: phase of the brightest phase image pixel (in radians).
+
+    Returns:
+    --------
+        (ndarray) complex128 field.
+    """
+    mag = load_image(mag_file or cfg.input_mag, shape)
+    phase = load_image(phase_file or cfg.input_phase, shape)
+    low, high = mag_range
+    mag = low + (high - low)*mag/max(mag.max(), 1)
+    return mag*np.exp(1j*phase_range*phase/max(phase.max(), 1))
+
+
+def correlation(image, reference):
+    """ Pearson correlation of two images.
+    """
+    return np.corrcoef(image.ravel(), reference.ravel())[0, 1]
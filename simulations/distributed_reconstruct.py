@@ -0,0 +1,82 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" File distributed_reconstruct.py
+
+Last update: 17/10/2026
+Runs a coordinator/worker tiled reconstruction (pyfpm.distributed) on one
+machine: local worker processes plus an unreliable worker that connects
+over TCP, fails its first tile and dies in the middle of the second one.
+Both tiles are queued again and the mosaic is checked against the process
+pool reconstruction (tiling.reconstruct_tiled). The authentication key is
+shared through the PYFPM_AUTHKEY environment variable.
+
+Usage:
+    python distributed_reconstruct.py [sensor size] [workers]
+"""
+import os
+import sys
+import time
+import tempfile
+import multiprocessing
+
+import numpy as np
+
+import pyfpm.coordtrans as ct
+import pyfpm.data as dt
+import pyfpm.tiling as tiling
+from pyfpm.distributed import (reconstruct_distributed, run_worker,
+                               AUTHKEY_VARIABLE)
+from pyfpm.stack import StackWriter, open_stack
+
+cfg = dt.load_config()
+sensor = int(sys.argv[1]) if len(sys.argv) > 1 else 192
+workers = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+address = '127.0.0.1:50007'
+
+
+def unreliable_worker():
+    """ Worker that raises on its first tile and exits on the second.
+    """
+    calls = list()
+    reconstruct_tile = tiling._reconstruct_tile
+
+    def broken(origin, offsets=None):
+        calls.append(origin)
+        if len(calls) == 1:
+            raise IOError('Simulated read error')
+        if len(calls) == 2:
+            os._exit(1)
+        return reconstruct_tile(origin, offsets)
+    tiling._reconstruct_tile = broken
+    time.sleep(1.)
+    run_worker(address)
+
+
+if __name__ == '__main__':
+    iterator = list(ct.set_iterator(cfg))
+    rng = np.random.RandomState(0)
+    stack_file = os.path.join(tempfile.mkdtemp(), 'stack.npy')
+    with StackWriter(stack_file, len(iterator), (sensor, sensor)) as writer:
+        for it in iterator:
+            writer.add(it['indexes'],
+                       1 + .1*rng.standard_normal((sensor, sensor)),
+                       it['acqpars'])
+    stack = open_stack(stack_file)
+    settings = dict(cfg=cfg, kdsc=60, pupil_radius=10, upsampling=2,
+                    overlap=16, patch_size=[64, 64], workers=workers,
+                    precision='single')
+
+    os.environ[AUTHKEY_VARIABLE] = os.urandom(32).hex()
+    unreliable = multiprocessing.Process(target=unreliable_worker)
+    unreliable.start()
+    start_time = time.time()
+    distributed = reconstruct_distributed(stack, address=address,
+                                          lease_timeout=5., **settings)
+    print('distributed: %.2f s' % (time.time() - start_time))
+    unreliable.join()
+
+    start_time = time.time()
+    pool = tiling.reconstruct_tiled(stack, **settings)
+    print('process pool: %.2f s' % (time.time() - start_time))
+    print('max modulus difference', np.max(np.abs(distributed[0] - pool[0])))
+    print('max phase difference', np.max(np.abs(distributed[1] - pool[1])))
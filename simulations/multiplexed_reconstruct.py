@@ -0,0 +1,66 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" File multiplexed_reconstruct.py
+
+Last update: 17/10/2026
+Simulated multiplexed acquisitions: every exposure lights several LEDs of
+the matrix at once (ct.multiplex_iterator()), and fpm_reconstruct_multiplexed
+splits it among them. For each number of LEDs per exposure the number of
+exposures, the total exposure time, the final error and the correlation of
+the reconstructed magnitude with the simulated one are reported.
+
+Usage:
+    python multiplexed_reconstruct.py [max LEDs per exposure]
+"""
+import sys
+import time
+
+import numpy as np
+
+import pyfpm.coordtrans as ct
+import pyfpm.data as dt
+import pyfpm.fpmmath as fpmm
+from pyfpm.convergence import StoppingRule
+from pyfpm.plan import ReconstructionPlan
+from pyfpm.reconstruct import fpm_reconstruct_multiplexed, defocus_pupil
+
+from common import LRSIZE, PUPIL_RADIUS, KDSC, correlation, load_field
+
+cfg = dt.load_config()
+lrsize, pupil_radius, kdsc = LRSIZE, PUPIL_RADIUS, KDSC
+hrshape = (3*lrsize, 3*lrsize)
+n_pass = 30
+max_leds = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+
+
+plan = ReconstructionPlan(cfg, kdsc, lrsize, hrshape)
+field = load_field(cfg, hrshape)
+amplitudes = fpmm.simulate_samples(field, plan,
+                                   defocus_pupil(lrsize, pupil_radius,
+                                                 -.35E-6, cfg))
+positions = dict((tuple(key), n) for n, key in enumerate(plan.keys))
+
+results = list()
+for n_leds in range(1, max_leds+1):
+    samples, exposure = dict(), 0.
+    for it in ct.multiplex_iterator(cfg, n_leds):
+        rows = [positions[led] for led in it['pattern']]
+        shutter_speed = it['acqpars'][1]
+        # Incoherent sum of the LEDs lit together, as the camera records it
+        intensity = np.sum(amplitudes[rows]**2, axis=0)
+        samples[it['indexes']] = np.sqrt(intensity)*shutter_speed
+        exposure += shutter_speed
+    start_time = time.time()
+    result = fpm_reconstruct_multiplexed(samples, hrshape, pupil_radius, kdsc,
+                                         cfg, plan=plan,
+                                         stopping=StoppingRule(n_pass))
+    elapsed = time.time() - start_time
+    results.append((n_leds, len(samples), exposure, result, elapsed,
+                    correlation(result.modulus, np.abs(field))))
+
+print('\n%-6s %10s %12s %10s %8s %8s' %
+      ('leds', 'exposures', 'exposure(s)', 'error', 'time', 'corr'))
+for n_leds, exposures, exposure, result, elapsed, corr in results:
+    print('%-6d %10d %12.2f %10.3e %7.2fs %8.4f' %
+          (n_leds, exposures, exposure*1E-6, result.errors[-1], elapsed,
+           corr))
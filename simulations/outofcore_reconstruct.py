@@ -0,0 +1,73 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" File outofcore_reconstruct.py
+
+Last update: 17/10/2026
+Writes a synthetic full frame stack to disk frame by frame (StackWriter),
+reconstructs it by tiles reading only the patch of every tile from the
+memory mapped file, and checks the mosaic against the in-memory (shared
+memory) tiled reconstruction. The peak memory of the parent process is
+reported for both paths.
+
+Usage:
+    python outofcore_reconstruct.py [sensor size] [workers]
+"""
+import os
+import sys
+import time
+import resource
+import tempfile
+
+import numpy as np
+
+import pyfpm.coordtrans as ct
+import pyfpm.data as dt
+from pyfpm.stack import StackWriter, open_stack
+from pyfpm.tiling import reconstruct_tiled
+
+cfg = dt.load_config()
+sensor = int(sys.argv[1]) if len(sys.argv) > 1 else 192
+workers = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+patch_size = [64, 64]
+kdsc = 60
+pupil_radius = 10
+upsampling = 2
+
+
+def peak_memory():
+    """ Peak resident memory of this process, in MB.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.
+
+
+iterator = list(ct.set_iterator(cfg))
+rng = np.random.RandomState(0)
+outdir = tempfile.mkdtemp()
+stack_file = os.path.join(outdir, 'stack.npy')
+
+start_time = time.time()
+with StackWriter(stack_file, len(iterator), (sensor, sensor)) as writer:
+    for it in iterator:
+        frame = 1 + .1*rng.standard_normal((sensor, sensor))
+        writer.add(it['indexes'], frame, it['acqpars'])
+print('Stack of %d frames written in %.2f s (%.1f MB on disk)'
+      % (len(iterator), time.time() - start_time,
+         os.path.getsize(stack_file)/1024.**2))
+
+stack = open_stack(stack_file)
+settings = dict(cfg=cfg, kdsc=kdsc, pupil_radius=pupil_radius,
+                upsampling=upsampling, overlap=16, patch_size=patch_size,
+                workers=workers, precision='single')
+start_time = time.time()
+mapped = reconstruct_tiled(stack, mosaic_file=os.path.join(outdir,
+                                                           'mosaic.npy'),
+                           **settings)
+print('mapped:    %.2f s, peak memory %.0f MB'
+      % (time.time() - start_time, peak_memory()))
+
+start_time = time.time()
+memory = reconstruct_tiled(stack.load(), **settings)
+print('in memory: %.2f s, peak memory %.0f MB'
+      % (time.time() - start_time, peak_memory()))
+print('max modulus difference', np.max(np.abs(mapped[0] - memory[0])))
+print('max phase difference', np.max(np.abs(mapped[1] - memory[1])))
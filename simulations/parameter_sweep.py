@@ -0,0 +1,72 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" File parameter_sweep.py
+
+Last update: 17/10/2026
+Searches the focus and LED matrix offset of simulated samples with
+sweep.parameter_sweep(). The samples are simulated with a known defocus and
+xoff, and a grid of candidates around them is ranked with the common and
+the neighbour warm starts (scored by residual error) and with the common
+one scored by SSIM against the bright field sample (requires scikit-image).
+The best candidates of every sweep and its run time are reported.
+
+Usage:
+    python parameter_sweep.py [workers]
+"""
+import sys
+import time
+
+import numpy as np
+
+import pyfpm.data as dt
+import pyfpm.fpmmath as fpmm
+from pyfpm.plan import ReconstructionPlan, offset_grid_shape
+from pyfpm.reconstruct import defocus_pupil
+from pyfpm.sweep import candidate_grid, parameter_sweep, ssim
+
+from common import LRSIZE, PUPIL_RADIUS, KDSC, load_field
+
+cfg = dt.load_config()
+lrsize, pupil_radius, kdsc = LRSIZE, PUPIL_RADIUS, KDSC
+workers = int(sys.argv[1]) if len(sys.argv) > 1 else None
+# Simulated geometry, xoff steps of .35 move the outer windows about 1 px
+truth = (-.4E-6, .7, -.1)
+candidates = candidate_grid(zfocus=[-.8E-6, -.4E-6, 0.],
+                            xoff=np.arange(0., 1.45, .35), yoff=[-.1])
+hrshape = offset_grid_shape(cfg, kdsc, lrsize, pupil_radius,
+                            [(xoff, yoff) for _, xoff, yoff in candidates])
+
+zfocus, xoff, yoff = truth
+plan = ReconstructionPlan(cfg, kdsc, lrsize, hrshape, xoff, yoff)
+field = load_field(cfg, hrshape)
+samples = fpmm.simulate_stack(field, plan,
+                              defocus_pupil(lrsize, pupil_radius, zfocus,
+                                            cfg))
+brightfield = samples[(15, 15)]
+
+sweeps = [('common', 'error', None), ('neighbour', 'error', None)]
+if ssim is not None:
+    sweeps.append(('common', 'ssim', brightfield))
+else:
+    print('scikit-image not installed, skipping the SSIM scored sweep.')
+
+results = list()
+for start, scoring, reference in sweeps:
+    start_time = time.time()
+    table, best = parameter_sweep(samples, hrshape, pupil_radius, kdsc, cfg,
+                                  candidates, n_iter=5, probe_iter=2,
+                                  workers=workers, reference=reference,
+                                  start=start)
+    results.append((start, scoring, table, time.time() - start_time))
+
+print('\nTruth: z=%.2e xoff=%.2f yoff=%.2f, %d candidates on a %s grid' %
+      (truth + (len(candidates), hrshape)))
+for start, scoring, table, elapsed in results:
+    print('\n%s start, %s score (%.2fs), %d rejected' %
+          (start, scoring, elapsed, np.count_nonzero(table['rejected'])))
+    print('%10s %6s %6s %12s %12s %6s' % ('zfocus', 'xoff', 'yoff', 'score',
+                                         'error', 'start'))
+    for row in table[:3]:
+        print('%10.2e %6.2f %6.2f %12.4e %12.4e %6d' %
+              (row['zfocus'], row['xoff'], row['yoff'], row['score'],
+               row['error'], row['warm_start']))
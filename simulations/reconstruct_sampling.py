@@ -29,8 +29,8 @@ samples, sim_cfg = dt.open_sampled('outest.npy', mode='simulation')
 # Reconstruction
 start_time = time.time()
 
-hr = int(client.lhscale)*int(cfg.patch_size[0])
-rec, phase = fpm_reconstruct_wrap(samples=samples, hrshape=[hr, hr], it=iterator,
+# No hrshape: fpm_reconstruct_wrap sizes one grid for every offset it tries
+rec, phase = fpm_reconstruct_wrap(samples=samples, hrshape=None, it=iterator,
                              cfg=cfg, debug=cfg.debug, pupil_radius=client.pupil_radius,
                              kdsc=client.kdsc)
 print('--- %s seconds ---' % (time.time() - start_time))
@@ -0,0 +1,65 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" File stream_reconstruct.py
+
+Last update: 17/10/2026
+Simulated acquisition with the reconstruction running alongside it: every
+frame is used as soon as it is acquired, instead of waiting for the whole
+set to be saved. The frames follow the reconstruction geometry
+(fpmmath.simulate_samples()), are handed out in the order of
+ct.set_iterator(cfg) with a delay standing for the camera, and the
+acquired set is saved as usual at the end.
+
+Usage:
+    python stream_reconstruct.py [seconds per frame]
+"""
+import sys
+import time
+
+import numpy as np
+
+import pyfpm.coordtrans as ct
+import pyfpm.data as dt
+import pyfpm.fpmmath as fpmm
+from pyfpm.plan import ReconstructionPlan
+from pyfpm.reconstruct import defocus_pupil
+from pyfpm.streaming import StreamingReconstructor, stream_acquisition
+
+from common import LRSIZE, PUPIL_RADIUS, KDSC, correlation, load_field
+
+# Simulation parameters
+cfg = dt.load_config()
+out_file = dt.generate_out_file(fname='streamtest.npy')
+capture_delay = float(sys.argv[1]) if len(sys.argv) > 1 else 0.05
+
+plan = ReconstructionPlan(cfg, KDSC, LRSIZE, None, pupil_radius=PUPIL_RADIUS)
+pupil = defocus_pupil(LRSIZE, PUPIL_RADIUS, -.35E-6, cfg)
+field = load_field(cfg, plan.hrshape)
+amplitudes = fpmm.simulate_samples(field, plan, pupil)
+positions = dict((tuple(key), n) for n, key in enumerate(plan.keys))
+
+
+def acquire(it):
+    """ Simulated frame of an iterator element, scaled by its exposure as
+    the camera records it.
+    """
+    time.sleep(capture_delay)
+    return amplitudes[positions[tuple(it['indexes'])]]*it['acqpars'][1]
+
+
+stream = StreamingReconstructor(cfg, plan=plan, pupil=pupil)
+start_time = time.time()
+stream.start()
+image_dict = stream_acquisition(acquire, ct.set_iterator(cfg), stream)
+result = stream.join()
+print('First update after %.2f s, capture %.2f s, total %.2f s' %
+      (stream.first_update_time, stream.capture_time,
+       time.time() - start_time))
+print('Final error %.3e, correlation with the simulated magnitude %.4f' %
+      (result.errors[-1], correlation(result.modulus, np.abs(field))))
+dt.save_yaml_metadata(out_file, cfg)
+np.save(out_file, image_dict)
+if not cfg.debug:
+    import matplotlib.pylab as plt
+    plt.imshow(result.modulus), plt.gray()
+    plt.show()
@@ -0,0 +1,57 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+""" File validate_precision.py
+
+Last update: 17/10/2026
+Reports how far a single precision (complex64) reconstruction deviates from
+the double precision (complex128) one. The bundled test images are used as
+magnitude and phase of simulated samples, which are then reconstructed with
+both precisions.
+
+Usage:
+    python validate_precision.py
+"""
+import os
+import time
+
+import numpy as np
+
+import pyfpm.data as dt
+import pyfpm.fpmmath as fpmm
+from pyfpm.plan import ReconstructionPlan
+from pyfpm.reconstruct import fpm_reconstruct, defocus_pupil
+
+from common import LRSIZE, PUPIL_RADIUS, KDSC, load_field
+
+cfg = dt.load_config()
+lrsize, pupil_radius, kdsc = LRSIZE, PUPIL_RADIUS, KDSC
+hrshape = (3*lrsize, 3*lrsize)
+test_images = [('imgs/mag1.png', 'imgs/phase1.png'),
+               ('imgs/mag2.png', 'imgs/phase2.png'),
+               ('imgs/alambre.png', 'imgs/lines0_0.png'),
+               ('imgs/Image_4a_mag.png', 'imgs/Image_4a_phase.png')]
+
+
+plan = ReconstructionPlan(cfg, kdsc, lrsize, hrshape)
+pupil = defocus_pupil(lrsize, pupil_radius, -.35E-6, cfg)
+
+print('%-24s %10s %10s %10s %8s %8s' % ('image', 'max amp', 'mean amp',
+                                        'rms phase', 't f64', 't f32'))
+for mag_file, phase_file in test_images:
+    field = load_field(cfg, hrshape, mag_file, phase_file,
+                       mag_range=(.1, 1.1))
+    samples = fpmm.simulate_stack(field, plan, pupil)
+    results = dict()
+    for precision in ['double', 'single']:
+        start_time = time.time()
+        mag, phase = fpm_reconstruct(samples, hrshape, None, pupil_radius,
+                                     kdsc, cfg, plan=plan,
+                                     precision=precision)
+        results[precision] = mag, phase, time.time() - start_time
+    mag64, phase64, t64 = results['double']
+    mag32, phase32, t32 = results['single']
+    amp_dev = np.abs(mag32 - mag64)/np.max(mag64)
+    phase_dev = np.angle(np.exp(1j*(phase32 - phase64)))
+    print('%-24s %10.2e %10.2e %10.2e %8.2f %8.2f' %
+          (os.path.basename(mag_file), amp_dev.max(), amp_dev.mean(),
+           np.sqrt(np.mean(phase_dev**2)), t64, t32))